@@ -1,19 +1,68 @@
 import os
+import sys
 import json
+import numpy as np
 import pandas as pd
 import io
 import re
-from flask import Flask, request, jsonify
+import hashlib
+import pickle
+import copy
+import threading
+import queue
+import random
+import time
+import uuid
+import shutil
+import tempfile
+import contextvars
+import itertools
+import mmap
+import multiprocessing
+import importlib.util
+import gc
+import warnings
+import atexit
+import cProfile
+from flask import Blueprint, Flask, Request, Response, request, jsonify
 from flask_cors import CORS
 from dotenv import load_dotenv
 from google import genai
 from google.genai import types
+from google.genai import errors as genai_errors
+import httpx
 from datetime import datetime
+from statistics import NormalDist
+from collections import Counter, OrderedDict
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import contextmanager
+from dataclasses import dataclass, field, replace
+from pandas.errors import EmptyDataError
+from pandas.io.parsers import TextParser
+from werkzeug.exceptions import RequestEntityTooLarge
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+try:
+    import pyarrow as pa
+    import pyarrow.ipc
+    import pyarrow.parquet as pq
+except ImportError:  # columnar uploads are optional
+    pa = pq = None
+try:
+    from pandas.tseries.api import guess_datetime_format
+except ImportError:  # pandas < 2.2
+    from pandas._libs.tslibs.parsing import guess_datetime_format
 
 load_dotenv()
 
-app = Flask(__name__)
-CORS(app)
+api = Blueprint('api', __name__)  # mounted by create_app()
 
 GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
 MODEL_NAME = "gemini-2.5-flash"
@@ -34,70 +83,516 @@ def month_short(dt: pd.Timestamp) -> str:
     except Exception:
         return str(dt)
 
-def generate_context_summary(df: pd.DataFrame) -> dict:
-    summary = {}
-    df = df.rename(columns={col: sanitize_column_name(col) for col in df.columns})
+# ---------------- Instrumentation ----------------
+# Per-stage wall/CPU time and peak-RSS growth for each analysis, exported as
+# Prometheus histograms on /metrics and optionally returned with the response.
+
+STAGE_SECONDS_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+MEMORY_BYTES_BUCKETS = tuple(2 ** p * 1024 * 1024 for p in range(0, 13))  # 1 MB .. 4 GB
+ROW_BUCKETS = (100, 1_000, 10_000, 100_000, 1_000_000, 10_000_000, 100_000_000)
+
+METRICS_DIR = os.getenv("METRICS_DIR", "")  # set by gunicorn.conf.py so /metrics covers every worker
+METRICS_FLUSH_SECONDS = float(os.getenv("METRICS_FLUSH_SECONDS", "5"))
+
+def pid_alive(pid: int) -> bool:
+    try: os.kill(pid, 0)
+    except ProcessLookupError: return False
+    except OSError: pass  # exists, owned by someone else
+    return True
+
+class MetricsRegistry:
+    """Just enough of the Prometheus text format for histograms, counters and gauges.
+
+    With a `directory`, every process writes its series there each
+    METRICS_FLUSH_SECONDS (and at exit), and render() adds in the other
+    processes' files, so a scrape that lands on any worker sees the whole
+    server. Gauges only count processes that are still running.
+    """
+    def __init__(self, directory: str | None = None):
+        self.directory = directory
+        self._lock = threading.Lock()
+        self._meta = {}     # name -> (type, help, buckets)
+        self._series = {}   # name -> {labels tuple: [bucket counts..., sum, count] | value}
+        self._readers = {}  # name -> callable returning {labels tuple: value}, read at snapshot time
+        self._flusher_pid = None
+
+    def histogram(self, name: str, help_text: str, buckets: tuple):
+        self._meta[name] = ('histogram', help_text, buckets); self._series.setdefault(name, {})
+
+    def counter(self, name: str, help_text: str, read=None):
+        self._meta[name] = ('counter', help_text, None); self._series.setdefault(name, {})
+        if read is not None: self._readers[name] = read
+
+    def gauge(self, name: str, help_text: str, read):
+        self._meta[name] = ('gauge', help_text, None); self._readers[name] = read
+
+    def observe(self, name: str, value: float, **labels):
+        buckets = self._meta[name][2]
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._start_flusher()
+            series = self._series[name].setdefault(key, [0] * (len(buckets) + 2))
+            for i, bound in enumerate(buckets):
+                if value <= bound: series[i] += 1
+            series[-2] += value; series[-1] += 1
+
+    def inc(self, name: str, value: float = 1, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._start_flusher()
+            self._series[name][key] = self._series[name].get(key, 0) + value
+
+    def _snapshot(self) -> dict:
+        with self._lock:
+            snapshot = {name: dict(series) for name, series in self._series.items()}
+        for name, read in self._readers.items(): snapshot[name] = read()
+        return snapshot
+
+    def _start_flusher(self):
+        # Once per process: a forked worker starts its own
+        if not self.directory or self._flusher_pid == os.getpid(): return
+        self._flusher_pid = os.getpid()
+        threading.Thread(target=self._flush_loop, name="metrics-flush", daemon=True).start()
+        atexit.register(self._flush)
+
+    def _flush_loop(self):
+        while True:
+            time.sleep(METRICS_FLUSH_SECONDS)
+            self._flush()
+
+    def _flush(self):
+        path = os.path.join(self.directory, f"{os.getpid()}.json")
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            with open(path + '.tmp', 'w') as fh:
+                json.dump({name: list(series.items()) for name, series in self._snapshot().items()}, fh)
+            os.replace(path + '.tmp', path)
+        except OSError:
+            pass
+
+    def _merged(self) -> dict:
+        """This process's series plus the last flush of every other process."""
+        merged = self._snapshot()
+        if not self.directory or not os.path.isdir(self.directory): return merged
+        for file_name in os.listdir(self.directory):
+            pid = file_name[:-len('.json')]
+            if not file_name.endswith('.json') or not pid.isdigit() or int(pid) == os.getpid(): continue
+            try:
+                with open(os.path.join(self.directory, file_name)) as fh: snapshot = json.load(fh)
+            except (OSError, ValueError):
+                continue
+            alive = pid_alive(int(pid))
+            for name, rows in snapshot.items():
+                if name not in self._meta or (self._meta[name][0] == 'gauge' and not alive): continue
+                target = merged.setdefault(name, {})
+                for key, value in rows:
+                    key = tuple(map(tuple, key))
+                    current = target.get(key)
+                    if current is None: target[key] = value
+                    elif isinstance(value, list): target[key] = [a + b for a, b in zip(current, value)]
+                    else: target[key] = current + value
+        return merged
+
+    def render(self) -> str:
+        def fmt_labels(pairs) -> str:
+            return '{' + ','.join(f'{k}="{v}"' for k, v in pairs) + '}' if pairs else ''
+        with self._lock: self._start_flusher()
+        merged = self._merged()
+        lines = []
+        for name, (kind, help_text, buckets) in self._meta.items():
+            lines += [f"# HELP {name} {help_text}", f"# TYPE {name} {kind}"]
+            for key, series in sorted(merged.get(name, {}).items()):
+                if kind != 'histogram':
+                    lines.append(f"{name}{fmt_labels(key)} {series}"); continue
+                for bound, count in zip(buckets, series):
+                    lines.append(f"{name}_bucket{fmt_labels(key + (('le', bound),))} {count}")
+                lines.append(f"{name}_bucket{fmt_labels(key + (('le', '+Inf'),))} {series[-1]}")
+                lines.append(f"{name}_sum{fmt_labels(key)} {series[-2]}")
+                lines.append(f"{name}_count{fmt_labels(key)} {series[-1]}")
+        return '\n'.join(lines) + '\n'
+
+metrics = MetricsRegistry(METRICS_DIR or None)
+metrics.histogram('analyze_stage_seconds', 'Wall-clock time per analysis stage.', STAGE_SECONDS_BUCKETS)
+metrics.histogram('analyze_stage_cpu_seconds', 'CPU time (of the running thread) per analysis stage.', STAGE_SECONDS_BUCKETS)
+metrics.histogram('analyze_stage_peak_rss_bytes', 'Growth of the process peak RSS during a stage.', MEMORY_BYTES_BUCKETS)
+metrics.histogram('analyze_request_seconds', 'End-to-end analysis time.', STAGE_SECONDS_BUCKETS)
+metrics.histogram('analyze_input_rows', 'Rows per analyzed upload.', ROW_BUCKETS)
+metrics.histogram('analyze_input_columns', 'Columns per analyzed upload.', (5, 10, 20, 50, 100, 250, 1000))
+metrics.counter('analyze_requests_total', 'Analyses by outcome.')
+metrics.counter('analyze_llm_tokens_total', 'Gemini tokens used, by kind.')
+metrics.counter('llm_gateway_events_total', 'LLM gateway calls, cache hits, coalesced waits, retries and failures.')
+metrics.counter('analyze_batch_items_total', 'Files (or sheets) analyzed through /api/analyze/batch, by outcome.')
+
+def peak_rss_bytes() -> int:
+    if resource is None: return 0
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss if sys.platform == 'darwin' else rss * 1024  # Linux reports KiB
+
+class PipelineTrace:
+    def __init__(self):
+        self.stages = []
+        self.attrs = {}
+        self.started = time.perf_counter()
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def stage(self, name: str):
+        w0, c0, m0 = time.perf_counter(), time.thread_time(), peak_rss_bytes()
+        try:
+            yield
+        finally:
+            wall, cpu, mem = time.perf_counter() - w0, time.thread_time() - c0, max(0, peak_rss_bytes() - m0)
+            with self._lock:
+                self.stages.append({"stage": name, "wallMs": round(wall * 1000, 2), "cpuMs": round(cpu * 1000, 2),
+                                    "peakRssDeltaMb": round(mem / 1e6, 2)})
+            metrics.observe('analyze_stage_seconds', wall, stage=name)
+            metrics.observe('analyze_stage_cpu_seconds', cpu, stage=name)
+            metrics.observe('analyze_stage_peak_rss_bytes', mem, stage=name)
+
+    def set(self, **attrs):
+        with self._lock: self.attrs.update(attrs)
+
+    def finish(self, outcome: str):
+        elapsed = time.perf_counter() - self.started
+        metrics.observe('analyze_request_seconds', elapsed)
+        metrics.inc('analyze_requests_total', outcome=outcome)
+        if 'rows' in self.attrs: metrics.observe('analyze_input_rows', self.attrs['rows'])
+        if 'columns' in self.attrs: metrics.observe('analyze_input_columns', self.attrs['columns'])
+        self.attrs['totalMs'] = round(elapsed * 1000, 2)
+
+    def to_json(self) -> dict:
+        with self._lock: return {"stages": list(self.stages), **self.attrs}
+
+    def server_timing(self) -> str:
+        with self._lock:
+            return ', '.join(f'{s["stage"]};dur={s["wallMs"]}' for s in self.stages)
+
+    def summary(self) -> str:
+        with self._lock:
+            return ' '.join(f'{s["stage"]}={s["wallMs"]:.0f}ms' for s in self.stages) or 'no stages'
+
+_current_trace = contextvars.ContextVar('analysis_trace', default=None)
+
+@contextmanager
+def trace_stage(name: str):
+    """Times the block as `name` on the current request's trace, if there is one."""
+    trace = _current_trace.get()
+    if trace is None:
+        yield
+    else:
+        with trace.stage(name):
+            yield
+
+def trace_set(**attrs):
+    """Records attributes on the current request's trace, if there is one."""
+    trace = _current_trace.get()
+    if trace is not None: trace.set(**attrs)
+
+@contextmanager
+def traced(trace: PipelineTrace):
+    token = _current_trace.set(trace)
+    try:
+        yield trace
+    finally:
+        _current_trace.reset(token)
+
+def record_llm_usage(usage):
+    if usage is None: return
+    counts = {"prompt": getattr(usage, 'prompt_token_count', None), "completion": getattr(usage, 'candidates_token_count', None),
+              "total": getattr(usage, 'total_token_count', None)}
+    counts = {k: int(v) for k, v in counts.items() if v}
+    for kind, n in counts.items(): metrics.inc('analyze_llm_tokens_total', n, kind=kind)
+    trace = _current_trace.get()
+    if trace is not None and counts: trace.set(llmTokens=counts)
+
+def submit_traced(stage: str, fn, *args):
+    """compute_pool.submit that keeps the caller's trace and times `fn` as `stage`."""
+    def run():
+        with trace_stage(stage): return fn(*args)
+    return compute_pool.submit(contextvars.copy_context().run, run)
+
+PROFILING_ENABLED = os.getenv("REQUEST_PROFILING", "").lower() in ("1", "true", "yes")
+PROFILE_DIR = os.getenv("PROFILE_DIR", os.path.join(tempfile.gettempdir(), "slidesky-profiles"))
+
+@contextmanager
+def request_profiler(enabled: bool):
+    """Opt-in per-request profile (pyinstrument if installed, else cProfile).
+    Yields a dict whose 'path' is filled in once the profile is written."""
+    out = {}
+    if not enabled:
+        yield out; return
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    stem = os.path.join(PROFILE_DIR, f"{time.strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:8]}")
+    try:
+        from pyinstrument import Profiler
+    except ImportError:
+        Profiler = None
+    if Profiler is not None:
+        profiler = Profiler(); profiler.start()
+        try:
+            yield out
+        finally:
+            profiler.stop()
+            out['path'] = stem + '.html'
+            with open(out['path'], 'w') as fh: fh.write(profiler.output_html())
+    else:
+        profiler = cProfile.Profile(); profiler.enable()
+        try:
+            yield out
+        finally:
+            profiler.disable()
+            out['path'] = stem + '.prof'
+            profiler.dump_stats(out['path'])
+
+# ---------------- Ingest normalization ----------------
+# Low-cardinality text -> category and int64 -> smallest lossless int before any
+# analysis runs; groupby/value_counts get cheaper and the frame shrinks.
+# Floats stay float64: float32 would change mean/variance accumulation and
+# therefore the brief.
+
+COMPACT_CATEGORY_MAX_RATIO = float(os.getenv("COMPACT_CATEGORY_MAX_RATIO", "0.5"))
+COMPACT_ARROW_STRINGS = os.getenv("COMPACT_ARROW_STRINGS", "").lower() in ("1", "true", "yes")
+
+def _arrow_string_dtype():
+    try:
+        import pyarrow  # noqa: F401
+    except ImportError:
+        return None
+    try:
+        return pd.StringDtype("pyarrow", na_value=np.nan)
+    except TypeError:  # pandas < 2.3
+        return "string[pyarrow_numpy]"
+
+def value_counts(series: pd.Series, dropna: bool = True) -> pd.Series:
+    """Series.value_counts with ties kept in order of first appearance for every
+    dtype, so compacted (categorical) columns rank exactly like the originals."""
+    if not isinstance(series.dtype, pd.CategoricalDtype): return series.value_counts(dropna=dropna)
+    categories = series.cat.categories
+    codes = series.cat.codes.to_numpy().astype(np.intp)
+    order = pd.unique(codes)
+    if dropna: order = order[order >= 0]
+    counts = np.bincount(codes + 1, minlength=len(categories) + 1)  # slot 0 holds NaN
+    index = pd.Index([categories[c] if c >= 0 else np.nan for c in order], dtype=object)
+    return pd.Series(counts[order + 1], index=index, name='count').sort_values(ascending=False, kind='stable')
+
+def compact_frame(df: pd.DataFrame, category_max_ratio: float = COMPACT_CATEGORY_MAX_RATIO,
+                  arrow_strings: bool = COMPACT_ARROW_STRINGS) -> tuple[pd.DataFrame, dict]:
+    """Returns (compacted frame, report). Original dtype names are kept in
+    `df.attrs['source_dtypes']` so the profile still reports them."""
+    before = int(df.memory_usage(deep=True).sum())
+    if df.columns.has_duplicates: return df, {"bytesBefore": before, "bytesAfter": before, "converted": {}}
+    source_dtypes = {col: df[col].dtype.name for col in df.columns}
+    converted = {}
+    arrow_dtype = _arrow_string_dtype() if arrow_strings else None
+    rows = len(df)
+    out = {}
+    for col in df.columns:
+        s = df[col]
+        if rows and (pd.api.types.is_object_dtype(s) or pd.api.types.is_string_dtype(s)) \
+                and not isinstance(s.dtype, pd.CategoricalDtype):
+            # factorize once: gives the cardinality and the category codes in the same pass
+            try:
+                codes, uniques = pd.factorize(s, sort=True)
+            except TypeError:  # mixed types that can't be ordered
+                codes, uniques = None, None
+            if uniques is not None and len(uniques) <= rows * category_max_ratio:
+                s = pd.Series(pd.Categorical.from_codes(codes, categories=uniques), index=s.index, name=col)
+            elif arrow_dtype is not None and pd.api.types.is_object_dtype(s) and pd.api.types.infer_dtype(s, skipna=True) == 'string':
+                s = s.astype(arrow_dtype)
+        elif s.dtype.kind in 'iu' and isinstance(s.dtype, np.dtype) and s.dtype.itemsize > 1:
+            s = pd.to_numeric(s, downcast='integer' if s.dtype.kind == 'i' else 'unsigned')
+        if s.dtype != df[col].dtype: converted[col] = f"{df[col].dtype.name} -> {s.dtype.name}"
+        out[col] = s
+    compacted = pd.DataFrame(out, index=df.index)
+    compacted.columns = df.columns
+    compacted.attrs = {**df.attrs, "source_dtypes": source_dtypes}
+    after = int(compacted.memory_usage(deep=True).sum())
+    return compacted, {"bytesBefore": before, "bytesAfter": after, "converted": converted}
+
+# ---------------- Column profiling ----------------
+# One scan of the frame per upload; every helper below reads from the profile
+# instead of re-running select_dtypes / nunique / isna / value_counts / var.
+
+PROFILE_TOP_K = 10
+PROFILE_QUANTILES = (0.1, 0.5, 0.9)
+PROFILE_MAX_VALUE_COUNTS = 1000  # skip top-k on free-text columns
+
+@dataclass
+class ColumnProfile:
+    name: str
+    label: str
+    dtype: str
+    kind: str  # 'numeric' | 'categorical' | 'datetime' | 'other'
+    count: int = 0
+    nunique: int = 0
+    null_rate: float = 0.0
+    is_intish: bool = False
+    top_values: list = field(default_factory=list)  # [(value, count), ...] most frequent first
+    sum: float = 0.0
+    mean: float = float('nan')
+    var: float = float('nan')
+    std: float = float('nan')
+    min: object = None
+    max: object = None
+    quantiles: dict = field(default_factory=dict)
+
+@dataclass
+class DatasetProfile:
+    rows: int
+    columns: dict  # original column name -> ColumnProfile, in frame order
+
+    def __getitem__(self, col) -> ColumnProfile:
+        return self.columns[col]
+
+    def of_kind(self, kind: str) -> list[ColumnProfile]:
+        return [c for c in self.columns.values() if c.kind == kind]
+
+    def label(self, col) -> str:
+        return self.columns[col].label if col in self.columns else sanitize_column_name(col)
+
+def build_dataset_profile(df: pd.DataFrame, top_k: int = PROFILE_TOP_K) -> DatasetProfile:
+    numeric_cols = list(df.select_dtypes(include=['number']).columns)
+    categorical_cols = set(df.select_dtypes(include=['object', 'category']).columns)
+    rows = len(df)
+    source_dtypes = df.attrs.get('source_dtypes', {})  # set by compact_frame
+    null_rates = df.isna().mean() if rows else pd.Series(0.0, index=df.columns)
+
+    # Vectorized moments/quantiles across the whole numeric block at once
+    stats = None; quantiles = None; num_unique = None
+    if numeric_cols:
+        num = df[numeric_cols]
+        stats = num.agg(['count', 'sum', 'mean', 'var', 'std', 'min', 'max'])
+        quantiles = num.quantile(list(PROFILE_QUANTILES))
+        num_unique = num.nunique(dropna=True)
+
+    columns = {}
     for col in df.columns:
         series = df[col]
-        dtype = series.dtype.name
-        nunique = series.nunique(dropna=True)
-        if dtype in ['object', 'category'] and nunique < 20:
-            examples = series.value_counts(dropna=True).index.tolist()[:5]
+        prof = ColumnProfile(name=col, label=sanitize_column_name(col), dtype=source_dtypes.get(col, series.dtype.name), kind='other',
+                             null_rate=float(null_rates[col]))
+        if stats is not None and col in stats.columns:
+            prof.kind = 'numeric'
+            prof.count = int(stats.at['count', col]); prof.nunique = int(num_unique[col])
+            prof.is_intish = series.dtype.kind in 'iu'
+            prof.sum = float(stats.at['sum', col])
+            prof.mean = float(stats.at['mean', col]); prof.var = float(stats.at['var', col])
+            prof.std = float(stats.at['std', col])
+            prof.min = stats.at['min', col]; prof.max = stats.at['max', col]
+            prof.quantiles = {q: float(quantiles.at[q, col]) for q in PROFILE_QUANTILES}
+        elif col in categorical_cols:
+            prof.kind = 'categorical'
+            prof.count = int(series.notna().sum())
+            # value_counts gives cardinality and top-k in the same hash pass
+            counts = value_counts(series, dropna=True)
+            prof.nunique = len(counts)
+            if prof.nunique <= PROFILE_MAX_VALUE_COUNTS:
+                prof.top_values = list(counts.head(top_k).items())
+        else:
+            if pd.api.types.is_datetime64_any_dtype(series):
+                prof.kind = 'datetime'
+            prof.count = int(series.notna().sum())
+            prof.nunique = int(series.nunique(dropna=True))
+            if prof.count:
+                prof.min = series.min(); prof.max = series.max()
+        columns[col] = prof
+    pruned = df.attrs.get('pruned_profiles')  # set by attach_pruned_profiles
+    if pruned:
+        columns = {col: columns.get(col) or pruned[col] for col in df.attrs['source_columns'] if col in columns or col in pruned}
+    return DatasetProfile(rows=rows, columns=columns)
+
+def generate_context_summary(profile: DatasetProfile) -> dict:
+    summary = {}
+    for prof in profile.columns.values():
+        dtype = prof.dtype
+        if dtype in ['object', 'category'] and prof.nunique < 20:
+            examples = [v for v, _ in prof.top_values][:5]
             context = f"Categories: {', '.join(map(str, examples))}"
         elif dtype in ['int64', 'float64', 'number']:
             try:
-                mean = series.mean(); min_val = series.min(); max_val = series.max()
-                context = f"Range: {min_val:,.1f} to {max_val:,.1f} (Mean: {mean:,.1f})"
+                context = f"Range: {prof.min:,.1f} to {prof.max:,.1f} (Mean: {prof.mean:,.1f})"
             except:
                 context = "Numeric details not available"
         else:
-            context = f"Unique values: {nunique}"
-        summary[col] = { "type": dtype, "context": context }
+            context = f"Unique values: {prof.nunique}"
+        summary[prof.label] = { "type": dtype, "context": context }
     return dict(list(summary.items())[:15])
 
-def determine_key_metric(df: pd.DataFrame) -> str | None:
-    numeric_cols = df.select_dtypes(include=['number']).columns
+def determine_key_metric(profile: DatasetProfile) -> str | None:
+    numeric_cols = profile.of_kind('numeric')
     if len(numeric_cols) == 0: return None
     scores = {}
-    for col in numeric_cols:
-        series = pd.to_numeric(df[col], errors='coerce').dropna()
-        if series.empty: scores[col] = -1e9; continue
-        var = series.var() if series.var() is not None else 0.0
-        uniq_ratio = series.nunique() / max(1, len(series))
-        is_intish = series.dtype.kind in 'iu'
+    for prof in numeric_cols:
+        if prof.count == 0: scores[prof.name] = -1e9; continue
+        var = prof.var
+        uniq_ratio = prof.nunique / max(1, prof.count)
         score = var
-        if is_intish and uniq_ratio > 0.5: score *= 0.05
+        if prof.is_intish and uniq_ratio > 0.5: score *= 0.05
         if uniq_ratio < 0.9: score *= 1.2
-        scores[col] = score
+        scores[prof.name] = score
     return max(scores, key=scores.get) if scores else None
 
-def determine_key_segment(df: pd.DataFrame, max_unique=50, min_unique=2) -> str | None:
-    categorical_cols = df.select_dtypes(include=['object', 'category']).columns
+def _rank_categorical_fields(profile: DatasetProfile, max_unique: int, min_unique: int, exclude=()) -> list[str]:
     candidates = []
-    for col in categorical_cols:
-        nunique = df[col].nunique(dropna=True)
-        if min_unique <= nunique <= max_unique:
-            null_rate = df[col].isna().mean()
-            score = nunique - (null_rate * 10)
-            candidates.append((col, score))
-    if not candidates: return None
+    for prof in profile.of_kind('categorical'):
+        if prof.name in exclude: continue
+        if min_unique <= prof.nunique <= max_unique:
+            # Scoring: prioritize fields with a useful number of unique values and few nulls.
+            score = prof.nunique - (prof.null_rate * 10)
+            candidates.append((prof.name, score))
     candidates.sort(key=lambda x: x[1], reverse=True)
-    return candidates[0][0]
+    return [col for col, score in candidates]
 
-def detect_time_column(df: pd.DataFrame) -> str | None:
+def determine_key_segment(profile: DatasetProfile, max_unique=50, min_unique=2) -> str | None:
+    candidates = _rank_categorical_fields(profile, max_unique, min_unique)
+    return candidates[0] if candidates else None
+
+TIME_SAMPLE_SIZE = 200
+COMMON_DATE_FORMATS = ('%Y-%m-%d', '%Y-%m-%d %H:%M:%S', '%m/%d/%Y', '%d/%m/%Y', '%Y/%m/%d', '%m/%d/%Y %H:%M',
+                       '%d-%m-%Y', '%m-%d-%Y', '%d.%m.%Y', '%b %d, %Y', '%d %b %Y', '%Y-%m', 'ISO8601')
+def infer_datetime_formats(sample: pd.Series):
+    """Yields each explicit strftime format that parses every value in `sample`, best guess first."""
+    if sample.empty or not sample.astype(str).str.contains(r'\d').all(): return
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', UserWarning)  # "Parsing dates in %d/%m/%Y format when dayfirst=False"
+        guessed = guess_datetime_format(str(sample.iloc[0]))
+    for fmt in dict.fromkeys(c for c in (guessed, *COMMON_DATE_FORMATS) if c):
+        try:
+            pd.to_datetime(sample, format=fmt, errors='raise')
+        except (ValueError, TypeError, OverflowError):
+            continue
+        yield fmt
+
+def detect_time_axis(df: pd.DataFrame) -> tuple[str | None, pd.Series | None, str | None]:
+    """Returns (column, parsed datetimes, format) for the first date-like column without touching `df`.
+
+    Text columns are screened on a small sample first; only the winning column
+    gets one full vectorized parse with the inferred format.
+    """
     for col in df.columns:
         s = df[col]
         if pd.api.types.is_datetime64_any_dtype(s):
-            return col
-        # try parse
-        if s.dtype == object:
-            try:
-                parsed = pd.to_datetime(s, errors='raise', infer_datetime_format=True)
-                df[col] = parsed
-                return col
-            except Exception:
-                continue
-    return None
+            return col, s, None
+        is_category = isinstance(s.dtype, pd.CategoricalDtype)
+        if is_category:
+            if not (pd.api.types.is_object_dtype(s.cat.categories) or pd.api.types.is_string_dtype(s.cat.categories)): continue
+        elif not (pd.api.types.is_object_dtype(s) or pd.api.types.is_string_dtype(s)): continue
+        sample = s.iloc[:TIME_SAMPLE_SIZE * 5].dropna().iloc[:TIME_SAMPLE_SIZE]
+        if sample.empty: sample = s.dropna().iloc[:TIME_SAMPLE_SIZE]
+        # A format can fit the sample and still lose rows further down (e.g. 03/04 vs 25/04), so try the next one
+        for fmt in infer_datetime_formats(sample.astype(object)):
+            if is_category:
+                # Parse each distinct label once and expand through the codes
+                parsed_categories = pd.DatetimeIndex(pd.to_datetime(s.cat.categories, format=fmt, errors='coerce'))
+                parsed = pd.Series(parsed_categories.take(s.cat.codes.to_numpy(), allow_fill=True, fill_value=pd.NaT), index=s.index, name=col)
+            else:
+                parsed = pd.to_datetime(s, format=fmt, errors='coerce')
+            # Same rule as a strict parse: every non-null value has to be a date
+            if parsed.notna().sum() == s.notna().sum():
+                return col, parsed, fmt
+    return None, None, None
+
+def detect_time_column(df: pd.DataFrame) -> str | None:
+    return detect_time_axis(df)[0]
 
 def safe_color(i: int) -> str:
     # simple palette
@@ -112,45 +607,835 @@ def to_float(v):
     except Exception:
         return 0.0
 
+# ---------------- Aggregate sources ----------------
+# Chart/brief code asks for grouped and monthly aggregates through this small
+# interface so the same strategies run on an in-memory frame or a streamed file.
+
+class FrameAggregates:
+    """Aggregation plan over an in-memory frame.
+
+    Callers declare what they will read (`need_group`, `need_monthly`); each
+    group key is then aggregated in one fused groupby().agg() on first access,
+    the time axis is resampled once for every value column, and later lookups
+    just slice the cached results.
+
+    With `detect_time` the time axis is found by detect_time_axis on first use,
+    so a shared instance only pays for it if someone reads the monthly series.
+    Lookups are locked: the brief, the charts and the template share one instance.
+    """
+    def __init__(self, df: pd.DataFrame, time_col: str | None = None, time_values: pd.Series | None = None,
+                 detect_time: bool = False):
+        self.df = df
+        # Parsed once by detect_time_axis; only re-parse if the caller didn't hand it over
+        if time_col and time_values is None:
+            time_values = pd.to_datetime(df[time_col], errors='coerce')
+        self._time = None if detect_time and time_col is None else (time_col, time_values)
+        self._lock = threading.RLock()
+        self._group_needs = {}    # key -> value columns
+        self._monthly_needs = []
+        self._groups = {}
+        self._counts = {}
+        self._monthly = None
+
+    def _time_axis(self) -> tuple[str | None, pd.Series | None]:
+        with self._lock:
+            if self._time is None:
+                with trace_stage('time_axis'):
+                    self._time = detect_time_axis(self.df)[:2]
+            return self._time
+
+    @property
+    def time_col(self) -> str | None:
+        return self._time_axis()[0]
+
+    @property
+    def time_values(self) -> pd.Series | None:
+        return self._time_axis()[1]
+
+    def need_group(self, key: str, *values: str):
+        with self._lock:
+            needs = self._group_needs.setdefault(key, [])
+            needs.extend(v for v in values if v not in needs)
+        return self
+
+    def need_monthly(self, *values: str):
+        with self._lock:
+            self._monthly_needs.extend(v for v in values if v not in self._monthly_needs)
+        return self
+
+    def group_stats(self, key: str, value: str) -> pd.DataFrame:
+        """sum/count of `value` per `key` (NaN kept as its own group)."""
+        with self._lock:
+            grouped = self._groups.get(key)
+            if grouped is None or (value, 'sum') not in grouped.columns:
+                cols = self.need_group(key, value)._group_needs[key]
+                grouped = self._groups[key] = self.df.groupby(key, dropna=False)[cols].agg(['sum', 'count'])
+        sums = grouped[(value, 'sum')]
+        # Widen downcast sums back to 64-bit: numpy breaks sort ties differently per dtype
+        sums = sums.astype(np.result_type(sums.dtype, np.int64))
+        return pd.DataFrame({'sum': sums, 'count': grouped[(value, 'count')]})
+
+    def value_counts(self, key: str) -> pd.Series:
+        with self._lock:
+            if key not in self._counts:
+                self._counts[key] = value_counts(self.df[key], dropna=False)
+            return self._counts[key]
+
+    def monthly(self, value: str) -> pd.DataFrame | None:
+        """sum/count of `value` per calendar month (month-start index, gaps filled)."""
+        time_col, time_values = self._time_axis()
+        if not time_col: return None
+        with self._lock:
+            if self._monthly is None or (value, 'sum') not in self._monthly.columns:
+                cols = self.need_monthly(value)._monthly_needs
+                mask = time_values.notna().to_numpy()
+                block = self.df.loc[mask, cols]
+                block.index = pd.DatetimeIndex(time_values.to_numpy()[mask])
+                self._monthly = block.resample('MS').agg(['sum', 'count'])
+            by_month = self._monthly
+        monthly = pd.DataFrame({'sum': by_month[(value, 'sum')], 'count': by_month[(value, 'count')]})
+        # Trim to the months where this value actually has data, like a per-column resample would
+        present = np.flatnonzero(monthly['count'].to_numpy() > 0)
+        if len(present) == 0: return None
+        return monthly.iloc[present[0]:present[-1] + 1]
+
+def aggregate_source(df) -> "FrameAggregates | StreamingDataset | SampledDataset":
+    """The aggregates the brief, charts and template slides read from."""
+    if isinstance(df, (StreamingDataset, SampledDataset)): return df
+    return FrameAggregates(df, detect_time=True)
+
+# ---------------- Streaming ingestion ----------------
+# Large CSVs are read in chunks and folded into mergeable accumulators, so the
+# raw file and the full frame never have to sit in memory together.
+
+INGEST_CHUNK_ROWS = int(os.getenv("INGEST_CHUNK_ROWS", "200000"))
+STREAMING_THRESHOLD_MB = float(os.getenv("STREAMING_THRESHOLD_MB", "100"))
+EXACT_DISTINCT_LIMIT = 10_000  # switch to HyperLogLog above this
+GROUP_TRACK_MAX_UNIQUE = 50    # matches determine_key_segment's max_unique
+
+class HyperLogLog:
+    def __init__(self, p: int = 14):
+        self.p = p
+        self.registers = np.zeros(1 << p, dtype=np.uint8)
+
+    @staticmethod
+    def hash_values(values: pd.Series) -> np.ndarray:
+        return pd.util.hash_pandas_object(values, index=False).to_numpy(dtype=np.uint64)
+
+    def add(self, values: pd.Series):
+        h = self.hash_values(values)
+        if len(h) == 0: return
+        p = np.uint64(self.p)
+        idx = (h >> (np.uint64(64) - p)).astype(np.intp)
+        w = (h << p) | (np.uint64(1) << (p - np.uint64(1)))  # guard bit keeps rank bounded
+        rank = np.ones(len(w), dtype=np.uint8)
+        for shift in (32, 16, 8, 4, 2, 1):
+            mask = w < (np.uint64(1) << np.uint64(64 - shift))
+            rank[mask] += shift
+            w = np.where(mask, w << np.uint64(shift), w)
+        np.maximum.at(self.registers, idx, rank)
+
+    def merge(self, other: "HyperLogLog"):
+        np.maximum(self.registers, other.registers, out=self.registers)
+
+    def count(self) -> int:
+        m = len(self.registers)
+        estimate = (0.7213 / (1 + 1.079 / m)) * m * m / np.sum(np.ldexp(1.0, -self.registers.astype(np.int64)))
+        zeros = int(np.count_nonzero(self.registers == 0))
+        if estimate <= 2.5 * m and zeros:
+            estimate = m * np.log(m / zeros)  # linear counting for small cardinalities
+        return int(round(estimate))
+
+class DistinctCounter:
+    """Exact distinct count up to `limit` values, HyperLogLog estimate beyond."""
+    def __init__(self, limit: int = EXACT_DISTINCT_LIMIT):
+        self.limit = limit
+        self.values = set()
+        self.hll = None
+
+    def add(self, series: pd.Series):
+        series = series.dropna()
+        if self.hll is not None:
+            self.hll.add(series); return
+        self.values.update(series.unique().tolist())
+        if len(self.values) > self.limit:
+            self.hll = HyperLogLog()
+            self.hll.add(pd.Series(list(self.values), dtype=series.dtype))
+            self.values = set()
+
+    @property
+    def exact(self) -> bool:
+        return self.hll is None
+
+    def count(self) -> int:
+        return len(self.values) if self.hll is None else self.hll.count()
+
+class QuantileSketch:
+    """Merging t-digest: centroids sized by the arcsine scale function, so the tails stay sharp."""
+    def __init__(self, compression: int = 500):
+        self.compression = compression
+        self.means = np.empty(0)
+        self.weights = np.empty(0)
+        self.min = np.inf
+        self.max = -np.inf
+
+    def add(self, values: np.ndarray):
+        values = np.asarray(values, dtype=float)
+        values = values[~np.isnan(values)]
+        if len(values) == 0: return
+        self.min = min(self.min, float(values.min())); self.max = max(self.max, float(values.max()))
+        self._compress(np.concatenate([self.means, values]), np.concatenate([self.weights, np.ones(len(values))]))
+
+    def merge(self, other: "QuantileSketch"):
+        if len(other.means) == 0: return
+        self.min = min(self.min, other.min); self.max = max(self.max, other.max)
+        self._compress(np.concatenate([self.means, other.means]), np.concatenate([self.weights, other.weights]))
+
+    def _compress(self, means: np.ndarray, weights: np.ndarray):
+        order = np.argsort(means, kind='mergesort')
+        means, weights = means[order], weights[order]
+        total = weights.sum()
+        q_mid = (np.cumsum(weights) - weights / 2) / total
+        k = self.compression / (2 * np.pi) * np.arcsin(np.clip(2 * q_mid - 1, -1, 1))
+        bucket = np.floor(k - k.min()).astype(np.intp)
+        w = np.bincount(bucket, weights)
+        m = np.bincount(bucket, weights * means)
+        keep = w > 0
+        self.weights = w[keep]
+        self.means = m[keep] / self.weights
+
+    @property
+    def count(self) -> float:
+        return float(self.weights.sum())
+
+    def quantile(self, q: float) -> float:
+        total = self.count
+        if total == 0: return float('nan')
+        mids = np.cumsum(self.weights) - self.weights / 2
+        xs = np.concatenate([[0.0], mids, [total]])
+        ys = np.concatenate([[self.min], self.means, [self.max]])
+        # Same positioning as pandas' linear interpolation: q * (n - 1) on 0-based ranks
+        return float(np.interp(q * (total - 1) + 0.5, xs, ys))
+
+class MomentAccumulator:
+    """Count/sum/mean/variance/min/max merged with Chan's parallel Welford update."""
+    def __init__(self):
+        self.count = 0; self.sum = 0.0; self.mean = 0.0; self.m2 = 0.0
+        self.min = None; self.max = None
+
+    def add_stats(self, count: int, total: float, mean: float, var: float, min_val, max_val):
+        if count == 0: return
+        m2 = var * (count - 1) if count > 1 else 0.0
+        n = self.count + count
+        delta = mean - self.mean
+        self.mean += delta * count / n
+        self.m2 += m2 + delta * delta * self.count * count / n
+        self.count = n
+        self.sum += total
+        self.min = min_val if self.min is None else min(self.min, min_val)
+        self.max = max_val if self.max is None else max(self.max, max_val)
+
+    def merge(self, other: "MomentAccumulator"):
+        if other.count == 0: return
+        var = other.m2 / (other.count - 1) if other.count > 1 else 0.0
+        self.add_stats(other.count, other.sum, other.mean, var, other.min, other.max)
+
+    @property
+    def var(self) -> float:
+        return self.m2 / (self.count - 1) if self.count > 1 else float('nan')
+
+def _add_frames(prev: pd.DataFrame | None, new: pd.DataFrame) -> pd.DataFrame:
+    return new if prev is None else prev.add(new, fill_value=0)
+
+class StreamingDataset:
+    """Online profile + aggregates for a CSV read chunk by chunk.
+
+    Exposes the same `group_stats` / `value_counts` / `monthly` interface as
+    FrameAggregates so the brief and chart strategies can run on it directly.
+    Quantiles come from a t-digest and large cardinalities from HyperLogLog,
+    so those figures are approximate; everything else is exact.
+    """
+    def __init__(self):
+        self.rows = 0
+        self.columns = None   # column order from the first chunk
+        self.kinds = {}
+        self.dtypes = {}
+        self.time_col = None
+        self.time_format = None
+        self.nulls = {}
+        self.moments = {}
+        self.sketches = {}
+        self.distinct = {}
+        self.counts = {}      # categorical: value -> count while exact
+        self.groups = {}      # categorical key -> (numeric col, sum|count) frame
+        self.months = None
+        self._profile = None
+
+    @property
+    def empty(self) -> bool:
+        return self.rows == 0
+
+    @property
+    def numeric_cols(self) -> list[str]:
+        return [c for c in self.columns if self.kinds[c] == 'numeric']
+
+    def _init_columns(self, chunk: pd.DataFrame):
+        self.columns = list(chunk.columns)
+        numeric = set(chunk.select_dtypes(include=['number']).columns)
+        categorical = set(chunk.select_dtypes(include=['object', 'category']).columns)
+        for col in self.columns:
+            s = chunk[col]
+            if col in numeric: kind = 'numeric'
+            elif col in categorical: kind = 'categorical'
+            elif pd.api.types.is_datetime64_any_dtype(s): kind = 'datetime'
+            else: kind = 'other'
+            self.kinds[col] = kind
+            self.dtypes[col] = s.dtype
+            self.nulls[col] = 0
+            self.distinct[col] = DistinctCounter()
+            if kind == 'numeric':
+                self.moments[col] = MomentAccumulator(); self.sketches[col] = QuantileSketch()
+            elif kind == 'categorical':
+                self.counts[col] = {}
+                self.groups[col] = None
+        # Detect on the first chunk only; later chunks reuse the inferred format
+        self.time_col, _, self.time_format = detect_time_axis(chunk)
+
+    def add_chunk(self, chunk: pd.DataFrame):
+        if self.columns is None: self._init_columns(chunk)
+        chunk = chunk.reindex(columns=self.columns)
+        self._profile = None
+        self.rows += len(chunk)
+        for col, n in chunk.isna().sum().items():
+            self.nulls[col] += int(n)
+
+        num_cols = self.numeric_cols
+        for col in num_cols:
+            if not pd.api.types.is_numeric_dtype(chunk[col]):
+                chunk[col] = pd.to_numeric(chunk[col], errors='coerce')
+            self.dtypes[col] = np.result_type(self.dtypes[col], chunk[col].dtype)
+        if num_cols:
+            block = chunk[num_cols]
+            stats = block.agg(['count', 'sum', 'mean', 'var', 'min', 'max'])
+            for col in num_cols:
+                self.moments[col].add_stats(int(stats.at['count', col]), float(stats.at['sum', col]),
+                                            float(stats.at['mean', col]), float(stats.at['var', col]) if stats.at['count', col] > 1 else 0.0,
+                                            stats.at['min', col], stats.at['max', col])
+                self.sketches[col].add(block[col].to_numpy(dtype=float, na_value=np.nan))
+                self.distinct[col].add(block[col].astype(float))
+
+        for col, counts in self.counts.items():
+            if counts is None: continue
+            for value, n in chunk[col].value_counts(dropna=True, sort=False).items():
+                counts[value] = counts.get(value, 0) + int(n)
+            if len(counts) > EXACT_DISTINCT_LIMIT:
+                self.distinct[col].add(pd.Series(list(counts.keys()), dtype=object))
+                self.counts[col] = None
+            if self.counts[col] is None or len(counts) > GROUP_TRACK_MAX_UNIQUE:
+                self.groups.pop(col, None)
+            elif num_cols:
+                grouped = chunk.groupby(col, dropna=False, sort=False)[num_cols].agg(['sum', 'count'])
+                self.groups[col] = _add_frames(self.groups[col], grouped)
+        for col, kind in self.kinds.items():
+            if kind == 'categorical' and self.counts[col] is None:
+                self.distinct[col].add(chunk[col].astype(object))
+            elif kind in ('datetime', 'other'):
+                self.distinct[col].add(chunk[col])
+
+        if self.time_col and num_cols:
+            t = chunk[self.time_col]
+            if not pd.api.types.is_datetime64_any_dtype(t):
+                t = pd.to_datetime(t, format=self.time_format, errors='coerce')
+            month = t.dt.to_period('M').dt.to_timestamp()
+            monthly = chunk[num_cols].groupby(month).agg(['sum', 'count'])
+            self.months = _add_frames(self.months, monthly)
+
+    @property
+    def profile(self) -> DatasetProfile:
+        if self._profile is None: self._profile = self._build_profile()
+        return self._profile
+
+    def _build_profile(self, top_k: int = PROFILE_TOP_K) -> DatasetProfile:
+        columns = {}
+        for col in self.columns or []:
+            kind = self.kinds[col]
+            prof = ColumnProfile(name=col, label=sanitize_column_name(col), dtype=np.dtype(self.dtypes[col]).name if kind == 'numeric' else self.dtypes[col].name,
+                                 kind=kind, count=self.rows - self.nulls[col],
+                                 null_rate=self.nulls[col] / self.rows if self.rows else 0.0)
+            if kind == 'numeric':
+                mom, sketch = self.moments[col], self.sketches[col]
+                prof.is_intish = np.dtype(self.dtypes[col]).kind in 'iu'
+                prof.nunique = self.distinct[col].count()
+                prof.sum = mom.sum
+                prof.mean = mom.mean if mom.count else float('nan')
+                prof.var = mom.var; prof.std = float(np.sqrt(prof.var))
+                prof.min, prof.max = mom.min, mom.max
+                prof.quantiles = {q: sketch.quantile(q) for q in PROFILE_QUANTILES}
+            elif kind == 'categorical' and self.counts[col] is not None:
+                counts = self.counts[col]
+                prof.nunique = len(counts)
+                if prof.nunique <= PROFILE_MAX_VALUE_COUNTS:
+                    prof.top_values = sorted(counts.items(), key=lambda kv: -kv[1])[:top_k]
+            else:
+                prof.nunique = self.distinct[col].count()
+            columns[col] = prof
+        return DatasetProfile(rows=self.rows, columns=columns)
+
+    # --- aggregate interface (see FrameAggregates) ---
+    # Everything is already accumulated while streaming, so declarations are no-ops
+    def need_group(self, key: str, *values: str):
+        return self
+
+    def need_monthly(self, *values: str):
+        return self
+
+    def group_stats(self, key: str, value: str) -> pd.DataFrame:
+        grouped = self.groups.get(key)
+        if grouped is None: raise KeyError(f"No streamed aggregates for '{key}'")
+        out = pd.DataFrame({'sum': grouped[(value, 'sum')], 'count': grouped[(value, 'count')].astype('int64')})
+        return out.sort_index(na_position='last')
+
+    def value_counts(self, key: str) -> pd.Series:
+        counts = self.counts.get(key) or {}
+        items = list(counts.items())
+        if self.nulls.get(key): items.append((np.nan, self.nulls[key]))
+        items.sort(key=lambda kv: -kv[1])
+        return pd.Series([n for _, n in items], index=[v for v, _ in items], dtype='int64', name='count')
+
+    def monthly(self, value: str) -> pd.DataFrame | None:
+        if self.months is None: return None
+        m = self.months[[(value, 'sum'), (value, 'count')]]
+        m.columns = ['sum', 'count']
+        m = m[m['count'] > 0]
+        if m.empty: return None
+        full = pd.date_range(m.index.min(), m.index.max(), freq='MS')
+        return m.reindex(full, fill_value=0).astype({'count': 'int64'})
+
+def read_csv_streaming(buffer, chunk_rows: int = INGEST_CHUNK_ROWS, **read_kwargs) -> StreamingDataset:
+    dataset = StreamingDataset()
+    for chunk in pd.read_csv(buffer, chunksize=chunk_rows, **read_kwargs):
+        dataset.add_chunk(chunk)
+    return dataset
+
+def upload_size(stream) -> int:
+    try:
+        pos = stream.tell(); stream.seek(0, os.SEEK_END)
+        size = stream.tell(); stream.seek(pos)
+        return size
+    except Exception:
+        return 0
+
+# ---------------- File ingestion (Excel, Parquet, Arrow) ----------------
+# A header-plus-sample read decides which columns are worth materializing;
+# free-text / ID columns are then left out of the full read and keep a
+# profile scaled up from the sample.
+
+INGEST_SAMPLE_ROWS = int(os.getenv("INGEST_SAMPLE_ROWS", "1000"))
+PRUNE_MIN_COUNT = 100      # need this many sampled values before calling a column free text
+PRUNE_DISTINCT_RATIO = 0.9
+
+def prunable_columns(head: pd.DataFrame) -> dict:
+    """Columns of the sample that only ever show up as 'Unique values: N' in the brief."""
+    if head.columns.has_duplicates: return {}
+    profile = build_dataset_profile(head)
+    time_col, _, _ = detect_time_axis(head)
+    return {col: prof for col, prof in profile.columns.items()
+            if prof.kind == 'categorical' and col != time_col and prof.count >= PRUNE_MIN_COUNT
+            and prof.nunique >= prof.count * PRUNE_DISTINCT_RATIO}
+
+def attach_pruned_profiles(df: pd.DataFrame, head: pd.DataFrame, pruned: dict) -> pd.DataFrame:
+    scale = len(df) / len(head)
+    for prof in pruned.values():
+        prof.count = round(prof.count * scale); prof.nunique = min(prof.count, round(prof.nunique * scale))
+        if prof.nunique > PROFILE_MAX_VALUE_COUNTS: prof.top_values = []
+    # build_dataset_profile splices these back in at their original position
+    df.attrs.update(pruned_profiles=pruned, source_columns=list(head.columns))
+    return df
+
+# The workbook is opened once. calamine parses in Rust; the openpyxl fallback
+# reads values only, in one pass, dropping pruned cells row by row so the full
+# sheet is never held as cell objects.
+
+EXCEL_ENGINE = os.getenv("EXCEL_ENGINE", "auto")  # auto | calamine | openpyxl | xlrd
+
+def excel_engine(ext: str) -> str:
+    """calamine when python-calamine is installed, else openpyxl (xlrd for .xls)."""
+    if EXCEL_ENGINE != 'auto': return EXCEL_ENGINE
+    if importlib.util.find_spec('python_calamine') is not None: return 'calamine'
+    return 'xlrd' if ext == 'xls' else 'openpyxl'
+
+def _excel_row(values, error_codes) -> list:
+    """Cell values as pandas' openpyxl reader converts them, trailing blanks trimmed."""
+    row = []
+    for v in values:
+        if v is None: v = ""
+        elif type(v) is float and v.is_integer(): v = int(v)
+        elif type(v) is str and v in error_codes: v = np.nan
+        row.append(v)
+    while row and row[-1] == "": row.pop()
+    return row
+
+def _excel_rows_frame(data: list) -> pd.DataFrame:
+    while data and not data[-1]: data.pop()  # trailing empty rows
+    if not data: return pd.DataFrame()
+    width = max(len(row) for row in data)
+    data = [row + [""] * (width - len(row)) if len(row) < width else row for row in data]
+    try:
+        return TextParser(data, header=0, skip_blank_lines=False).read()
+    except EmptyDataError:
+        return pd.DataFrame()
+
+def _read_openpyxl_sheet(ws, prune: bool):
+    """Returns (frame, header sample, pruned profiles)."""
+    from openpyxl.cell.cell import ERROR_CODES  # openpyxl is optional; only this reader needs it
+    ws.reset_dimensions()  # read-only sheets can carry a stale dimension
+    rows = ws.iter_rows(values_only=True)
+    data = [_excel_row(r, ERROR_CODES) for r in itertools.islice(rows, INGEST_SAMPLE_ROWS + 1)]
+    head = _excel_rows_frame(list(data))
+    if len(head) < INGEST_SAMPLE_ROWS: return head, head, {}
+    pruned = prunable_columns(head) if prune else {}
+    if not pruned:
+        data.extend(_excel_row(r, ERROR_CODES) for r in rows)
+        return _excel_rows_frame(data), head, {}
+    keep = [i for i, col in enumerate(head.columns) if col not in pruned]
+    def select(row): return [row[i] if i < len(row) else "" for i in keep]
+    data = [select(row) for row in data]
+    data.extend(select(_excel_row(r, ERROR_CODES)) for r in rows)
+    df = _excel_rows_frame(data)
+    # TextParser renumbers blank headers ('Unnamed: N') by their new position; keep the sheet's names
+    if len(df.columns) == len(keep): df.columns = [head.columns[i] for i in keep]
+    return df, head, pruned
+
+def read_excel_sheet(book: pd.ExcelFile, sheet, prune: bool = True) -> pd.DataFrame:
+    if book.engine == 'openpyxl':
+        df, head, pruned = _read_openpyxl_sheet(book.book[sheet], prune)
+    else:
+        head = book.parse(sheet, nrows=INGEST_SAMPLE_ROWS)
+        if len(head) < INGEST_SAMPLE_ROWS: return head  # the sample was the whole sheet
+        pruned = prunable_columns(head) if prune else {}
+        df = book.parse(sheet, usecols=[i for i, col in enumerate(head.columns) if col not in pruned]) if pruned else book.parse(sheet)
+    return attach_pruned_profiles(df, head, pruned) if pruned else df
+
+def read_excel_upload(buffer, ext: str, sheet: str | None = None, prune: bool = True) -> pd.DataFrame:
+    """First sheet by default; `sheet` picks one by name or index, 'all' stacks
+    every sheet that shares the first sheet's header (with a Sheet column)."""
+    try:
+        book = pd.ExcelFile(buffer, engine=excel_engine(ext))
+    except ImportError as e:
+        raise AnalysisError(f"Reading .{ext} files is not supported on this server ({e}).", 415)
+    with book:
+        names = book.sheet_names
+        if not sheet:
+            return read_excel_sheet(book, names[0], prune)
+        if sheet.lower() != 'all':
+            if sheet in names: return read_excel_sheet(book, sheet, prune)
+            if sheet.isdigit() and int(sheet) < len(names): return read_excel_sheet(book, names[int(sheet)], prune)
+            raise AnalysisError(f"Sheet '{sheet}' not found. Available sheets: {', '.join(names)}")
+        frames = {name: read_excel_sheet(book, name, prune=False) for name in names}
+    first = frames[names[0]]
+    stacked = {name: f for name, f in frames.items() if list(f.columns) == list(first.columns)}
+    skipped = [name for name in names if name not in stacked]
+    if skipped: trace_set(skippedSheets=skipped)
+    if len(stacked) == 1: return first
+    sheet_col = 'Sheet' if 'Sheet' not in first.columns else 'Source Sheet'
+    return pd.concat([f.assign(**{sheet_col: name}) for name, f in stacked.items()], ignore_index=True)
+
+# Parquet / Arrow IPC / Feather: the upload is mapped into memory (or wrapped,
+# if it is still an in-memory buffer) and read zero-copy with column
+# projection; types come from the schema, so there is no inference pass.
+
+COLUMNAR_EXTENSIONS = ('parquet', 'arrow', 'feather')
+
+def arrow_buffer(stream):
+    """Zero-copy pyarrow buffer over an upload: an mmap when it has a file on disk."""
+    if isinstance(stream, io.BytesIO): return pa.py_buffer(stream.getbuffer())
+    try:
+        fileno = stream.fileno()  # a SpooledTemporaryFile rolls over to disk here
+    except (AttributeError, OSError, io.UnsupportedOperation):
+        stream.seek(0); return pa.py_buffer(stream.read())
+    stream.flush()
+    if os.fstat(fileno).st_size == 0: return pa.py_buffer(b'')
+    return pa.py_buffer(mmap.mmap(fileno, 0, access=mmap.ACCESS_READ))
+
+def read_columnar_upload(stream, ext: str, prune: bool = True) -> pd.DataFrame:
+    if pa is None:
+        raise AnalysisError(f"Reading .{ext} files needs pyarrow, which is not installed on this server.", 415)
+    buffer = arrow_buffer(stream)
+    try:
+        if ext == 'parquet':
+            source = pq.ParquetFile(pa.BufferReader(buffer))
+            head = next(source.iter_batches(batch_size=INGEST_SAMPLE_ROWS), None)
+            if head is None: return source.schema_arrow.empty_table().to_pandas()
+            read = lambda columns: source.read(columns=columns)
+        else:
+            try:
+                reader = pa.ipc.open_file(buffer)
+            except pa.ArrowInvalid:  # IPC stream format rather than file format
+                table = pa.ipc.open_stream(buffer).read_all()
+                head, read = table.slice(0, INGEST_SAMPLE_ROWS), table.select
+            else:
+                if reader.num_record_batches == 0: return reader.schema.empty_table().to_pandas()
+                head = reader.get_batch(0).slice(0, INGEST_SAMPLE_ROWS)
+                def read(columns):
+                    # Only the projected fields get decoded (and decompressed)
+                    fields = [reader.schema.get_field_index(c) for c in columns]
+                    return pa.ipc.open_file(buffer, options=pa.ipc.IpcReadOptions(included_fields=fields)).read_all()
+        head = head.to_pandas()
+        pruned = prunable_columns(head) if prune and len(head) >= INGEST_SAMPLE_ROWS else {}
+        df = read([c for c in head.columns if c not in pruned]).to_pandas()
+    except (pa.ArrowInvalid, OSError) as e:
+        raise AnalysisError(f"Could not read the .{ext} file: {e}")
+    return attach_pruned_profiles(df, head, pruned) if pruned else df
+
+# ---------------- Sampling ----------------
+# Above SAMPLING_THRESHOLD_ROWS the brief and charts run on a stratified sample
+# (stratified on the key segment so small groups survive) and the brief
+# reports confidence intervals, so time-to-deck stops growing with the input.
+
+SAMPLING_THRESHOLD_ROWS = int(os.getenv("SAMPLING_THRESHOLD_ROWS", "5000000"))  # 0 disables auto sampling
+SAMPLE_ROWS = int(os.getenv("SAMPLE_ROWS", "250000"))
+SAMPLE_MIN_PER_STRATUM = int(os.getenv("SAMPLE_MIN_PER_STRATUM", "2000"))
+SAMPLE_CONFIDENCE = float(os.getenv("SAMPLE_CONFIDENCE", "0.95"))
+SAMPLE_PILOT_ROWS = 50_000  # rows profiled to pick the stratification column
+SAMPLE_SEED = 0             # fixed so a re-upload gets the same deck
+
+def weighted_quantile(values: np.ndarray, weights: np.ndarray, q: float) -> float:
+    if len(values) == 0: return float('nan')
+    order = np.argsort(values, kind='stable')
+    values, weights = values[order], weights[order]
+    cum = np.cumsum(weights)
+    # Midpoint rule: each value sits at the centre of its weight
+    return float(np.interp(q, (cum - weights / 2) / cum[-1], values))
+
+def should_sample(rows: int, mode: str | None) -> bool:
+    if mode == 'sample': return True
+    return mode not in ('exact', 'stream') and SAMPLING_THRESHOLD_ROWS > 0 and rows > SAMPLING_THRESHOLD_ROWS
+
+def estimate_csv_rows(stream) -> int:
+    """Newline count (minus the header); quoted line breaks make it an upper bound."""
+    stream.seek(0)
+    lines = sum(block.count(b'\n') for block in iter(lambda: stream.read(1 << 24), b''))
+    stream.seek(0)
+    return max(0, lines - 1)
+
+def choose_strata_column(df: pd.DataFrame) -> str | None:
+    pilot = df if len(df) <= SAMPLE_PILOT_ROWS else df.sample(n=SAMPLE_PILOT_ROWS, random_state=SAMPLE_SEED)
+    return determine_key_segment(build_dataset_profile(pilot))
+
+class StratifiedSampler:
+    """Mergeable stratified sample, built chunk by chunk.
+
+    Every row gets a uniform random key. A row is kept while its key is among
+    the `size` smallest overall or the `min_per_stratum` smallest of its
+    stratum, so each stratum ends up with a simple random sample of itself
+    and rare groups are never sampled away.
+    """
+    def __init__(self, strata_col: str | None = None, size: int = SAMPLE_ROWS,
+                 min_per_stratum: int = SAMPLE_MIN_PER_STRATUM, seed: int = SAMPLE_SEED):
+        self.strata_col = strata_col
+        self.size = size
+        self.min_per_stratum = min_per_stratum
+        self.rows = 0
+        self.strata_sizes = None  # stratum value -> population rows
+        self._rng = np.random.default_rng(seed)
+        self._kept = None
+        self._keys = np.empty(0)
+
+    def add(self, chunk: pd.DataFrame):
+        self.rows += len(chunk)
+        keys = self._rng.random(len(chunk))
+        if self.strata_col is not None:
+            counts = chunk[self.strata_col].value_counts(dropna=False, sort=False)
+            self.strata_sizes = counts if self.strata_sizes is None else self.strata_sizes.add(counts, fill_value=0)
+        frame = chunk if self._kept is None else pd.concat([self._kept, chunk], ignore_index=True)
+        keys = np.concatenate([self._keys, keys])
+        if len(frame) > self.size:
+            keep = np.zeros(len(frame), dtype=bool)
+            keep[np.argpartition(keys, self.size - 1)[:self.size]] = True
+            if self.strata_col is not None and self.min_per_stratum > 0:
+                codes, _ = pd.factorize(frame[self.strata_col], use_na_sentinel=False)
+                keep |= (pd.Series(keys).groupby(codes).rank(method='first') <= self.min_per_stratum).to_numpy()
+            frame, keys = frame[keep], keys[keep]
+        self._kept, self._keys = frame.reset_index(drop=True), keys
+
+    def result(self) -> "SampledDataset":
+        sample = self._kept if self._kept is not None else pd.DataFrame()
+        if self.strata_col is None or self.strata_sizes is None:
+            codes = np.zeros(len(sample), dtype=np.intp)
+            strata_sizes = np.array([float(self.rows)])
+        else:
+            codes = self.strata_sizes.index.get_indexer(sample[self.strata_col])
+            strata_sizes = self.strata_sizes.to_numpy(dtype=float)
+        sample_sizes = np.bincount(codes, minlength=len(strata_sizes)).astype(float)
+        return SampledDataset(sample, self.rows, self.strata_col, codes, strata_sizes, sample_sizes)
+
+def sample_frame(df: pd.DataFrame, size: int = SAMPLE_ROWS) -> "SampledDataset":
+    sampler = StratifiedSampler(choose_strata_column(df), size)
+    sampler.add(df)
+    return sampler.result()
+
+def read_csv_sampled(buffer, chunk_rows: int = INGEST_CHUNK_ROWS, **read_kwargs) -> "SampledDataset":
+    sampler = None
+    for chunk in pd.read_csv(buffer, chunksize=chunk_rows, **read_kwargs):
+        # Stratify on the key segment as seen in the first chunk
+        if sampler is None: sampler = StratifiedSampler(choose_strata_column(chunk))
+        sampler.add(chunk)
+    return (sampler or StratifiedSampler()).result()
+
+class SampledDataset:
+    """A stratified sample standing in for the full dataset.
+
+    Exposes the FrameAggregates interface with sums and counts scaled by each
+    stratum's inverse sampling rate, a profile with weighted numeric stats
+    (numeric `count`/`nunique` stay sample-level so the metric heuristics see
+    the same ratios), and `estimate()` for confidence intervals.
+    """
+    def __init__(self, sample: pd.DataFrame, rows: int, strata_col: str | None, codes: np.ndarray,
+                 strata_sizes: np.ndarray, sample_sizes: np.ndarray):
+        self.df = sample
+        self.rows = rows
+        self.strata_col = strata_col
+        self.codes = codes
+        self.strata_sizes = strata_sizes
+        self.sample_sizes = sample_sizes
+        self.weights = (strata_sizes / np.maximum(sample_sizes, 1))[codes]
+        self.time_col, self.time_values, _ = detect_time_axis(sample) if len(sample) else (None, None, None)
+        self._profile = None
+
+    @property
+    def empty(self) -> bool:
+        return self.rows == 0
+
+    @property
+    def profile(self) -> DatasetProfile:
+        if self._profile is None: self._profile = self._build_profile()
+        return self._profile
+
+    def _values(self, col) -> np.ndarray:
+        return self.df[col].to_numpy(dtype=float, na_value=np.nan)
+
+    def _build_profile(self, top_k: int = PROFILE_TOP_K) -> DatasetProfile:
+        profile = build_dataset_profile(self.df, top_k)
+        profile.rows = self.rows
+        w = self.weights; total_weight = w.sum()
+        for prof in profile.columns.values():
+            present = self.df[prof.name].notna().to_numpy()
+            prof.null_rate = float(w[~present].sum() / total_weight) if total_weight else 0.0
+            if prof.kind == 'numeric' and present.any():
+                values, pw = self._values(prof.name)[present], w[present]
+                prof.sum = float(pw @ values); prof.mean = prof.sum / pw.sum()
+                prof.var = float(np.cov(values, aweights=pw)) if len(values) > 1 else float('nan')
+                prof.std = float(np.sqrt(prof.var))
+                prof.quantiles = {q: weighted_quantile(values, pw, q) for q in PROFILE_QUANTILES}
+            elif prof.kind == 'categorical' and prof.top_values:
+                counts = self.value_counts(prof.name)
+                prof.top_values = list(counts[counts.index.notna()].head(top_k).items())
+        return profile
+
+    # --- aggregate interface (see FrameAggregates) ---
+    def need_group(self, key: str, *values: str):
+        return self
+
+    def need_monthly(self, *values: str):
+        return self
+
+    def _weighted(self, value: str) -> pd.DataFrame:
+        values = self._values(value); present = ~np.isnan(values)
+        return pd.DataFrame({'sum': np.where(present, values * self.weights, 0.0), 'count': present * self.weights})
+
+    def group_stats(self, key: str, value: str) -> pd.DataFrame:
+        return self._weighted(value).groupby(self.df[key], dropna=False, observed=True).sum()
+
+    def value_counts(self, key: str) -> pd.Series:
+        counts = pd.Series(self.weights).groupby(self.df[key], dropna=False, observed=True).sum()
+        return counts.sort_values(ascending=False, kind='stable').round().astype('int64').rename('count')
+
+    def monthly(self, value: str) -> pd.DataFrame | None:
+        if not self.time_col: return None
+        mask = self.time_values.notna().to_numpy()
+        block = self._weighted(value)[mask]
+        block.index = pd.DatetimeIndex(self.time_values.to_numpy()[mask])
+        monthly = block.resample('MS').sum()
+        present = np.flatnonzero(monthly['count'].to_numpy() > 0)
+        if len(present) == 0: return None
+        return monthly.iloc[present[0]:present[-1] + 1]
+
+    # --- confidence intervals ---
+    def _total_variance(self, z: np.ndarray) -> float:
+        """Variance of the stratified expansion estimator of sum(z)."""
+        n, N = self.sample_sizes, self.strata_sizes
+        s2 = pd.Series(z).groupby(self.codes).var(ddof=1).reindex(range(len(n))).fillna(0.0).to_numpy()
+        return float(np.sum(N ** 2 * (1 - n / N) * s2 / np.maximum(n, 1)))
+
+    def estimate(self, col: str, group_col: str | None = None, confidence: float = SAMPLE_CONFIDENCE) -> dict:
+        """(estimate, low, high) for the total, mean and median of `col`, plus the top group's share.
+
+        Mean and share are ratio estimators (linearized variance); the median
+        interval is Woodruff's, read off the weighted CDF.
+        """
+        z_score = NormalDist().inv_cdf((1 + confidence) / 2)
+        values = self._values(col); present = ~np.isnan(values)
+        y = np.where(present, values, 0.0); w = self.weights
+        total = float(w @ y); observed = float(w @ present)
+        def interval(est, variance, lo=-np.inf, hi=np.inf):
+            half = z_score * np.sqrt(max(variance, 0.0))
+            return est, max(lo, est - half), min(hi, est + half)
+
+        out = {"total": interval(total, self._total_variance(y))}
+        if observed > 0:
+            mean = total / observed
+            out["mean"] = interval(mean, self._total_variance((y - mean) * present) / observed ** 2)
+            median = weighted_quantile(values[present], w[present], 0.5)
+            below = ((values <= median) & present).astype(float)
+            se = np.sqrt(self._total_variance(below - (w @ below / observed) * present)) / observed
+            bounds = [weighted_quantile(values[present], w[present], min(1.0, max(0.0, p)))
+                      for p in (0.5 - z_score * se, 0.5 + z_score * se)]
+            out["median"] = (median, *bounds)
+        if group_col and total > 0:
+            sums = self.group_stats(group_col, col)['sum']
+            if not sums.empty:
+                top = sums.idxmax()
+                in_top = (self.df[group_col].isna() if pd.isna(top) else self.df[group_col] == top).to_numpy()
+                share = float(w @ (y * in_top)) / total
+                out["topShare"] = interval(share, self._total_variance(y * (in_top - share)) / total ** 2, 0.0, 1.0)
+        return out
+
 # ---------------- Chart spec generator (MODIFIED for diverse relationships) ----------------
 
-def get_top_categorical_fields(df: pd.DataFrame, count: int = 3, max_unique: int = 50, min_unique: int = 2) -> list[str]:
+def get_top_categorical_fields(profile: DatasetProfile, count: int = 3, max_unique: int = 50, min_unique: int = 2, exclude=()) -> list[str]:
     """Returns a list of the top 'count' most relevant categorical fields for charting."""
-    categorical_cols = df.select_dtypes(include=['object', 'category']).columns
-    candidates = []
-    for col in categorical_cols:
-        nunique = df[col].nunique(dropna=True)
-        if min_unique <= nunique <= max_unique:
-            # Scoring: prioritize fields with a useful number of unique values and few nulls.
-            null_rate = df[col].isna().mean()
-            # Simple score: cardinality - penalty for nulls
-            score = nunique - (null_rate * 10)
-            candidates.append((col, score))
-    candidates.sort(key=lambda x: x[1], reverse=True)
-    return [col for col, score in candidates[:count]]
+    return _rank_categorical_fields(profile, max_unique, min_unique, exclude)[:count]
 
 
-def generate_chart_specs(df: pd.DataFrame) -> list[dict]:
-    df = df.copy()
-    time_col = detect_time_column(df)
-    main_value = determine_key_metric(df)
+def generate_chart_specs(df: "pd.DataFrame | StreamingDataset | SampledDataset", profile: DatasetProfile | None = None,
+                         aggs=None) -> list[dict]:
+    if isinstance(df, (StreamingDataset, SampledDataset)):
+        profile = df.profile
+    elif profile is None:
+        profile = build_dataset_profile(df)
+    if aggs is None: aggs = aggregate_source(df)
+    time_col = aggs.time_col
+    main_value = determine_key_metric(profile)
     
     if main_value is None:
         return []
 
-    # Get multiple categorical fields for different analyses
-    top_segments = get_top_categorical_fields(df, count=4, max_unique=20)
+    # Get multiple categorical fields for different analyses (the date column doesn't count as one)
+    top_segments = get_top_categorical_fields(profile, count=4, max_unique=20, exclude=(time_col,))
     primary_group = top_segments[0] if top_segments else None
     secondary_group = top_segments[1] if len(top_segments) > 1 else None
     tertiary_group = top_segments[2] if len(top_segments) > 2 else None
 
+    # Declare what the strategies read: one fused groupby for the primary key, one monthly resample
+    if primary_group: aggs.need_group(primary_group, main_value)
+    if time_col: aggs.need_monthly(main_value)
+
     chart_specs = []
     
     # STRATEGY 1: BAR CHART - Total values by primary group (Business Performance)
     if primary_group:
         total_by_primary = (
-            df.groupby(primary_group, dropna=False)[main_value]
-            .sum(numeric_only=True)
+            aggs.group_stats(primary_group, main_value)['sum']
             .sort_values(ascending=False)
             .head(8)
         )
@@ -167,7 +1452,7 @@ def generate_chart_specs(df: pd.DataFrame) -> list[dict]:
     # STRATEGY 2: PIE CHART - Percentage contribution using COUNT distribution (Market Share)
     if secondary_group:
         # Use COUNT instead of SUM for completely different perspective
-        count_distribution = df[secondary_group].value_counts(dropna=False).head(6)
+        count_distribution = aggs.value_counts(secondary_group).head(6)
         if len(count_distribution) > 1:
             total_count = count_distribution.sum()
             pie_data = []
@@ -190,13 +1475,11 @@ def generate_chart_specs(df: pd.DataFrame) -> list[dict]:
     # STRATEGY 3: LINE CHART - Time-based trend (Performance Over Time)
     if time_col and len(chart_specs) < 3:
         try:
-            ts_data = df[[time_col, main_value]].dropna()
-            ts_data[time_col] = pd.to_datetime(ts_data[time_col], errors='coerce')
-            ts_data = ts_data.dropna(subset=[time_col])
+            monthly = aggs.monthly(main_value)
             
-            if not ts_data.empty:
+            if monthly is not None:
                 # Use monthly averages for trend analysis
-                monthly_avg = ts_data.set_index(time_col)[main_value].resample('MS').mean()
+                monthly_avg = monthly['sum'] / monthly['count']
                 if len(monthly_avg) >= 2:
                     line_data = [{"month": month_short(idx), "value": round(to_float(val), 2)} 
                                 for idx, val in monthly_avg.items()]
@@ -213,9 +1496,9 @@ def generate_chart_specs(df: pd.DataFrame) -> list[dict]:
     if len(chart_specs) < 3 and primary_group and secondary_group:
         try:
             # Calculate average values by primary group for efficiency comparison
+            group_stats = aggs.group_stats(primary_group, main_value)
             efficiency_data = (
-                df.groupby(primary_group, dropna=False)[main_value]
-                .mean(numeric_only=True)
+                (group_stats['sum'] / group_stats['count'])
                 .sort_values(ascending=True)  # Sort for better horizontal bar display
                 .head(8)
             )
@@ -234,12 +1517,10 @@ def generate_chart_specs(df: pd.DataFrame) -> list[dict]:
     # STRATEGY 5: AREA CHART - Cumulative growth
     if len(chart_specs) < 3 and time_col:
         try:
-            ts_data = df[[time_col, main_value]].dropna()
-            ts_data[time_col] = pd.to_datetime(ts_data[time_col], errors='coerce')
-            ts_data = ts_data.dropna(subset=[time_col])
+            monthly = aggs.monthly(main_value)
             
-            if not ts_data.empty:
-                cumulative_growth = ts_data.set_index(time_col)[main_value].resample('MS').sum().cumsum()
+            if monthly is not None:
+                cumulative_growth = monthly['sum'].cumsum()
                 if len(cumulative_growth) >= 2:
                     area_data = [{"month": month_short(idx), "value": round(to_float(val), 2)} 
                                 for idx, val in cumulative_growth.items()]
@@ -254,7 +1535,7 @@ def generate_chart_specs(df: pd.DataFrame) -> list[dict]:
 
     # STRATEGY 6: Alternative - Value counts by tertiary field if others fail
     if len(chart_specs) < 3 and tertiary_group:
-        value_counts = df[tertiary_group].value_counts(dropna=False).head(8)
+        value_counts = aggs.value_counts(tertiary_group).head(8)
         if not value_counts.empty:
             horizontal_data = [{"category": str(idx), "value": int(val), "color": safe_color(i)} 
                               for i, (idx, val) in enumerate(value_counts.items())]
@@ -269,35 +1550,61 @@ def generate_chart_specs(df: pd.DataFrame) -> list[dict]:
 
 # --------------- Core Brief & Prompt (MODIFIED for AI-generated titles) ---------------
 
-def generate_data_brief_and_prompt(df: pd.DataFrame) -> dict:
+def sampling_brief(sample: SampledDataset, main_col: str, group_col: str | None) -> dict:
+    est = sample.estimate(main_col, group_col)
+    def span(key, fmt="{:,.0f}"):
+        if key not in est: return "N/A"
+        _, lo, hi = est[key]
+        if not (np.isfinite(lo) and np.isfinite(hi)): return "N/A"
+        return f"{fmt.format(lo)} to {fmt.format(hi)}"
+    return {
+        "sampledRecords": len(sample.df),
+        "method": f"Stratified by {sanitize_column_name(sample.strata_col)}" if sample.strata_col else "Simple random sample",
+        "confidenceLevel": f"{SAMPLE_CONFIDENCE * 100:.0f}%",
+        "totalRange": span("total"),
+        "averageRange": span("mean"),
+        "medianRange": span("median"),
+        "topGroupShareRange": span("topShare", "{:.1%}"),
+        "note": "Figures are estimated from a sample; the ranges show where the true values likely fall.",
+    }
+
+def generate_data_brief_and_prompt(df: "pd.DataFrame | StreamingDataset | SampledDataset", profile: DatasetProfile | None = None,
+                                   aggs=None) -> dict:
     if df.empty: return {"error": "DataFrame is empty."}
-    df_sanitized = df.rename(columns={col: sanitize_column_name(col) for col in df.columns})
-    context_summary = generate_context_summary(df)
-    main_value = determine_key_metric(df_sanitized)
-    if not main_value: return {"error": "No clear numeric value to analyze."}
-    group_field = determine_key_segment(df_sanitized)
-
-    series = pd.to_numeric(df_sanitized[main_value], errors="coerce")
-    total_records = len(df_sanitized)
-    total_sum = float(series.sum(skipna=True))
-    average = float(series.mean(skipna=True)) if series.notna().any() else 0.0
-    median_val = float(series.median(skipna=True)) if series.notna().any() else 0.0
-    std_dev = float(series.std(skipna=True)) if series.notna().any() and len(series) > 1 else 0.0
+    if isinstance(df, (StreamingDataset, SampledDataset)):
+        profile = df.profile
+    elif profile is None:
+        profile = build_dataset_profile(df)
+    if aggs is None: aggs = aggregate_source(df)
+    context_summary = generate_context_summary(profile)
+    main_col = determine_key_metric(profile)
+    if not main_col: return {"error": "No clear numeric value to analyze."}
+    main_value = profile.label(main_col)
+    group_col = determine_key_segment(profile)
+    group_field = profile.label(group_col) if group_col else None
+
+    stats = profile[main_col]
+    has_values = stats.count > 0
+    total_records = profile.rows
+    total_sum = stats.sum
+    average = stats.mean if has_values else 0.0
+    median_val = stats.quantiles[0.5] if has_values else 0.0
+    std_dev = stats.std if has_values and total_records > 1 else 0.0
 
     # Calculate additional statistics for unique insights
-    top_10_pct = float(series.quantile(0.9)) if series.notna().any() else 0.0
-    bottom_10_pct = float(series.quantile(0.1)) if series.notna().any() else 0.0
+    top_10_pct = stats.quantiles[0.9] if has_values else 0.0
+    bottom_10_pct = stats.quantiles[0.1] if has_values else 0.0
     cv = (std_dev / average) * 100 if average > 0 else 0  # Coefficient of variation
 
     top_group = "N/A"; share_text = "N/A"; balance_text = "No grouping available"
-    if group_field:
-        totals_mean = df_sanitized.groupby(group_field, dropna=False)[main_value].mean(numeric_only=True)
-        total_value_by_group = df_sanitized.groupby(group_field, dropna=False)[main_value].sum(numeric_only=True)
+    if group_col:
+        aggs.need_group(group_col, main_col)
+        total_value_by_group = aggs.group_stats(group_col, main_col)['sum']
         if not total_value_by_group.empty:
             top_group = str(total_value_by_group.idxmax())
             top_sum = float(total_value_by_group.max())
             share = (top_sum / total_sum) if total_sum > 0 else 0.0
-            share_text = f"{share*100:.1f}%"
+            share_text = f"{share*100:.1f}%" if np.isfinite(share) else "N/A"
             if len(total_value_by_group) > 1:
                 second = float(total_value_by_group.sort_values(ascending=False).iloc[1])
                 if second > 0 and (top_sum / second) > 1.5: balance_text = "One group stands out clearly"
@@ -305,22 +1612,26 @@ def generate_data_brief_and_prompt(df: pd.DataFrame) -> dict:
             else:
                 balance_text = "Only one group found"
 
+    def whole(v): return f"{v:,.0f}" if np.isfinite(v) else "N/A"  # inf in the column makes sums and moments non-finite
     brief = {
         "overview": {
             "records": total_records, 
             "mainValue": main_value, 
-            "total": f"{total_sum:,.0f}", 
-            "average": f"{average:,.0f}",
-            "median": f"{median_val:,.0f}",
-            "stdDev": f"{std_dev:,.0f}",
-            "top10Percentile": f"{top_10_pct:,.0f}",
-            "bottom10Percentile": f"{bottom_10_pct:,.0f}",
-            "coefficientOfVariation": f"{cv:.1f}%"
+            "total": whole(total_sum), 
+            "average": whole(average),
+            "median": whole(median_val),
+            "stdDev": whole(std_dev),
+            "top10Percentile": whole(top_10_pct),
+            "bottom10Percentile": whole(bottom_10_pct),
+            "coefficientOfVariation": f"{cv:.1f}%" if np.isfinite(cv) else "N/A"
         },
         "leaders": {"grouping": group_field or "N/A", "topGroup": top_group, "share": share_text, "balance": balance_text}
     }
+    if isinstance(df, SampledDataset):
+        brief["sampling"] = sampling_brief(df, main_col, group_col)
 
-    user_prompt = f"""
+    with trace_stage('prompt_build'):
+        user_prompt = f"""
 ROLE: You are an expert business communicator writing a summary for a dataset. Your content MUST be at a Grade 6 reading level and use context-specific terms derived from the column names and context summary.
 
 DATA CONTEXT SUMMARY:
@@ -380,101 +1691,1732 @@ EXAMPLE TITLES (for inspiration only - create your own):
 
     return {"brief": brief, "prompt": user_prompt}
 
-# --------------- API (MODIFIED for AI-generated titles) ---------------
+# ---------------- Template text slides (zero-LLM fast mode) ----------------
+# Renders the 8 text slides straight from the brief and the profile, in the
+# same schema Gemini returns, so a deck comes back without a model call.
 
-@app.route('/api/analyze', methods=['POST'])
-def analyze_file():
-    if 'file' not in request.files: return jsonify({"error": "No file part"}), 400
-    file = request.files['file']
-    if file.filename == '': return jsonify({"error": "No selected file"}), 400
-    if not GEMINI_API_KEY: return jsonify({"error": "GEMINI_API_KEY not configured"}), 500
+FAST_MODE_DEFAULT = os.getenv("FAST_MODE", "").lower() in ("1", "true", "yes")  # ?fast=0 still asks Gemini
+OUTLIER_Z = 3.0
 
+def format_number(v: float) -> str:
+    v = float(v)
+    if not np.isfinite(v): return "N/A"
+    if abs(v) >= 100 or v == int(v): return f"{v:,.0f}"
+    return f"{v:,.2f}".rstrip('0').rstrip('.')
+
+def _percent(part: float, whole: float) -> str:
+    if not whole: return "0.0%"
+    share = part / whole * 100
+    return f"{share:.1f}%" if np.isfinite(share) else "N/A"
+
+def _month_label(dt: pd.Timestamp) -> str:
     try:
-        file_bytes = file.read()
-        file_buffer = io.BytesIO(file_bytes)
-        ext = file.filename.split('.')[-1].lower()
-        if ext in ('xlsx', 'xls'):
-            df = pd.read_excel(file_buffer, engine='openpyxl')
-        elif ext == 'csv':
-            try:
-                file_buffer.seek(0); df = pd.read_csv(file_buffer)
-            except UnicodeDecodeError:
-                file_buffer.seek(0); df = pd.read_csv(file_buffer, encoding='cp1252')
-        else:
-            return jsonify({"error": f"Unsupported file type: {ext}. Please use CSV or Excel."}), 400
-
-        # Build brief + prompt
-        analysis = generate_data_brief_and_prompt(df)
-        if "error" in analysis: return jsonify({"error": analysis["error"]}), 400
-        prompt = analysis["prompt"]
-
-        # Call Gemini for text slides with AI-generated titles
-        client = genai.Client(api_key=GEMINI_API_KEY)
-        response = client.models.generate_content(
-            model=MODEL_NAME,
-            contents=[prompt],
-            config=types.GenerateContentConfig(
-                response_mime_type="application/json",
-                response_schema=types.Schema(
+        return dt.strftime('%b %Y')
+    except Exception:
+        return str(dt)
+
+def _slide(title: str, points: list[str]) -> dict:
+    return {"sectionTitle": title, "points": points}
+
+def _leaders_slide(main, group, sums: pd.Series, total: float) -> dict | None:
+    sums = sums.sort_values(ascending=False)
+    if len(sums) < 2: return None
+    top, second = sums.index[0], sums.index[1]
+    ratio = f"{sums.iloc[0] / sums.iloc[1]:.1f}x" if sums.iloc[1] > 0 else "far above"
+    return _slide(f"Top {group} Performance", [
+        f"{top} leads with {_percent(sums.iloc[0], total)} of total {main} ({format_number(sums.iloc[0])}).",
+        f"The top {min(3, len(sums))} of {len(sums)} {group} groups hold {_percent(sums.head(3).sum(), total)} of the total.",
+        f"{top} is {ratio} the next group, {second}, at {format_number(sums.iloc[1])}.",
+    ])
+
+def _distribution_slide(main, stats: ColumnProfile, cv: float) -> dict:
+    p10, median, p90 = stats.quantiles[0.1], stats.quantiles[0.5], stats.quantiles[0.9]
+    skew = stats.mean - median
+    spread = "high" if cv > 100 else "moderate" if cv > 30 else "low"
+    return _slide(f"{main} Distribution", [
+        f"The middle 80% of {main} values fall between {format_number(p10)} and {format_number(p90)}.",
+        f"Half the records are at or below {format_number(median)}; the average is "
+        + (f"{format_number(abs(skew))} {'higher' if skew > 0 else 'lower'}." if skew and np.isfinite(skew)
+           else "the same." if skew == 0 else "N/A."),
+        f"The coefficient of variation is {cv:.1f}%, a {spread} spread around the average." if np.isfinite(cv)
+        else f"Extreme values make the spread of {main} around its average undefined.",
+    ])
+
+def _outlier_slide(main, stats: ColumnProfile, beyond: int | None) -> dict | None:
+    if not stats.std or not np.isfinite(stats.std): return None
+    high_z = (float(stats.max) - stats.mean) / stats.std
+    low_z = (stats.mean - float(stats.min)) / stats.std
+    lo, hi = stats.mean - OUTLIER_Z * stats.std, stats.mean + OUTLIER_Z * stats.std
+    third = (f"{beyond:,} records ({_percent(beyond, stats.count)}) lie more than {OUTLIER_Z:g} standard deviations from the average."
+             if beyond is not None else
+             f"Values outside {format_number(lo)} to {format_number(hi)} are more than {OUTLIER_Z:g} standard deviations out.")
+    return _slide("Outliers & Extreme Values", [
+        f"The highest {main}, {format_number(stats.max)}, is {high_z:.1f} standard deviations above the average.",
+        f"The lowest {main}, {format_number(stats.min)}, is {low_z:.1f} standard deviations below the average.",
+        third,
+    ])
+
+def _trend_slide(main, monthly: pd.DataFrame | None) -> tuple[dict | None, float | None]:
+    if monthly is None or len(monthly) < 2: return None, None
+    sums = monthly['sum'].astype(float)
+    first, last = sums.iloc[0], sums.iloc[-1]
+    change = (last - first) / abs(first) * 100 if first else None
+    return _slide(f"Monthly {main} Trend", [
+        f"{main} moved from {format_number(first)} in {_month_label(sums.index[0])} to {format_number(last)} in {_month_label(sums.index[-1])}"
+        + (f" ({change:+.1f}%)." if change is not None else "."),
+        f"The best month was {_month_label(sums.idxmax())} at {format_number(sums.max())}; the weakest was "
+        f"{_month_label(sums.idxmin())} at {format_number(sums.min())}.",
+        f"Monthly totals average {format_number(sums.mean())} across {len(sums)} months.",
+    ]), change
+
+def _comparison_slide(main, group, stats: pd.DataFrame, average: float) -> dict | None:
+    means = (stats['sum'] / stats['count'].where(stats['count'] > 0)).dropna().sort_values(ascending=False)
+    if len(means) < 2: return None
+    best, worst = means.index[0], means.index[-1]
+    ratio = f"{means.iloc[0] / means.iloc[-1]:.1f}x" if means.iloc[-1] > 0 else "well above"
+    above = int((means > average).sum())
+    return _slide(f"{group} Average Comparison", [
+        f"{best} has the highest average {main} per record at {format_number(means.iloc[0])}.",
+        f"{worst} has the lowest at {format_number(means.iloc[-1])}; {best} is {ratio} that level.",
+        f"{above} of {len(means)} {group} groups beat the overall average of {format_number(average)}.",
+    ])
+
+def _mix_slide(label, counts: pd.Series) -> dict | None:
+    counts = counts[counts.index.notna()]
+    if len(counts) < 2: return None
+    total = counts.sum()
+    return _slide(f"{label} Mix", [
+        f"The most common {label} is {counts.index[0]} with {int(counts.iloc[0]):,} records ({_percent(counts.iloc[0], total)}).",
+        f"There are {len(counts)} {label} values; the top 3 cover {_percent(counts.head(3).sum(), total)} of records.",
+        f"The least common is {counts.index[-1]} with {int(counts.iloc[-1]):,} records.",
+    ])
+
+def _other_measures_slide(others: list[ColumnProfile]) -> dict | None:
+    if not others: return None
+    per_column = [[f"{p.label} averages {format_number(p.mean)} with a median of {format_number(p.quantiles.get(0.5, p.mean))}.",
+                   f"{p.label} ranges from {format_number(p.min)} to {format_number(p.max)}.",
+                   f"{p.label} is filled in for {_percent(1 - p.null_rate, 1)} of records."] for p in others[:3]]
+    points = [col[i] for i in range(3) for col in per_column][:3]  # round-robin so each column gets a line
+    return _slide("Other Key Measures", points)
+
+def _sampling_slide(sampling: dict) -> dict:
+    return _slide("Sample-Based Estimates", [
+        f"Figures come from {sampling['sampledRecords']:,} sampled records ({sampling['method']}).",
+        f"At {sampling['confidenceLevel']} confidence the total is between {sampling['totalRange']}.",
+        f"The average is between {sampling['averageRange']} and the median between {sampling['medianRange']}.",
+    ])
+
+def _data_quality_slide(profile: DatasetProfile, main_col) -> dict:
+    kinds = Counter(p.kind for p in profile.columns.values())
+    missing = [p for p in profile.columns.values() if p.null_rate > 0]
+    worst = max(missing, key=lambda p: p.null_rate) if missing else None
+    return _slide("Data Coverage & Quality", [
+        f"The dataset has {len(profile.columns)} columns: {kinds['numeric']} numeric, {kinds['categorical']} categorical "
+        f"and {kinds['datetime'] + kinds['other']} other.",
+        f"{profile.label(main_col)} is filled in for {_percent(1 - profile[main_col].null_rate, 1)} of records.",
+        (f"{len(missing)} columns have gaps; {worst.label} is the least complete at {_percent(worst.null_rate, 1)} missing."
+         if worst else "No column has missing values."),
+    ])
+
+# Fillers for data too thin for the slides above, so the deck keeps its 8 text slides
+
+def _range_slide(main, stats: ColumnProfile) -> dict:
+    low, high = float(stats.min), float(stats.max)
+    return _slide(f"{main} Range", [
+        f"{main} runs from {format_number(low)} to {format_number(high)}, a spread of {format_number(high - low)}.",
+        f"{stats.count:,} records have a {main} value and {stats.nunique:,} of those values are distinct.",
+        f"The largest {main} is {format_number(high - stats.mean)} above the average; "
+        f"the smallest is {format_number(stats.mean - low)} below it.",
+    ])
+
+def _structure_slide(profile: DatasetProfile, time_col) -> dict:
+    def names(kind):
+        labels = [p.label for p in profile.of_kind(kind) if p.name != time_col]
+        return ", ".join(labels[:4]) + (f" and {len(labels) - 4} more" if len(labels) > 4 else "")
+    numeric, categorical = names('numeric'), names('categorical')
+    return _slide("Dataset Structure", [
+        f"Numeric measures: {numeric}." if numeric else "The dataset has no numeric measures.",
+        f"Descriptive fields: {categorical}." if categorical else "There are no descriptive fields to group records by.",
+        f"{profile.label(time_col)} dates each record, so figures can be followed over time." if time_col
+        else "There is no date field, so the figures cover the whole period at once.",
+    ])
+
+def _cells_slide(profile: DatasetProfile) -> dict:
+    columns = list(profile.columns.values())
+    cells = profile.rows * len(columns)
+    filled = sum(p.count for p in columns)
+    complete = sum(1 for p in columns if p.null_rate == 0)
+    by_distinct = sorted(columns, key=lambda p: p.nunique, reverse=True)
+    most, fewest = by_distinct[0], by_distinct[-1]
+    return _slide("Cells & Distinct Values", [
+        f"{profile.rows:,} records across {len(columns)} columns make {cells:,} cells, {_percent(filled, cells)} of them filled in.",
+        f"{complete} of {len(columns)} columns have a value in every record.",
+        (f"{most.label} has the most distinct values ({most.nunique:,}); {fewest.label} has the fewest ({fewest.nunique:,})."
+         if len(columns) > 1 else f"{most.label} has {most.nunique:,} distinct values."),
+    ])
+
+def _next_steps_slide(main, profile: DatasetProfile, group, time_col) -> dict:
+    return _slide("Suggested Next Steps", [
+        f"With only {profile.rows:,} record{'s' if profile.rows != 1 else ''}, collect more data before drawing firm conclusions." if profile.rows < 30
+        else f"{profile.rows:,} records give a solid base for the figures in this report.",
+        f"Compare {main} across {group} groups to find where to focus." if group
+        else f"Add a category such as region or product to compare {main} between groups.",
+        f"Keep adding dated records to follow {main} over time." if time_col
+        else f"Add a date to each record to track {main} over time.",
+    ])
+
+def generate_template_presentation(df: "pd.DataFrame | StreamingDataset | SampledDataset", profile: DatasetProfile,
+                                   brief: dict, aggs=None) -> dict:
+    """The deck's text slides from templates: slide 1 from the brief overview,
+    then 6 analysis slides in priority order, then key takeaways."""
+    if aggs is None: aggs = aggregate_source(df)
+    time_col = aggs.time_col
+    overview, leaders = brief["overview"], brief["leaders"]
+    main_col = determine_key_metric(profile)
+    main = overview["mainValue"]
+    stats = profile[main_col]
+    group_col = determine_key_segment(profile)
+    group = profile.label(group_col) if group_col else None
+    average = stats.mean if stats.count else 0.0
+    cv = (stats.std / average) * 100 if average > 0 and stats.std == stats.std else 0.0
+
+    group_stats = None
+    if group_col:
+        aggs.need_group(group_col, main_col)
+        group_stats = aggs.group_stats(group_col, main_col)
+        group_stats = group_stats[group_stats.index.notna()]
+    if time_col: aggs.need_monthly(main_col)
+    beyond = None
+    if isinstance(df, pd.DataFrame) and stats.count and stats.std:
+        values = df[main_col].to_numpy(dtype=float, na_value=np.nan)
+        beyond = int((np.abs(values - stats.mean) > OUTLIER_Z * stats.std).sum())
+    trend, change = _trend_slide(main, aggs.monthly(main_col)) if time_col else (None, None)
+    secondary = next((c for c in get_top_categorical_fields(profile, count=4, max_unique=20, exclude=(time_col,))
+                      if c != group_col), None)
+
+    candidates = [
+        _sampling_slide(brief["sampling"]) if "sampling" in brief else None,
+        _leaders_slide(main, group, group_stats['sum'], stats.sum) if group_stats is not None else None,
+        _distribution_slide(main, stats, cv) if stats.count else None,
+        trend,
+        _comparison_slide(main, group, group_stats, average) if group_stats is not None else None,
+        _outlier_slide(main, stats, beyond) if stats.count else None,
+        _mix_slide(profile.label(secondary), aggs.value_counts(secondary)) if secondary else None,
+        _other_measures_slide([p for p in profile.of_kind('numeric') if p.name != main_col and p.count]),
+        _data_quality_slide(profile, main_col),
+        _range_slide(main, stats) if stats.count else None,
+        _structure_slide(profile, time_col),
+        _cells_slide(profile),
+        _next_steps_slide(main, profile, group, time_col),
+    ]
+    sections = [_slide("About the Dataset", [
+        f"The dataset has {overview['records']:,} records with a total {main} of {overview['total']}.",
+        f"The average {main} is {overview['average']}, the median is {overview['median']} "
+        f"and the standard deviation is {overview['stdDev']}.",
+    ])]
+    sections += [s for s in candidates if s is not None][:6]
+
+    takeaways = []
+    if leaders["topGroup"] != "N/A":
+        takeaways.append(f"{leaders['topGroup']} drives {leaders['share']} of total {main}; {leaders['balance'].lower()}.")
+    if change is not None:
+        takeaways.append(f"{main} is {'up' if change >= 0 else 'down'} {abs(change):.1f}% from the first month to the last.")
+    if stats.count:
+        skew = stats.mean - stats.quantiles[0.5]
+        takeaways.append(f"A typical record is {overview['median']}; "
+                         + ("a few large values lift the average to " if skew > 0 else "the average sits at ")
+                         + f"{overview['average']}.")
+        takeaways.append(f"The top 10% of records start at {overview['top10Percentile']}, "
+                         f"the bottom 10% end at {overview['bottom10Percentile']}.")
+    takeaways.append(f"{main} varies by {overview['coefficientOfVariation']} around its average.")
+    sections.append(_slide("Key Takeaways", takeaways[:3]))
+    return {"title": f"{main} Analysis Report", "sections": sections}
+
+# ---------------- Gemini client & compute pool ----------------
+# One client per process (it keeps its HTTP connection pool warm) and a shared
+# thread pool so pandas work can run while the LLM request is in flight.
+
+COMPUTE_WORKERS = int(os.getenv("COMPUTE_WORKERS", str(min(8, (os.cpu_count() or 1) + 2))))
+compute_pool = ThreadPoolExecutor(max_workers=COMPUTE_WORKERS, thread_name_prefix="compute")
+
+_genai_client = None
+_genai_client_lock = threading.Lock()
+
+GEMINI_BASE_URL = os.getenv("GEMINI_BASE_URL")  # e.g. http://127.0.0.1:8089 to talk to llm_stub.py
+
+def get_genai_client():
+    global _genai_client
+    if _genai_client is None:
+        with _genai_client_lock:
+            if _genai_client is None:
+                http_options = types.HttpOptions(base_url=GEMINI_BASE_URL) if GEMINI_BASE_URL else None
+                _genai_client = genai.Client(api_key=GEMINI_API_KEY, http_options=http_options)
+    return _genai_client
+
+PRESENTATION_CONFIG = types.GenerateContentConfig(
+    response_mime_type="application/json",
+    response_schema=types.Schema(
+        type=types.Type.OBJECT,
+        properties={
+            "title": types.Schema(type=types.Type.STRING),
+            "sections": types.Schema(
+                type=types.Type.ARRAY,
+                items=types.Schema(
                     type=types.Type.OBJECT,
                     properties={
-                        "title": types.Schema(type=types.Type.STRING),
-                        "sections": types.Schema(
-                            type=types.Type.ARRAY,
-                            items=types.Schema(
-                                type=types.Type.OBJECT,
-                                properties={
-                                    "sectionTitle": types.Schema(type=types.Type.STRING),
-                                    "points": types.Schema(type=types.Type.ARRAY, items=types.Schema(type=types.Type.STRING)),
-                                }
-                            )
-                        )
+                        "sectionTitle": types.Schema(type=types.Type.STRING),
+                        "points": types.Schema(type=types.Type.ARRAY, items=types.Schema(type=types.Type.STRING)),
                     }
                 )
             )
-        )
-        ai_presentation = json.loads(response.text)
+        }
+    )
+)
 
-        # Generate chart sections directly from the dataset
-        chart_sections = generate_chart_specs(df)
+# ---------------- LLM gateway ----------------
+# Every Gemini call goes through one gateway per process: a semaphore caps
+# concurrent calls, identical in-flight prompts share one call, finished
+# responses are kept by prompt hash for a while, and rate limits / transient
+# failures are retried with full-jitter exponential backoff.
 
-        # Insert charts after specific text slides (slides 3, 5, and 7 - 0-indexed 2, 4, 6)
-        ai_sections = ai_presentation.get("sections") or []
-        target_slide_indices = [2, 4, 6]
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "8"))
+LLM_CACHE_TTL_SECONDS = float(os.getenv("LLM_CACHE_TTL_SECONDS", "900"))  # 0 disables the response cache
+LLM_CACHE_ENTRIES = int(os.getenv("LLM_CACHE_ENTRIES", "256"))
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "4"))
+LLM_BACKOFF_BASE_SECONDS = float(os.getenv("LLM_BACKOFF_BASE_SECONDS", "0.5"))
+LLM_BACKOFF_MAX_SECONDS = float(os.getenv("LLM_BACKOFF_MAX_SECONDS", "20"))
+LLM_RETRY_STATUS = (429, 500, 502, 503, 504)
 
-        merged_sections = []
-        chart_index = 0
+def is_retryable(e: Exception) -> bool:
+    if isinstance(e, genai_errors.APIError): return e.code in LLM_RETRY_STATUS
+    return isinstance(e, (httpx.TransportError, ConnectionError, TimeoutError))
 
-        for i, section in enumerate(ai_sections):
-            merged_sections.append(section)
-            
-            # Insert chart after the target slides if we have charts remaining
-            if i in target_slide_indices and chart_index < len(chart_sections):
+class SharedStream:
+    """Chunks of one in-flight streamed call, replayed to every caller that joins it."""
+    def __init__(self):
+        self.parts = []
+        self.done = False
+        self.error = None
+        self._cond = threading.Condition()
+
+    def put(self, part: str | None = None, done: bool = False, error: BaseException | None = None):
+        with self._cond:
+            if part is not None: self.parts.append(part)
+            self.error = self.error or error
+            self.done = self.done or done or error is not None
+            self._cond.notify_all()
+
+    def __iter__(self):
+        seen = 0
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: len(self.parts) > seen or self.done)
+                parts, done, error = self.parts[seen:], self.done, self.error
+            seen += len(parts)
+            yield from parts
+            if done:
+                if error is not None: raise error
+                return
+
+class LLMGateway:
+    def __init__(self, max_concurrency: int, cache_ttl: float, cache_entries: int,
+                 max_retries: int, backoff_base: float, backoff_max: float):
+        self.cache_ttl = cache_ttl
+        self.cache_entries = cache_entries
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.active = 0
+        self._slots = threading.BoundedSemaphore(max_concurrency)
+        self._lock = threading.Lock()
+        self._inflight = {}          # prompt key -> Future shared by every caller
+        self._streaming = {}         # prompt key -> SharedStream of the streamed call in flight
+        self._cache = OrderedDict()  # prompt key -> (expires at, response text)
+
+    @staticmethod
+    def key_for(prompt: str) -> str:
+        return hashlib.sha256(f"{MODEL_NAME}\0{prompt}".encode()).hexdigest()
+
+    def _cached(self, key: str) -> str | None:
+        entry = self._cache.get(key)
+        if entry is None: return None
+        if entry[0] < time.monotonic():
+            del self._cache[key]; return None
+        self._cache.move_to_end(key)
+        return entry[1]
+
+    def _remember(self, key: str, text: str):
+        if self.cache_ttl <= 0: return
+        with self._lock:
+            self._cache[key] = (time.monotonic() + self.cache_ttl, text)
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.cache_entries: self._cache.popitem(last=False)
+
+    def _acquire(self):
+        self._slots.acquire()
+        with self._lock: self.active += 1
+
+    def _release(self):
+        with self._lock: self.active -= 1
+        self._slots.release()
+
+    def _backoff(self, attempt: int, e: Exception) -> float:
+        delay = random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+        # Never come back sooner than the server asked us to
+        retry_after = getattr(getattr(e, 'response', None), 'headers', {}).get('Retry-After')
+        try: return max(delay, float(retry_after)) if retry_after else delay
+        except ValueError: return delay
+
+    def _retrying(self, call):
+        """Runs `call` in a concurrency slot; the slot is given back while backing off."""
+        attempt = 0
+        while True:
+            self._acquire()
+            try:
+                return call()
+            except Exception as e:
+                if attempt >= self.max_retries or not is_retryable(e):
+                    metrics.inc('llm_gateway_events_total', event='failure')
+                    raise
+                delay = self._backoff(attempt, e)
+            finally:
+                self._release()
+            metrics.inc('llm_gateway_events_total', event='retry')
+            time.sleep(delay)
+            attempt += 1
+
+    def _note(self, event: str):
+        metrics.inc('llm_gateway_events_total', event=event)
+        trace = _current_trace.get()
+        if trace is not None: trace.set(llm=event)
+
+    def generate(self, prompt: str, call, cache_mode: str = '') -> str:
+        """`call(prompt)` -> response text, at most once per distinct prompt in flight.
+        `cache_mode` as for the result cache: 'refresh' skips the cached text, 'bypass' also doesn't store it."""
+        key = self.key_for(prompt)
+        with self._lock:
+            text = self._cached(key) if cache_mode not in ('refresh', 'bypass') else None
+            future = self._inflight.get(key) if text is None else None
+            leader = text is None and future is None
+            if leader: future = self._inflight[key] = Future()
+        if text is not None:
+            self._note('cache_hit'); return text
+        if not leader:
+            self._note('coalesced'); return future.result()
+        self._note('call')
+        try:
+            text = self._retrying(lambda: call(prompt))
+            if cache_mode != 'bypass': self._remember(key, text)
+            future.set_result(text)
+            return text
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._lock: self._inflight.pop(key, None)
+
+    def stream(self, prompt: str, call, cache_mode: str = ''):
+        """Streams `call(prompt)`'s text chunks. Retries only until the first chunk
+        arrives, and holds its slot until the stream is drained. Identical prompts in
+        flight share the one call: later callers replay its chunks as they arrive."""
+        key = self.key_for(prompt)
+        with self._lock:
+            text = self._cached(key) if cache_mode not in ('refresh', 'bypass') else None
+            shared = self._streaming.get(key) if text is None else None
+            leader = text is None and shared is None
+            if leader: shared = self._streaming[key] = SharedStream()
+        if text is not None:
+            self._note('cache_hit'); yield text; return
+        if not leader:
+            self._note('coalesced'); yield from shared; return
+        self._note('call')
+        attempt, held = 0, False
+        try:
+            while True:
+                self._acquire(); held = True
+                try:
+                    chunks = call(prompt)
+                    first = next(chunks, None)
+                    break
+                except Exception as e:
+                    self._release(); held = False
+                    if attempt >= self.max_retries or not is_retryable(e):
+                        metrics.inc('llm_gateway_events_total', event='failure')
+                        raise
+                    delay = self._backoff(attempt, e)
+                metrics.inc('llm_gateway_events_total', event='retry')
+                time.sleep(delay)
+                attempt += 1
+            try:
+                for part in itertools.chain([first] if first is not None else [], chunks):
+                    shared.put(part)
+                    yield part
+            except Exception:
+                metrics.inc('llm_gateway_events_total', event='failure')  # broke off mid-stream
+                raise
+            if cache_mode != 'bypass': self._remember(key, ''.join(shared.parts))
+            shared.put(done=True)
+        except GeneratorExit:
+            shared.put(error=RuntimeError("The shared Gemini stream was closed before it finished"))
+            raise
+        except BaseException as e:
+            shared.put(error=e)
+            raise
+        finally:
+            if held: self._release()
+            with self._lock: self._streaming.pop(key, None)
+
+llm_gateway = LLMGateway(LLM_MAX_CONCURRENCY, LLM_CACHE_TTL_SECONDS, LLM_CACHE_ENTRIES,
+                         LLM_MAX_RETRIES, LLM_BACKOFF_BASE_SECONDS, LLM_BACKOFF_MAX_SECONDS)
+
+def _generate_presentation_text(prompt: str) -> str:
+    response = get_genai_client().models.generate_content(
+        model=MODEL_NAME,
+        contents=[prompt],
+        config=PRESENTATION_CONFIG
+    )
+    record_llm_usage(getattr(response, 'usage_metadata', None))
+    return response.text
+
+def _stream_presentation_text(prompt: str):
+    usage = None
+    for chunk in get_genai_client().models.generate_content_stream(
+        model=MODEL_NAME,
+        contents=[prompt],
+        config=PRESENTATION_CONFIG
+    ):
+        usage = getattr(chunk, 'usage_metadata', None) or usage
+        if chunk.text: yield chunk.text
+    record_llm_usage(usage)
+
+def generate_ai_presentation(prompt: str, cache_mode: str = '') -> dict:
+    return json.loads(llm_gateway.generate(prompt, _generate_presentation_text, cache_mode))
+
+def stream_ai_presentation(prompt: str, cache_mode: str = ''):
+    """Yields the raw JSON text of the presentation as Gemini generates it."""
+    yield from llm_gateway.stream(prompt, _stream_presentation_text, cache_mode)
+
+CHART_SLOTS = (2, 4, 6)  # charts go after slides 3, 5 and 7
+
+def interleave_sections(ai_sections: list[dict], chart_sections: list[dict] | None, complete: bool = True) -> list[dict]:
+    """Merged deck order. With `chart_sections` unknown (None) or `complete` False,
+    returns only the prefix whose positions can no longer change."""
+    merged_sections = []
+    chart_index = 0
+
+    for i, section in enumerate(ai_sections):
+        merged_sections.append(section)
+        
+        # Insert chart after the target slides if we have charts remaining
+        if i in CHART_SLOTS:
+            if chart_sections is None: return merged_sections
+            if chart_index < len(chart_sections):
                 merged_sections.append(chart_sections[chart_index])
                 chart_index += 1
 
-        # Add any remaining charts at the end if we didn't use all target positions
-        while chart_index < len(chart_sections):
-            merged_sections.append(chart_sections[chart_index])
-            chart_index += 1
+    # Add any remaining charts at the end if we didn't use all target positions
+    if complete and chart_sections is not None:
+        merged_sections.extend(chart_sections[chart_index:])
+    return merged_sections
 
-        presentation = {
-            "title": ai_presentation.get("title", "Data Analysis Report"),
-            "sections": merged_sections
-        }
-        
-        # Ensure serializable
-        return jsonify({"presentation": json.loads(json.dumps(presentation, default=lambda o: str(o)))})
+def merge_presentation(ai_presentation: dict, chart_sections: list[dict]) -> dict:
+    # Insert charts after specific text slides (slides 3, 5, and 7 - 0-indexed 2, 4, 6)
+    return {
+        "title": ai_presentation.get("title", "Data Analysis Report"),
+        "sections": interleave_sections(ai_presentation.get("sections") or [], chart_sections)
+    }
+
+_TITLE_RE = re.compile(r'"title"\s*:\s*"((?:[^"\\]|\\.)*)"')
+_SECTIONS_RE = re.compile(r'"sections"\s*:\s*\[')
+
+class SectionStreamParser:
+    """Incremental JSON reader that hands back each object of the top-level
+    `sections` array as soon as its closing brace arrives."""
+    def __init__(self):
+        self.buffer = ''
+        self.title = None
+        self._pos = None
+        self._depth = 0
+        self._start = None
+        self._in_string = False
+        self._escape = False
+        self._closed = False
+
+    def feed(self, text: str) -> list[dict]:
+        self.buffer += text
+        if self.title is None:
+            m = _TITLE_RE.search(self.buffer)
+            if m: self.title = json.loads(f'"{m.group(1)}"')
+        if self._pos is None:
+            m = _SECTIONS_RE.search(self.buffer)
+            if not m: return []
+            self._pos = m.end()
+        found = []
+        buf = self.buffer
+        i = self._pos
+        while i < len(buf) and not self._closed:
+            ch = buf[i]
+            if self._in_string:
+                if self._escape: self._escape = False
+                elif ch == '\\': self._escape = True
+                elif ch == '"': self._in_string = False
+            elif ch == '"':
+                self._in_string = True
+            elif ch == '{':
+                if self._depth == 0: self._start = i
+                self._depth += 1
+            elif ch == '}':
+                self._depth -= 1
+                if self._depth == 0:
+                    try: found.append(json.loads(buf[self._start:i + 1]))
+                    except ValueError: pass
+            elif ch == ']' and self._depth == 0:
+                self._closed = True
+            i += 1
+        self._pos = i
+        return found
+
+# ---------------- Result cache ----------------
+# Re-uploads of the same file are answered from a content-addressed cache:
+# key = sha256(upload bytes) + file type + analysis mode + sheet + pipeline version + model.
+
+PIPELINE_VERSION = "5"  # bump whenever the prompt, brief or chart strategies change output
+RESULT_CACHE_DIR = os.getenv("RESULT_CACHE_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache", "analyze"))
+RESULT_CACHE_MEMORY_MB = float(os.getenv("RESULT_CACHE_MEMORY_MB", "64"))
+RESULT_CACHE_DISK_MB = float(os.getenv("RESULT_CACHE_DISK_MB", "512"))
+RESULT_CACHE_RESCAN_WRITES = 256  # re-walk the disk tier this often to pick up other workers' writes
+RESULT_CACHE_EVICT_TO = 0.9       # evict down to this fraction of the limit so the next writes don't re-walk
+
+class ResultCache:
+    """Two-tier (in-memory LRU + on-disk) cache with size-based eviction."""
+    def __init__(self, directory: str | None, memory_bytes: int, disk_bytes: int):
+        self.directory = directory
+        self.memory_bytes = memory_bytes
+        self.disk_bytes = disk_bytes
+        self._memory = OrderedDict()  # key -> (pickled entry, size)
+        self._memory_used = 0
+        self._disk_used = None  # running estimate; None until the first walk
+        self._writes_since_scan = 0
+        self._lock = threading.Lock()
+        self.stats = {"hits": 0, "memory_hits": 0, "disk_hits": 0, "misses": 0, "writes": 0, "evictions": 0}
+
+    @staticmethod
+    def key_for(stream, *parts: str) -> str:
+        digest = hashlib.sha256()
+        stream.seek(0)
+        for block in iter(lambda: stream.read(1 << 20), b''):
+            digest.update(block)
+        stream.seek(0)
+        for part in (*parts, PIPELINE_VERSION, MODEL_NAME):
+            digest.update(b'\0' + str(part).encode())
+        return digest.hexdigest()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, key[:2], key + '.pkl')
+
+    def get(self, key: str):
+        with self._lock:
+            if key in self._memory:
+                self._memory.move_to_end(key)
+                self.stats["hits"] += 1; self.stats["memory_hits"] += 1
+                return pickle.loads(self._memory[key][0])
+        blob = None
+        if self.directory:
+            try:
+                with open(self._path(key), 'rb') as fh: blob = fh.read()
+                os.utime(self._path(key))  # mtime doubles as LRU clock for the disk tier
+            except OSError:
+                blob = None
+        try:
+            entry = pickle.loads(blob) if blob is not None else None
+        except Exception:
+            entry = None  # written by an incompatible build; treat as a miss
+        with self._lock:
+            if entry is None:
+                self.stats["misses"] += 1
+                return None
+            self.stats["hits"] += 1; self.stats["disk_hits"] += 1
+            self._remember(key, blob)
+        return entry
+
+    def put(self, key: str, entry: dict):
+        blob = pickle.dumps(entry, protocol=pickle.HIGHEST_PROTOCOL)
+        with self._lock:
+            self._remember(key, blob)
+            self.stats["writes"] += 1
+        if self.directory:
+            try:
+                path = self._path(key)
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                try: previous = os.stat(path).st_size
+                except OSError: previous = 0
+                tmp = f"{path}.{os.getpid()}.tmp"
+                with open(tmp, 'wb') as fh: fh.write(blob)
+                os.replace(tmp, path)
+                # Only walk the directory when the running total crosses the limit (or to resync now and then)
+                with self._lock:
+                    if self._disk_used is not None: self._disk_used += len(blob) - previous
+                    self._writes_since_scan += 1
+                    walk = (self._disk_used is None or self._disk_used > self.disk_bytes
+                            or self._writes_since_scan >= RESULT_CACHE_RESCAN_WRITES)
+                if walk: self._evict_disk()
+            except OSError as e:
+                print(f"Result cache write failed: {e}")
+
+    def _remember(self, key: str, blob: bytes):
+        if len(blob) > self.memory_bytes: return
+        if key in self._memory: self._memory_used -= self._memory.pop(key)[1]
+        self._memory[key] = (blob, len(blob))
+        self._memory_used += len(blob)
+        while self._memory_used > self.memory_bytes:
+            _, (_, size) = self._memory.popitem(last=False)
+            self._memory_used -= size
+            self.stats["evictions"] += 1
+
+    def _evict_disk(self):
+        files = []
+        for root, _, names in os.walk(self.directory):
+            for name in names:
+                if not name.endswith('.pkl'): continue
+                path = os.path.join(root, name)
+                try: st = os.stat(path)
+                except OSError: continue
+                files.append((st.st_mtime, st.st_size, path))
+        used = sum(size for _, size, _ in files)
+        target = self.disk_bytes * RESULT_CACHE_EVICT_TO if used > self.disk_bytes else used
+        for _, size, path in sorted(files):
+            if used <= target: break
+            try: os.remove(path)
+            except OSError: continue
+            used -= size
+            with self._lock: self.stats["evictions"] += 1
+        with self._lock:
+            self._disk_used = used; self._writes_since_scan = 0
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {**self.stats, "memory_entries": len(self._memory), "memory_bytes": self._memory_used}
+
+result_cache = ResultCache(RESULT_CACHE_DIR or None, int(RESULT_CACHE_MEMORY_MB * 1024 * 1024), int(RESULT_CACHE_DISK_MB * 1024 * 1024))
+
+# --------------- Analysis pipeline ---------------
+
+SUPPORTED_EXTENSIONS = ('csv', 'xlsx', 'xls', *COLUMNAR_EXTENSIONS)
+
+class AnalysisError(Exception):
+    """A problem with the upload itself; reported to the client with `status`."""
+    def __init__(self, message: str, status: int = 400):
+        super().__init__(message)
+        self.status = status
+
+    def __reduce__(self):  # keeps `status` when raised in a batch worker process
+        return AnalysisError, (str(self), self.status)
+
+class AnalysisCancelled(Exception):
+    pass
+
+def load_dataset(stream, ext: str, mode: str | None = None, sheet: str | None = None):
+    """Parses an upload (CSV, Excel, Parquet, Arrow IPC / Feather) into a DataFrame,
+    or a StreamingDataset / SampledDataset for large CSVs.
+
+    `mode`: 'stream' forces the chunked exact read, 'sample' forces sampling,
+    'exact' never samples; by default sampling kicks in above SAMPLING_THRESHOLD_ROWS.
+    `sheet` selects the Excel sheet (see read_excel_upload).
+    """
+    if ext == 'csv' and (mode in ('stream', 'sample') or upload_size(stream) >= STREAMING_THRESHOLD_MB * 1024 * 1024):
+        # Chunked read straight off the upload stream; only the online aggregates (or the sample) stay in memory
+        with trace_stage('parse'):
+            reader = read_csv_sampled if should_sample(estimate_csv_rows(stream) if mode is None else 0, mode) else read_csv_streaming
+            try:
+                stream.seek(0); return reader(stream)
+            except UnicodeDecodeError:
+                stream.seek(0); return reader(stream, encoding='cp1252')
+    if ext not in SUPPORTED_EXTENSIONS:
+        raise AnalysisError(f"Unsupported file type: {ext}. Please use CSV, Excel, Parquet or Arrow.")
+    if ext in COLUMNAR_EXTENSIONS:
+        # Arrow maps the spooled upload rather than reading it into memory
+        with trace_stage('parse'):
+            return read_columnar_upload(stream, ext)
+    # The upload is already spooled (see UploadRequest), so parsers read it in place
+    with trace_stage('parse'):
+        if ext in ('xlsx', 'xls'):
+            stream.seek(0); return read_excel_upload(stream, ext, sheet)
+        try:
+            stream.seek(0); return pd.read_csv(stream)
+        except UnicodeDecodeError:
+            stream.seek(0); return pd.read_csv(stream, encoding='cp1252')
+
+@dataclass
+class PreparedAnalysis:
+    cache_key: str | None
+    cached: dict | None = None
+    df: object = None  # DataFrame, StreamingDataset or SampledDataset
+    profile: DatasetProfile | None = None
+    prompt: str | None = None
+    brief: dict | None = None
+    aggs: object = None  # aggregate_source(df), shared by the brief, charts and template slides
+    fast: bool = False  # template text slides instead of Gemini
+    cache_mode: str = ''  # passed on to the LLM gateway's response cache
+
+def prepare_analysis(stream, ext: str, mode: str | None = None, cache_mode: str = '',
+                     checkpoint=lambda: None, sheet: str | None = None, fast: bool = False) -> PreparedAnalysis:
+    """Cache lookup, parse, profile and brief: everything before the Gemini call."""
+    lookup = cache_lookup(stream, ext, mode, cache_mode, sheet, fast)
+    if lookup.cached is not None: return lookup
+    return prepare_upload(stream, ext, mode, cache_mode, lookup.cache_key, checkpoint, sheet, fast)
+
+def cache_lookup(stream, ext: str, mode: str | None = None, cache_mode: str = '',
+                 sheet: str | None = None, fast: bool = False) -> PreparedAnalysis:
+    """The upload's cache key, and its cached result if there is one."""
+    # cache_mode 'refresh' recomputes and overwrites the entry, 'bypass' skips the cache entirely
+    with trace_stage('cache_lookup'):
+        # Template decks get their own entries so asking again without ?fast=1 upgrades to Gemini's wording
+        parts = (mode or '', sheet or '', *(('template',) if fast else ()))
+        cache_key = None if cache_mode == 'bypass' else ResultCache.key_for(stream, ext, *parts)
+        cached = result_cache.get(cache_key) if cache_key and cache_mode != 'refresh' else None
+    return PreparedAnalysis(cache_key, cached=cached, fast=fast, cache_mode=cache_mode)
+
+def prepare_upload(stream, ext: str, mode: str | None, cache_mode: str, cache_key: str | None,
+                   checkpoint=lambda: None, sheet: str | None = None, fast: bool = False) -> PreparedAnalysis:
+    """Parse, profile and brief for an upload that missed the cache."""
+    df = load_dataset(stream, ext, mode, sheet)
+    if isinstance(df, pd.DataFrame) and should_sample(len(df), mode):
+        with trace_stage('sample'):
+            df = sample_frame(df)
+    if isinstance(df, SampledDataset):
+        trace_set(sampledRows=len(df.df), strataColumn=df.strata_col)
+    if isinstance(df, pd.DataFrame):
+        with trace_stage('compact'):
+            df, report = compact_frame(df)
+        trace_set(ingestMbBefore=round(report['bytesBefore'] / 1e6, 2), ingestMbAfter=round(report['bytesAfter'] / 1e6, 2))
+    checkpoint()
+    return replace(prepare_dataset(df, cache_key, checkpoint, fast), cache_mode=cache_mode)
+
+def prepare_dataset(df, cache_key: str | None = None, checkpoint=lambda: None, fast: bool = False) -> PreparedAnalysis:
+    """Profile and brief for an already loaded dataset."""
+    # Profile once; brief and charts both read from it
+    with trace_stage('profile'):
+        profile = df.profile if isinstance(df, (StreamingDataset, SampledDataset)) else build_dataset_profile(df)
+    trace = _current_trace.get()
+    if trace is not None: trace.set(rows=profile.rows, columns=len(profile.columns))
+
+    # Build brief + prompt
+    aggs = aggregate_source(df)
+    with trace_stage('brief'):
+        analysis = generate_data_brief_and_prompt(df, profile, aggs)
+    if "error" in analysis: raise AnalysisError(analysis["error"])
+    checkpoint()
+    return PreparedAnalysis(cache_key, df=df, profile=profile, prompt=analysis["prompt"], brief=analysis["brief"],
+                            aggs=aggs, fast=fast)
+
+def finish_analysis(prepared: PreparedAnalysis, presentation: dict, chart_sections: list[dict]) -> dict:
+    # Lets the client tell a template deck apart and re-ask without ?fast=1 for Gemini's wording
+    if prepared.fast: presentation["textSource"] = "template"
+    # Ensure serializable
+    with trace_stage('serialize'):
+        presentation = json.loads(json.dumps(presentation, default=lambda o: str(o)))
+    if prepared.cache_key:
+        result_cache.put(prepared.cache_key, {"profile": prepared.profile, "charts": chart_sections, "presentation": presentation})
+    return presentation
+
+def run_analysis(stream, ext: str, mode: str | None = None, cache_mode: str = '',
+                 cancel_event: threading.Event | None = None, sheet: str | None = None, fast: bool = False) -> tuple[dict, str]:
+    """Full upload -> presentation pipeline. Returns (presentation, cache status)."""
+    def checkpoint():
+        if cancel_event is not None and cancel_event.is_set(): raise AnalysisCancelled()
+
+    prepared = prepare_analysis(stream, ext, mode, cache_mode, checkpoint, sheet, fast)
+    if prepared.cached is not None: return prepared.cached["presentation"], 'HIT'
+    return complete_analysis(prepared, checkpoint), 'MISS' if prepared.cache_key else 'BYPASS'
+
+def complete_analysis(prepared: PreparedAnalysis, checkpoint=lambda: None) -> dict:
+    """Charts and the Gemini call (or the text templates), run side by side, then merge."""
+    # Charts only need pandas, so compute them while the Gemini request is in flight
+    chart_future = submit_traced('chart_specs', generate_chart_specs, prepared.df, prepared.profile, prepared.aggs)
+
+    # Call Gemini for text slides with AI-generated titles
+    try:
+        ai_presentation = text_slides(prepared)
+    except Exception:
+        chart_future.cancel()
+        raise
+
+    # Join at the merge step
+    with trace_stage('chart_wait'):
+        chart_sections = chart_future.result()
+    checkpoint()
+    return finish_analysis(prepared, merge_presentation(ai_presentation, chart_sections), chart_sections)
+
+def text_slides(prepared: PreparedAnalysis) -> dict:
+    if prepared.fast:
+        with trace_stage('template'):
+            return generate_template_presentation(prepared.df, prepared.profile, prepared.brief, prepared.aggs)
+    with trace_stage('llm'):
+        return generate_ai_presentation(prepared.prompt, prepared.cache_mode)
+
+def stream_analysis_events(prepared: PreparedAnalysis, trace: PipelineTrace | None = None):
+    """Server-sent events for one analysis.
+
+    `charts` fires as soon as the chart specs are computed, `title` and
+    `section` (with its final deck index) as Gemini's JSON streams in, and
+    `done` carries the merged presentation once everything has arrived.
+    `trace` is finished here, with the stream's real outcome.
+    """
+    outcome = 'cancelled'  # unless we get to 'done' or an error: the client went away
+    try:
+        for event in _analysis_events(prepared, trace or PipelineTrace()):
+            if event.startswith('event: done'): outcome = 'ok'
+            elif event.startswith('event: error'): outcome = 'error'
+            yield event
+    finally:
+        if trace is not None: trace.finish(outcome)
+
+def _analysis_events(prepared: PreparedAnalysis, trace: PipelineTrace):
+    def sse(event: str, payload) -> str:
+        return f"event: {event}\ndata: {json.dumps(payload, default=lambda o: str(o))}\n\n"
+
+    if prepared.cached is not None:
+        presentation = prepared.cached["presentation"]
+        yield sse('title', {"title": presentation.get("title")})
+        for i, section in enumerate(presentation.get("sections") or []):
+            yield sse('section', {"index": i, "section": section})
+        yield sse('done', {"presentation": presentation, "cache": 'HIT'})
+        return
+
+    events = queue.Queue()
+
+    def pump_llm():
+        try:
+            if prepared.fast:
+                events.put(('text', json.dumps(text_slides(prepared))))
+            else:
+                with trace_stage('llm'):
+                    for text in stream_ai_presentation(prepared.prompt, prepared.cache_mode): events.put(('text', text))
+            events.put(('text_done', None))
+        except Exception as e:
+            events.put(('error', e))
+    # Both run under this request's trace (the generator itself yields, so it can't hold it set)
+    with traced(trace):
+        chart_future = submit_traced('chart_specs', generate_chart_specs, prepared.df, prepared.profile, prepared.aggs)
+        threading.Thread(target=contextvars.copy_context().run, args=(pump_llm,), name="llm-stream", daemon=True).start()
+    chart_future.add_done_callback(lambda f: events.put(('charts', f)))
+
+    parser = SectionStreamParser()
+    ai_sections, chart_sections = [], None
+    text_done = False; title_sent = False; emitted = 0
+    while not (text_done and chart_sections is not None):
+        kind, payload = events.get()
+        if kind == 'error':
+            chart_future.cancel()
+            print(f"Server Error: {payload}")
+            yield sse('error', {"error": describe_error(payload)}); return
+        if kind == 'charts':
+            try:
+                chart_sections = payload.result()
+            except Exception as e:
+                print(f"Server Error: {e}")
+                yield sse('error', {"error": describe_error(e)}); return
+            yield sse('charts', {"charts": chart_sections})
+        elif kind == 'text':
+            ai_sections.extend(parser.feed(payload))
+        elif kind == 'text_done':
+            text_done = True
+            try:
+                # The incremental parse is best-effort; the complete document is authoritative
+                full = json.loads(parser.buffer)
+                parser.title = full.get("title", parser.title)
+                if len(full.get("sections") or []) > len(ai_sections): ai_sections = list(full["sections"])
+            except ValueError:
+                pass
+        if parser.title is not None and not title_sent:
+            yield sse('title', {"title": parser.title}); title_sent = True
+        ready = interleave_sections(ai_sections, chart_sections, complete=text_done)
+        for i in range(emitted, len(ready)):
+            yield sse('section', {"index": i, "section": ready[i]})
+        emitted = len(ready)
+
+    presentation = {"title": parser.title or "Data Analysis Report", "sections": ready}
+    with traced(trace): presentation = finish_analysis(prepared, presentation, chart_sections)
+    yield sse('done', {"presentation": presentation, "cache": 'MISS' if prepared.cache_key else 'BYPASS'})
+
+def describe_error(e: Exception) -> str:
+    if 'No engine for filetype' in str(e):
+        return "Missing dependency: Please install 'openpyxl' (pip install openpyxl) to process Excel files."
+    return f"An unexpected error occurred during processing: {str(e)}"
+
+# --------------- API (MODIFIED for AI-generated titles) ---------------
 
+MAX_UPLOAD_MB = float(os.getenv("MAX_UPLOAD_MB", "1024"))  # 0 disables the limit
+UPLOAD_SPOOL_MEMORY_MB = float(os.getenv("UPLOAD_SPOOL_MEMORY_MB", "1"))  # smaller uploads stay in memory
+UPLOAD_SPOOL_DIR = os.getenv("UPLOAD_SPOOL_DIR") or None  # defaults to the system temp dir
+
+class UploadRequest(Request):
+    """Spools multipart uploads to an unnamed temp file so the parsers (and
+    Arrow's mmap) read them from disk instead of a second in-memory copy."""
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        size = content_length or total_content_length
+        if size is not None and size <= UPLOAD_SPOOL_MEMORY_MB * 1024 * 1024: return io.BytesIO()
+        return tempfile.TemporaryFile('w+b', dir=UPLOAD_SPOOL_DIR)
+
+def upload_too_large(e):
+    return jsonify({"error": f"Upload is larger than the {MAX_UPLOAD_MB:g} MB limit."}), 413
+
+def fast_requested() -> bool:
+    """?fast=1 renders the text slides from templates; FAST_MODE makes that the default."""
+    return request.args.get('fast', '1' if FAST_MODE_DEFAULT else '0') == '1'
+
+def upload_from_request():
+    """Returns (file, ext) or an error response tuple."""
+    if 'file' not in request.files: return None, (jsonify({"error": "No file part"}), 400)
+    file = request.files['file']
+    if file.filename == '': return None, (jsonify({"error": "No selected file"}), 400)
+    if not GEMINI_API_KEY and not fast_requested(): return None, (jsonify({"error": "GEMINI_API_KEY not configured"}), 500)
+    ext = file.filename.split('.')[-1].lower()
+    if ext not in SUPPORTED_EXTENSIONS:
+        return None, (jsonify({"error": f"Unsupported file type: {ext}. Please use CSV, Excel, Parquet or Arrow."}), 400)
+    return (file, ext), None
+
+@api.route('/api/analyze', methods=['POST'])
+def analyze_file():
+    upload, error = upload_from_request()
+    if error: return error
+    file, ext = upload
+
+    # ?timing=1 adds the per-stage breakdown to the body; ?profile=1 (with REQUEST_PROFILING on) captures a profile
+    want_timing = request.args.get('timing') == '1'
+    want_profile = PROFILING_ENABLED and request.args.get('profile') == '1'
+    trace = PipelineTrace()
+    try:
+        with traced(trace), request_profiler(want_profile) as profile_out:
+            presentation, cache_status = run_analysis(file.stream, ext, request.args.get('mode'), request.args.get('cache', '').lower(),
+                                                      sheet=request.args.get('sheet'), fast=fast_requested())
+            body = {"presentation": presentation}
+            with trace_stage('response_json'):
+                response = jsonify(body)
+        trace.finish('ok')
+        if want_timing:
+            body["timing"] = trace.to_json()
+            response = jsonify(body)
+        response.headers['X-Cache'] = cache_status
+        response.headers['Server-Timing'] = trace.server_timing()
+        if profile_out.get('path'): response.headers['X-Profile-Path'] = profile_out['path']
+        return response
+
+    except AnalysisError as e:
+        trace.finish('rejected')
+        return jsonify({"error": str(e)}), e.status
+    except Exception as e:
+        trace.finish('error')
+        print(f"Server Error: {e} [{trace.summary()}]")
+        return jsonify({"error": describe_error(e)}), 500
+
+@api.route('/api/analyze/stream', methods=['POST'])
+def analyze_file_stream():
+    upload, error = upload_from_request()
+    if error: return error
+    file, ext = upload
+
+    # Parse and brief up front so upload errors still come back as plain JSON
+    trace = PipelineTrace()
+    try:
+        with traced(trace):
+            prepared = prepare_analysis(file.stream, ext, request.args.get('mode'), request.args.get('cache', '').lower(),
+                                        sheet=request.args.get('sheet'), fast=fast_requested())
+    except AnalysisError as e:
+        trace.finish('rejected')
+        return jsonify({"error": str(e)}), e.status
     except Exception as e:
-        print(f"Server Error: {e}")
-        if 'No engine for filetype' in str(e):
-            error_message = "Missing dependency: Please install 'openpyxl' (pip install openpyxl) to process Excel files."
+        trace.finish('error')
+        print(f"Server Error: {e} [{trace.summary()}]")
+        return jsonify({"error": describe_error(e)}), 500
+    return Response(stream_analysis_events(prepared, trace), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+# --------------- Analysis jobs ---------------
+# POST returns immediately; the work runs on a bounded pool. Once
+# workers + queue depth jobs are in flight, new submissions get 429.
+# Each job's status is also written to JOB_DIR, so any server process can
+# answer a poll or take a cancel for a job another process is running.
+
+ANALYSIS_WORKERS = int(os.getenv("ANALYSIS_WORKERS", "4"))
+ANALYSIS_QUEUE_DEPTH = int(os.getenv("ANALYSIS_QUEUE_DEPTH", "16"))
+JOB_TTL_SECONDS = int(os.getenv("JOB_TTL_SECONDS", "3600"))
+JOB_SWEEP_SECONDS = int(os.getenv("JOB_SWEEP_SECONDS", "60"))  # how often a submit may clean JOB_DIR
+JOB_DIR = os.getenv("JOB_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache", "jobs"))
+_JOB_ID_RE = re.compile(r'[0-9a-f]{32}')
+
+class CancelFlag(threading.Event):
+    """Set locally, or by another process dropping the `marker` file."""
+    def __init__(self, marker: str | None = None):
+        super().__init__()
+        self.marker = marker
+
+    def is_set(self) -> bool:
+        return super().is_set() or (self.marker is not None and os.path.exists(self.marker))
+
+@dataclass
+class AnalysisJob:
+    id: str
+    path: str
+    ext: str
+    mode: str | None = None
+    cache_mode: str = ''
+    sheet: str | None = None
+    fast: bool = False
+    status: str = 'queued'  # queued | running | done | failed | cancelled
+    created_at: float = field(default_factory=time.time)
+    started_at: float | None = None
+    finished_at: float | None = None
+    presentation: dict | None = None
+    error: str | None = None
+    error_status: int | None = None
+    timing: dict | None = None
+    cancel_event: CancelFlag = field(default_factory=CancelFlag)
+    future: object = None
+
+    def to_json(self) -> dict:
+        out = {"id": self.id, "status": self.status, "createdAt": self.created_at,
+               "startedAt": self.started_at, "finishedAt": self.finished_at}
+        if self.presentation is not None: out["presentation"] = self.presentation
+        if self.error: out["error"] = self.error
+        if self.timing: out["timing"] = self.timing
+        return out
+
+class JobManager:
+    """Runs jobs on this process's pool; with a `directory`, publishes their status there."""
+    def __init__(self, workers: int, queue_depth: int, ttl: int, directory: str | None = None):
+        self.pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="analysis")
+        self.capacity = workers + queue_depth
+        self.ttl = ttl
+        self.directory = directory
+        self.jobs = {}
+        self._in_flight = 0
+        self._swept_at = 0.0
+        self._lock = threading.Lock()
+
+    def _path(self, job_id: str, suffix: str = '.json') -> str:
+        return os.path.join(self.directory, job_id + suffix)
+
+    def submit(self, job: AnalysisJob) -> bool:
+        with self._lock:
+            self._expire()
+            if self._in_flight >= self.capacity: return False
+            self._in_flight += 1
+            self.jobs[job.id] = job
+            sweep = self.directory and time.monotonic() - self._swept_at >= JOB_SWEEP_SECONDS
+            if sweep: self._swept_at = time.monotonic()
+        if sweep: self._sweep()
+        if self.directory: job.cancel_event.marker = self._path(job.id, '.cancel')
+        self._publish(job)
+        job.future = self.pool.submit(self._run, job)
+        return True
+
+    def get(self, job_id: str) -> AnalysisJob | None:
+        with self._lock:
+            return self.jobs.get(job_id)
+
+    def status(self, job_id: str) -> dict | None:
+        """The job's JSON, from memory if this process runs it, else from the shared directory."""
+        job = self.get(job_id)
+        if job is not None: return job.to_json()
+        if not self.directory or not _JOB_ID_RE.fullmatch(job_id or ''): return None
+        try:
+            with open(self._path(job_id)) as fh: status = json.load(fh)
+        except (OSError, ValueError):
+            return None
+        pid = status.pop("pid", None)
+        if status["status"] in ('queued', 'running') and pid and not pid_alive(pid):
+            status.update(status='failed', error="The server process running this job exited. Please resubmit.")
+        return status
+
+    def cancel(self, job_id: str) -> dict | None:
+        job = self.get(job_id)
+        if job is None:
+            # Another process runs it: leave a marker its cancel checks will see
+            status = self.status(job_id)
+            if status is not None and status["status"] in ('queued', 'running'):
+                with open(self._path(job_id, '.cancel'), 'w'): pass
+            return status
+        if job.status in ('done', 'failed', 'cancelled'): return job.to_json()
+        job.cancel_event.set()
+        if job.future is not None and job.future.cancel():
+            # Never started: _run won't execute, so release its slot here
+            self._finish(job, 'cancelled')
+        return job.to_json()
+
+    def _run(self, job: AnalysisJob):
+        if job.cancel_event.is_set():
+            self._finish(job, 'cancelled'); return
+        job.status = 'running'; job.started_at = time.time()
+        self._publish(job)
+        trace = PipelineTrace()
+        status = 'failed'
+        try:
+            with traced(trace), open(job.path, 'rb') as fh:
+                job.presentation, _ = run_analysis(fh, job.ext, job.mode, job.cache_mode, job.cancel_event, job.sheet, job.fast)
+            trace.finish('ok')
+            status = 'done'
+        except AnalysisCancelled:
+            trace.finish('cancelled')
+            status = 'cancelled'
+        except AnalysisError as e:
+            trace.finish('rejected')
+            job.error, job.error_status = str(e), e.status
+        except Exception as e:
+            trace.finish('error')
+            print(f"Job {job.id} failed: {e} [{trace.summary()}]")
+            job.error, job.error_status = describe_error(e), 500
+        finally:
+            job.timing = trace.to_json()
+            self._finish(job, status)
+
+    def _finish(self, job: AnalysisJob, status: str):
+        job.status = status; job.finished_at = time.time()
+        self._publish(job)
+        for path in (job.path, job.cancel_event.marker):
+            if path is None: continue
+            try: os.remove(path)
+            except OSError: pass
+        with self._lock: self._in_flight -= 1
+
+    def _publish(self, job: AnalysisJob):
+        if not self.directory: return
+        os.makedirs(self.directory, exist_ok=True)
+        tmp = f"{self._path(job.id)}.{os.getpid()}.tmp"
+        with open(tmp, 'w') as fh: json.dump({**job.to_json(), "pid": os.getpid()}, fh)
+        os.replace(tmp, self._path(job.id))
+
+    def _expire(self):
+        cutoff = time.time() - self.ttl
+        for job_id in [j.id for j in self.jobs.values() if j.finished_at and j.finished_at < cutoff]:
+            del self.jobs[job_id]
+
+    def _sweep(self):
+        """Removes old files of every process's jobs, including ones whose process has
+        since exited; a job still queued or running keeps its files however old."""
+        if not os.path.isdir(self.directory): return
+        cutoff = time.time() - self.ttl
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            try:
+                if os.path.getmtime(path) >= cutoff: continue
+                status = self.status(name.split('.')[0])
+                if status is not None and status["status"] in ('queued', 'running'): continue
+                os.remove(path)
+            except OSError: continue
+
+job_manager = JobManager(ANALYSIS_WORKERS, ANALYSIS_QUEUE_DEPTH, JOB_TTL_SECONDS, JOB_DIR or None)
+
+@api.route('/api/analyze/jobs', methods=['POST'])
+def submit_analysis_job():
+    upload, error = upload_from_request()
+    if error: return error
+    file, ext = upload
+
+    # The request's upload is gone once we return, so park it on disk for the worker
+    fd, path = tempfile.mkstemp(prefix="analyze-", suffix=f".{ext}")
+    with os.fdopen(fd, 'wb') as fh: shutil.copyfileobj(file.stream, fh)
+    job = AnalysisJob(id=uuid.uuid4().hex, path=path, ext=ext, mode=request.args.get('mode'),
+                      cache_mode=request.args.get('cache', '').lower(), sheet=request.args.get('sheet'), fast=fast_requested())
+    if not job_manager.submit(job):
+        os.remove(path)
+        response = jsonify({"error": "Analysis queue is full, please retry shortly."})
+        response.headers['Retry-After'] = '5'
+        return response, 429
+    response = jsonify({"jobId": job.id, "status": job.status})
+    response.headers['Location'] = f"/api/analyze/jobs/{job.id}"
+    return response, 202
+
+@api.route('/api/analyze/jobs/<job_id>', methods=['GET'])
+def get_analysis_job(job_id):
+    job = job_manager.status(job_id)
+    if job is None: return jsonify({"error": "Job not found"}), 404
+    return jsonify(job)
+
+@api.route('/api/analyze/jobs/<job_id>', methods=['DELETE'])
+def cancel_analysis_job(job_id):
+    job = job_manager.cancel(job_id)
+    if job is None: return jsonify({"error": "Job not found"}), 404
+    return jsonify(job)
+
+# --------------- Batch analysis ---------------
+# Many files (or every sheet of a workbook) in one request. Parse, profile,
+# brief and chart specs run in worker processes, so the GIL-bound pandas work
+# uses every core; the Gemini calls go out from here as each file finishes,
+# capped by the LLM gateway.
+
+BATCH_MAX_FILES = int(os.getenv("BATCH_MAX_FILES", "50"))
+BATCH_PROCESSES = int(os.getenv("BATCH_PROCESSES", str(os.cpu_count() or 1)))
+
+_batch_pool = None
+_batch_pool_lock = threading.Lock()
+
+def batch_pool() -> ProcessPoolExecutor:
+    """The batch worker processes, started on first use (so never in a pre-fork master).
+
+    forkserver children fork from a clean single-threaded server that has this
+    module imported already, instead of from a request thread of this process.
+    """
+    global _batch_pool
+    with _batch_pool_lock:
+        if _batch_pool is None:
+            methods = multiprocessing.get_all_start_methods()
+            ctx = multiprocessing.get_context('forkserver' if 'forkserver' in methods else 'spawn')
+            if 'forkserver' in methods and __name__ != '__main__': ctx.set_forkserver_preload([__name__])
+            _batch_pool = ProcessPoolExecutor(max_workers=BATCH_PROCESSES, mp_context=ctx)
+        return _batch_pool
+
+def reset_batch_pool(pool: ProcessPoolExecutor):
+    """Drops a pool whose worker died (e.g. OOM-killed) so the next batch starts a fresh one."""
+    global _batch_pool
+    with _batch_pool_lock:
+        if _batch_pool is pool: _batch_pool = None
+    pool.shutdown(wait=False, cancel_futures=True)
+
+def analyze_batch_item(path: str, ext: str, sheet: str | None, mode: str | None, cache_mode: str,
+                       cache_key: str | None, fast: bool):
+    """Runs in a batch worker: parse, brief and chart specs for one file that missed
+    the cache (plus the template text in fast mode). The frame stays in the worker;
+    only the profile, prompt and specs go back. The parent counts the request."""
+    trace = PipelineTrace()
+    with traced(trace), open(path, 'rb') as fh:
+        prepared = prepare_upload(fh, ext, mode, cache_mode, cache_key, sheet=sheet, fast=fast)
+        with trace_stage('chart_specs'):
+            charts = generate_chart_specs(prepared.df, prepared.profile, prepared.aggs)
+        text = text_slides(prepared) if fast else None
+    trace.set(totalMs=round((time.perf_counter() - trace.started) * 1000, 2))
+    return replace(prepared, df=None, aggs=None), charts, text, trace.to_json()
+
+@dataclass
+class BatchItem:
+    name: str
+    path: str
+    ext: str
+    sheet: str | None = None
+    result: dict | None = None  # set early for files rejected before the pool
+    profile: DatasetProfile | None = None
+
+def spool_batch(files, sheet: str | None, per_sheet: bool, directory: str) -> list[BatchItem]:
+    """Writes each upload to `directory` (worker processes can't read the request's
+    streams) and expands workbooks into one item per sheet when `per_sheet`."""
+    items = []
+    for file in files:
+        ext = file.filename.split('.')[-1].lower()
+        if ext not in SUPPORTED_EXTENSIONS:
+            items.append(BatchItem(file.filename, '', ext, result={
+                "error": f"Unsupported file type: {ext}. Please use CSV, Excel, Parquet or Arrow.", "status": 400}))
+            continue
+        fd, path = tempfile.mkstemp(dir=directory, suffix=f".{ext}")
+        with os.fdopen(fd, 'wb') as fh: shutil.copyfileobj(file.stream, fh)
+        if not (per_sheet and ext in ('xlsx', 'xls')):
+            items.append(BatchItem(file.filename, path, ext, sheet)); continue
+        try:
+            with pd.ExcelFile(path, engine=excel_engine(ext)) as book: sheets = book.sheet_names
+        except Exception as e:
+            items.append(BatchItem(file.filename, path, ext, result={"error": f"Could not read the .{ext} file: {e}", "status": 400}))
+            continue
+        items += [BatchItem(file.filename, path, ext, str(name)) for name in sheets]
+    return items
+
+def run_batch(items: list[BatchItem], mode: str | None, cache_mode: str, fast: bool, want_timing: bool = False):
+    """Fills in each item's result: its presentation and cache status, or an error."""
+    pool = batch_pool()
+    pending = {}
+    queued = sum(item.result is None for item in items)
+    llm_pool = ThreadPoolExecutor(max_workers=max(1, min(queued, LLM_MAX_CONCURRENCY)), thread_name_prefix="batch-llm")
+    llm_calls = {}
+
+    def fail(item: BatchItem, e: Exception):
+        if isinstance(e, AnalysisError): item.result = {"error": str(e), "status": e.status}; outcome = 'rejected'
         else:
-            error_message = f"An unexpected error occurred during processing: {str(e)}"
-        return jsonify({"error": error_message}), 500
+            print(f"Batch item {item.name} failed: {e}")
+            item.result = {"error": describe_error(e), "status": 500}; outcome = 'error'
+        metrics.inc('analyze_batch_items_total', outcome=outcome)
+
+    def done(item: BatchItem, prepared: PreparedAnalysis, presentation: dict, cache_status: str, timing: dict):
+        item.profile = prepared.profile
+        item.result = {"presentation": presentation, "cache": cache_status}
+        if want_timing: item.result["timing"] = timing
+        metrics.inc('analyze_batch_items_total', outcome='ok')
+
+    try:
+        # Looked up here, not in the workers: results are stored by this process, and the
+        # in-memory tier would never be seen from a worker
+        for item in items:
+            if item.result is not None: continue
+            trace = PipelineTrace()
+            try:
+                with traced(trace), open(item.path, 'rb') as fh:
+                    lookup = cache_lookup(fh, item.ext, mode, cache_mode, item.sheet, fast)
+            except Exception as e:
+                fail(item, e); continue
+            if lookup.cached is not None:
+                cached = replace(lookup, profile=lookup.cached["profile"])
+                done(item, cached, lookup.cached["presentation"], 'HIT', trace.to_json()); continue
+            pending[pool.submit(analyze_batch_item, item.path, item.ext, item.sheet, mode, cache_mode,
+                                lookup.cache_key, fast)] = item
+
+        # Gemini calls start as soon as their file's compute is done, not after the whole batch
+        for future in as_completed(pending):
+            item = pending[future]
+            try:
+                prepared, charts, text, timing = future.result()
+            except BrokenProcessPool as e:
+                reset_batch_pool(pool); fail(item, e); continue
+            except Exception as e:
+                fail(item, e); continue
+            if text is not None:
+                done(item, prepared, finish_analysis(prepared, merge_presentation(text, charts), charts), cache_status_for(prepared), timing)
+            else:
+                llm_calls[llm_pool.submit(generate_ai_presentation, prepared.prompt, prepared.cache_mode)] = (item, prepared, charts, timing)
+        for future in as_completed(llm_calls):
+            item, prepared, charts, timing = llm_calls[future]
+            try:
+                presentation = finish_analysis(prepared, merge_presentation(future.result(), charts), charts)
+            except Exception as e:
+                fail(item, e); continue
+            done(item, prepared, presentation, cache_status_for(prepared), timing)
+    finally:
+        llm_pool.shutdown(wait=False, cancel_futures=True)
+
+def cache_status_for(prepared: PreparedAnalysis) -> str:
+    return 'MISS' if prepared.cache_key else 'BYPASS'
+
+def compare_datasets(items: list[BatchItem]) -> dict | None:
+    """Cross-file slides from the per-file profiles: totals, averages and record
+    counts for the key metric most of the files share."""
+    rows = []
+    for item in items:
+        profile = item.profile
+        main_col = determine_key_metric(profile) if profile else None
+        if main_col is None or not profile[main_col].count: continue
+        stats = profile[main_col]
+        name = f"{item.name} [{item.sheet}]" if item.sheet is not None and item.ext in ('xlsx', 'xls') else item.name
+        rows.append((name, profile.label(main_col), stats.sum, stats.mean, profile.rows))
+    if len(rows) < 2: return None
+    metric = Counter(r[1] for r in rows).most_common(1)[0][0]
+    table = pd.DataFrame([r for r in rows if r[1] == metric], columns=['file', 'metric', 'total', 'average', 'records'])
+    if len(table) < 2: return None
+    totals = table.set_index('file')['total'].sort_values(ascending=False)
+    averages = table.set_index('file')['average'].sort_values(ascending=True)
+    records = table.set_index('file')['records'].sort_values()
+    sections = [
+        _slide(f"{metric} Across Files", [
+            f"{totals.index[0]} has the highest total {metric} at {format_number(totals.iloc[0])}, "
+            f"{_percent(totals.iloc[0], totals.sum())} of all {len(totals)} files.",
+            f"{averages.index[-1]} has the highest average {metric} ({format_number(averages.iloc[-1])}); "
+            f"{averages.index[0]} the lowest ({format_number(averages.iloc[0])}).",
+            f"Record counts run from {int(records.iloc[0]):,} in {records.index[0]} to {int(records.iloc[-1]):,} in {records.index[-1]}.",
+        ]),
+        {"sectionTitle": f"Total {metric} by File", "isChartSlide": True, "chartType": "bar",
+         "chartData": [{"category": str(f), "value": round(to_float(v), 2), "color": safe_color(i)}
+                       for i, (f, v) in enumerate(totals.head(8).items())]},
+        {"sectionTitle": f"Average {metric} by File", "isChartSlide": True, "chartType": "horizontal",
+         "chartData": [{"category": str(f), "value": round(to_float(v), 2), "color": safe_color(i)}
+                       for i, (f, v) in enumerate(averages.tail(8).items())]},
+    ]
+    return {"title": f"{metric} Comparison", "metric": metric, "files": list(table['file']), "sections": sections}
+
+@api.route('/api/analyze/batch', methods=['POST'])
+def analyze_batch():
+    """Multipart `files` (repeatable). ?per_sheet=1 analyzes each workbook sheet on its
+    own, ?compare=1 adds cross-file comparison slides; ?fast, ?mode, ?cache and
+    ?sheet work as on /api/analyze."""
+    files = [f for f in request.files.getlist('files') + request.files.getlist('file') if f.filename]
+    if not files: return jsonify({"error": "No files uploaded"}), 400
+    if len(files) > BATCH_MAX_FILES: return jsonify({"error": f"At most {BATCH_MAX_FILES} files per batch."}), 400
+    fast = fast_requested()
+    if not GEMINI_API_KEY and not fast: return jsonify({"error": "GEMINI_API_KEY not configured"}), 500
+
+    want_timing = request.args.get('timing') == '1'
+    trace = PipelineTrace()
+    directory = tempfile.mkdtemp(prefix="batch-")
+    try:
+        with traced(trace):
+            with trace_stage('spool'):
+                items = spool_batch(files, request.args.get('sheet'), request.args.get('per_sheet') == '1', directory)
+            trace.set(files=len(items))
+            with trace_stage('batch'):
+                run_batch(items, request.args.get('mode'), request.args.get('cache', '').lower(), fast, want_timing)
+            body = {"results": [{"file": item.name, **({"sheet": item.sheet} if item.sheet is not None else {}), **item.result}
+                                for item in items]}
+            if request.args.get('compare') == '1':
+                with trace_stage('compare'):
+                    body["comparison"] = compare_datasets([item for item in items if item.profile is not None])
+        trace.finish('ok')
+    except Exception as e:
+        trace.finish('error')
+        print(f"Server Error: {e} [{trace.summary()}]")
+        return jsonify({"error": describe_error(e)}), 500
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+    if want_timing: body["timing"] = trace.to_json()
+    response = jsonify(body)
+    response.headers['Server-Timing'] = trace.server_timing()
+    return response
+
+# --------------- Dataset sessions ---------------
+# A session keeps a StreamingDataset (moments, t-digests, per-group and
+# monthly sums/counts) on disk, so a daily append only pushes the new rows
+# through the accumulators and the deck is rebuilt from the merged state.
+
+SESSION_DIR = os.getenv("SESSION_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache", "sessions"))
+SESSION_TTL_SECONDS = int(os.getenv("SESSION_TTL_SECONDS", str(30 * 24 * 3600)))
+_SESSION_ID_RE = re.compile(r'[0-9a-f]{32}')
+SESSION_LOCK_STRIPES = 64  # sessions share this many locks (and lock files), so neither grows with traffic
+
+def upload_chunks(stream, ext: str, sheet: str | None = None, encoding: str | None = None):
+    """Yields an upload's rows as frames of at most INGEST_CHUNK_ROWS, nothing pruned."""
+    if ext == 'csv':
+        stream.seek(0)
+        yield from pd.read_csv(stream, chunksize=INGEST_CHUNK_ROWS, encoding=encoding)
+        return
+    if ext in COLUMNAR_EXTENSIONS: df = read_columnar_upload(stream, ext, prune=False)
+    else: stream.seek(0); df = read_excel_upload(stream, ext, sheet, prune=False)
+    for start in range(0, len(df), INGEST_CHUNK_ROWS):
+        yield df.iloc[start:start + INGEST_CHUNK_ROWS]
+
+class DatasetSessions:
+    """Pickled StreamingDatasets keyed by session id; in memory only when `directory` is None."""
+    def __init__(self, directory: str | None, ttl: int):
+        self.directory = directory
+        self.ttl = ttl
+        self._memory = {}
+        self._locks = [threading.Lock() for _ in range(SESSION_LOCK_STRIPES)]
+
+    def _path(self, session_id: str) -> str:
+        return os.path.join(self.directory, session_id + '.pkl')
+
+    @contextmanager
+    def _locked(self, session_id: str):
+        """Striped lock for a (validated) session id: a thread lock, plus flock on a
+        shared lock file so appends serialize across worker processes too."""
+        stripe = int(session_id[:8], 16) % SESSION_LOCK_STRIPES
+        with self._locks[stripe]:
+            if fcntl is None or not self.directory:
+                yield; return
+            lock_dir = os.path.join(self.directory, '.locks')
+            os.makedirs(lock_dir, exist_ok=True)
+            with open(os.path.join(lock_dir, f"{stripe}.lock"), 'a') as fh:
+                fcntl.flock(fh, fcntl.LOCK_EX)
+                try: yield
+                finally: fcntl.flock(fh, fcntl.LOCK_UN)
+
+    def _exists(self, session_id: str) -> bool:
+        if not _SESSION_ID_RE.fullmatch(session_id or ''): return False
+        if not self.directory: return session_id in self._memory
+        return os.path.exists(self._path(session_id))
+
+    def _remove(self, session_id: str) -> bool:
+        if not self.directory: return self._memory.pop(session_id, None) is not None
+        try: os.remove(self._path(session_id)); return True
+        except OSError: return False
+
+    def _load(self, session_id: str) -> dict | None:
+        if not _SESSION_ID_RE.fullmatch(session_id or ''): return None
+        if not self.directory:
+            blob = self._memory.get(session_id)
+            return pickle.loads(blob) if blob is not None else None
+        try:
+            if time.time() - os.path.getmtime(self._path(session_id)) > self.ttl:
+                self._remove(session_id); return None
+            with open(self._path(session_id), 'rb') as fh: entry = pickle.load(fh)
+        except OSError:
+            return None
+        except Exception:
+            entry = None  # written by an incompatible build
+        if not isinstance(entry, dict) or entry.get("version") != PIPELINE_VERSION:
+            self._remove(session_id); return None
+        return entry
+
+    def _save(self, session_id: str, entry: dict):
+        entry["updated_at"] = time.time()
+        if not self.directory:
+            self._memory[session_id] = pickle.dumps(entry, protocol=pickle.HIGHEST_PROTOCOL); return
+        os.makedirs(self.directory, exist_ok=True)
+        tmp = f"{self._path(session_id)}.{os.getpid()}.tmp"
+        with open(tmp, 'wb') as fh: pickle.dump(entry, fh, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, self._path(session_id))
+
+    def _ingest(self, dataset_factory, stream, ext: str, sheet: str | None) -> tuple[StreamingDataset, int]:
+        for encoding in (None, 'cp1252'):
+            dataset = dataset_factory()  # fresh copy per attempt, so a failed decode leaves nothing half-merged
+            before = dataset.rows
+            try:
+                with trace_stage('append'):
+                    for chunk in upload_chunks(stream, ext, sheet, encoding):
+                        missing = [str(c) for c in dataset.columns or [] if c not in chunk.columns]
+                        if missing: raise AnalysisError(f"Appended rows are missing the session's columns: {', '.join(missing)}")
+                        dataset.add_chunk(chunk)
+                return dataset, dataset.rows - before
+            except UnicodeDecodeError:
+                if encoding is not None or ext != 'csv': raise
+
+    def create(self, stream, ext: str, sheet: str | None = None) -> tuple[str, StreamingDataset]:
+        self._sweep()
+        session_id = uuid.uuid4().hex
+        dataset, _ = self._ingest(StreamingDataset, stream, ext, sheet)
+        with self._locked(session_id):
+            self._save(session_id, {"dataset": dataset, "created_at": time.time(), "version": PIPELINE_VERSION})
+        return session_id, dataset
+
+    def append(self, session_id: str, stream, ext: str, sheet: str | None = None) -> tuple[StreamingDataset, int] | None:
+        if not self._exists(session_id): return None  # before any lock, so unknown ids cost nothing
+        with self._locked(session_id):
+            entry = self._load(session_id)
+            if entry is None: return None
+            dataset, added = self._ingest(lambda: copy.deepcopy(entry["dataset"]), stream, ext, sheet)
+            entry["dataset"] = dataset
+            self._save(session_id, entry)
+        return dataset, added
+
+    def get(self, session_id: str) -> dict | None:
+        return self._load(session_id)
+
+    def delete(self, session_id: str) -> bool:
+        if not self._exists(session_id): return False
+        with self._locked(session_id):  # waits for an in-flight append
+            return self._remove(session_id)
+
+    def _sweep(self):
+        if not self.directory or not os.path.isdir(self.directory): return
+        cutoff = time.time() - self.ttl
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            try:
+                if name.endswith('.pkl') and os.path.getmtime(path) < cutoff: self.delete(name[:-4])
+            except OSError: continue
+
+dataset_sessions = DatasetSessions(SESSION_DIR or None, SESSION_TTL_SECONDS)
+
+def session_response(trace: PipelineTrace, session_id: str, dataset: StreamingDataset, appended: int, status: int = 200):
+    """Session summary, plus the refreshed presentation unless ?analyze=0."""
+    body = {"sessionId": session_id, "rows": dataset.rows, "appendedRows": appended, "columns": dataset.columns or []}
+    try:
+        if request.args.get('analyze', '1') != '0':
+            with traced(trace):
+                body["presentation"] = complete_analysis(prepare_dataset(dataset, fast=fast_requested()))
+        trace.finish('ok')
+    except AnalysisError as e:
+        trace.finish('rejected')
+        return jsonify({**body, "error": str(e)}), e.status
+    except Exception as e:
+        trace.finish('error')
+        print(f"Server Error: {e} [{trace.summary()}]")
+        return jsonify({**body, "error": describe_error(e)}), 500
+    response = jsonify(body)
+    response.status_code = status
+    response.headers['Server-Timing'] = trace.server_timing()
+    return response
+
+@api.route('/api/datasets', methods=['POST'])
+def create_dataset_session():
+    upload, error = upload_from_request()
+    if error: return error
+    file, ext = upload
+    trace = PipelineTrace()
+    try:
+        with traced(trace):
+            session_id, dataset = dataset_sessions.create(file.stream, ext, request.args.get('sheet'))
+    except AnalysisError as e:
+        trace.finish('rejected')
+        return jsonify({"error": str(e)}), e.status
+    except Exception as e:
+        trace.finish('error')
+        print(f"Server Error: {e} [{trace.summary()}]")
+        return jsonify({"error": describe_error(e)}), 500
+    response = session_response(trace, session_id, dataset, dataset.rows, 201)
+    if isinstance(response, Response): response.headers['Location'] = f"/api/datasets/{session_id}"
+    return response
+
+@api.route('/api/datasets/<session_id>/append', methods=['POST'])
+def append_to_dataset_session(session_id):
+    upload, error = upload_from_request()
+    if error: return error
+    file, ext = upload
+    trace = PipelineTrace()
+    try:
+        with traced(trace):
+            appended = dataset_sessions.append(session_id, file.stream, ext, request.args.get('sheet'))
+    except AnalysisError as e:
+        trace.finish('rejected')
+        return jsonify({"error": str(e)}), e.status
+    except Exception as e:
+        trace.finish('error')
+        print(f"Server Error: {e} [{trace.summary()}]")
+        return jsonify({"error": describe_error(e)}), 500
+    if appended is None: return jsonify({"error": "Dataset session not found"}), 404
+    return session_response(trace, session_id, *appended)
+
+@api.route('/api/datasets/<session_id>/analyze', methods=['POST'])
+def analyze_dataset_session(session_id):
+    entry = dataset_sessions.get(session_id)
+    if entry is None: return jsonify({"error": "Dataset session not found"}), 404
+    return session_response(PipelineTrace(), session_id, entry["dataset"], 0)
+
+@api.route('/api/datasets/<session_id>', methods=['GET'])
+def get_dataset_session(session_id):
+    entry = dataset_sessions.get(session_id)
+    if entry is None: return jsonify({"error": "Dataset session not found"}), 404
+    dataset = entry["dataset"]
+    return jsonify({"sessionId": session_id, "rows": dataset.rows, "columns": dataset.columns or [],
+                    "createdAt": entry["created_at"], "updatedAt": entry["updated_at"]})
+
+@api.route('/api/datasets/<session_id>', methods=['DELETE'])
+def delete_dataset_session(session_id):
+    if not dataset_sessions.delete(session_id): return jsonify({"error": "Dataset session not found"}), 404
+    return '', 204
+
+@api.route('/metrics', methods=['GET'])
+def prometheus_metrics():
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+metrics.counter('analyze_cache_events_total', 'Result cache hits, misses, writes and evictions.',
+                lambda: {(('event', event),): value for event, value in result_cache.snapshot().items()
+                         if event not in ('memory_entries', 'memory_bytes')})
+metrics.gauge('analyze_jobs_in_flight', 'Queued plus running analysis jobs.', lambda: {(): job_manager._in_flight})
+metrics.gauge('llm_gateway_active_calls', 'Gemini calls currently holding a gateway slot.', lambda: {(): llm_gateway.active})
+
+@api.route('/api/analyze/cache', methods=['GET'])
+def cache_stats():
+    return jsonify(result_cache.snapshot())
+
+# --------------- App factory ---------------
+
+def warm_up():
+    """Imports the lazily loaded parser engines and runs one tiny analysis, so a
+    pre-fork server's master has every code path loaded before it forks."""
+    for module in ('openpyxl', 'python_calamine', 'xlrd'):
+        if importlib.util.find_spec(module): importlib.import_module(module)
+    df = pd.DataFrame({"order_date": pd.date_range("2024-01-01", periods=64, freq="W").strftime("%Y-%m-%d"),
+                       "region": ["North", "South", "East", "West"] * 16, "amount": np.arange(64, dtype=float)})
+    prepared = prepare_dataset(compact_frame(df)[0], fast=True)
+    generate_chart_specs(prepared.df, prepared.profile, prepared.aggs)
+    generate_template_presentation(prepared.df, prepared.profile, prepared.brief, prepared.aggs)
+
+def create_app(preload: bool = False) -> Flask:
+    """WSGI app. `preload` is for a pre-fork master (see gunicorn.conf.py): it warms
+    up, then freezes the GC so workers share the loaded modules copy-on-write."""
+    flask_app = Flask(__name__)
+    flask_app.request_class = UploadRequest
+    flask_app.config['MAX_CONTENT_LENGTH'] = int(MAX_UPLOAD_MB * 1024 * 1024) or None
+    flask_app.register_blueprint(api)
+    flask_app.register_error_handler(RequestEntityTooLarge, upload_too_large)
+    CORS(flask_app)
+    if preload:
+        warm_up()
+        gc.freeze()  # keeps the collector from touching (and so copying) the master's pages in each worker
+    return flask_app
+
+def __getattr__(name: str):
+    # `app` for `flask run`, benchmark.py and the tests, built on first use so that
+    # importing the module for create_app() (gunicorn) doesn't build a second app
+    if name == 'app':
+        flask_app = globals()['app'] = create_app()
+        return flask_app
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 if __name__ == '__main__':
     if not GEMINI_API_KEY:
         print("ERROR: GEMINI_API_KEY is not set. Please configure your .env file.")
-    app.run(debug=True, port=5000)
\ No newline at end of file
+    create_app().run(debug=True, port=5000)
\ No newline at end of file
@@ -0,0 +1,201 @@
+"""Benchmarks for the analysis pipeline.
+
+Builds synthetic datasets, times each pipeline stage on its own (wall, CPU and
+peak traced memory), then runs /api/analyze end to end against a fake Gemini
+client so no network or API key is needed. Results go to a JSON file that
+--compare can diff against an earlier run.
+
+    python benchmark.py --rows 10000,100000,1000000 --output bench.json
+    python benchmark.py --rows 100000 --compare bench.json
+"""
+import argparse
+import io
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+import tracemalloc
+import types as pytypes
+
+import numpy as np
+import pandas as pd
+
+os.environ.setdefault("GEMINI_API_KEY", "benchmark")
+os.environ.setdefault("RESULT_CACHE_DIR", "")
+import app as backend  # noqa: E402
+
+# ---------------- Synthetic data ----------------
+
+def make_dataset(rows: int, numeric_cols: int = 4, categorical_cols: int = 4, cardinality: int = 12,
+                 null_rate: float = 0.02, date_cols: int = 1, text_cols: int = 1, seed: int = 0) -> pd.DataFrame:
+    rng = np.random.default_rng(seed)
+    data = {}
+    for i in range(date_cols):
+        days = rng.integers(0, 3 * 365, rows)
+        data[f"order_date_{i}" if i else "order_date"] = (pd.Timestamp("2022-01-01") + pd.to_timedelta(days, unit="D")).strftime("%Y-%m-%d")
+    for i in range(categorical_cols):
+        labels = np.array([f"segment_{i}_{k}" for k in range(max(2, cardinality))], dtype=object)
+        data[f"category_{i}"] = labels[rng.zipf(1.6, rows) % len(labels)]
+    for i in range(numeric_cols):
+        if i % 2 == 0: data[f"amount_{i}"] = rng.gamma(2.0, 150.0 * (i + 1), rows).round(2)
+        else: data[f"units_{i}"] = rng.integers(0, 50 * (i + 1), rows)
+    for i in range(text_cols):
+        data[f"note_{i}"] = [f"free text {k}" for k in rng.integers(0, rows * 10, rows)]
+    df = pd.DataFrame(data)
+    if null_rate > 0:
+        for col in df.columns:
+            if col.startswith("order_date"): continue
+            mask = rng.random(rows) < null_rate
+            if df[col].dtype.kind in "iu": df[col] = df[col].astype("float64")
+            df.loc[mask, col] = np.nan
+    return df
+
+# ---------------- Fake Gemini ----------------
+
+FAKE_PRESENTATION = {
+    "title": "Benchmark Report",
+    "sections": [{"sectionTitle": f"Section {i + 1}", "points": ["Point one", "Point two", "Point three"]} for i in range(8)],
+}
+
+class FakeGeminiModels:
+    def __init__(self, latency: float):
+        self.latency = latency
+
+    def generate_content(self, model, contents, config=None):
+        time.sleep(self.latency)
+        return pytypes.SimpleNamespace(text=json.dumps(FAKE_PRESENTATION), usage_metadata=None)
+
+    def generate_content_stream(self, model, contents, config=None):
+        text = json.dumps(FAKE_PRESENTATION)
+        step = max(1, len(text) // 16)
+        for i in range(0, len(text), step):
+            time.sleep(self.latency / 16)
+            yield pytypes.SimpleNamespace(text=text[i:i + step], usage_metadata=None)
+
+class FakeGeminiClient:
+    def __init__(self, latency: float = 0.0):
+        self.models = FakeGeminiModels(latency)
+
+def install_fake_client(latency: float):
+    backend.GEMINI_API_KEY = backend.GEMINI_API_KEY or "benchmark"
+    backend._genai_client = FakeGeminiClient(latency)
+
+# ---------------- Measurement ----------------
+
+def measure(fn, memory: bool = True, repeat: int = 1) -> tuple[dict, object]:
+    """Best-of-`repeat` wall/CPU time, then one traced run for peak memory."""
+    result = None
+    wall, cpu = float("inf"), float("inf")
+    for _ in range(repeat):
+        w0, c0 = time.perf_counter(), time.process_time()
+        result = fn()
+        wall = min(wall, time.perf_counter() - w0); cpu = min(cpu, time.process_time() - c0)
+    out = {"wall_s": round(wall, 4), "cpu_s": round(cpu, 4)}
+    if memory:
+        tracemalloc.start()
+        try:
+            fn()
+            out["peak_mb"] = round(tracemalloc.get_traced_memory()[1] / 1e6, 2)
+        finally:
+            tracemalloc.stop()
+    return out, result
+
+def run_stages(df: pd.DataFrame, csv_bytes: bytes, args) -> list[dict]:
+    records = []
+    def record(stage, fn):
+        stats, result = measure(fn, memory=not args.no_memory, repeat=args.repeat)
+        records.append({"stage": stage, **stats})
+        print(f"  {stage:<18} {stats['wall_s']:>8.3f}s wall {stats['cpu_s']:>8.3f}s cpu"
+              + (f" {stats['peak_mb']:>9.1f} MB peak" if "peak_mb" in stats else ""))
+        return result
+
+    parsed = record("parse_csv", lambda: pd.read_csv(io.BytesIO(csv_bytes)))
+    if backend.pa is not None:
+        buffer = io.BytesIO(); df.to_parquet(buffer); parquet_bytes = buffer.getvalue()
+        record("parse_parquet", lambda: backend.read_columnar_upload(io.BytesIO(parquet_bytes), "parquet"))
+    compacted, _ = record("compact", lambda: backend.compact_frame(parsed))
+    profile = record("profile", lambda: backend.build_dataset_profile(compacted))
+    record("detect_time", lambda: backend.detect_time_column(compacted))
+    analysis = record("brief", lambda: backend.generate_data_brief_and_prompt(compacted, profile))
+    record("template", lambda: backend.generate_template_presentation(compacted, profile, analysis["brief"]))
+    record("chart_specs", lambda: backend.generate_chart_specs(compacted, profile))
+    streamed = record("stream_ingest", lambda: backend.read_csv_streaming(io.BytesIO(csv_bytes)))
+    record("stream_brief", lambda: backend.generate_data_brief_and_prompt(streamed))
+    record("stream_charts", lambda: backend.generate_chart_specs(streamed))
+    sampled = record("sample", lambda: backend.sample_frame(parsed))
+    record("sample_brief", lambda: backend.generate_data_brief_and_prompt(sampled))
+    record("sample_charts", lambda: backend.generate_chart_specs(sampled))
+
+    client = backend.app.test_client()
+    def call_endpoint(query=""):
+        response = client.post("/api/analyze?cache=bypass" + query, data={"file": (io.BytesIO(csv_bytes), "bench.csv")})
+        if response.status_code != 200: raise RuntimeError(response.get_json())
+        return response
+    record("endpoint", call_endpoint)
+    record("endpoint_fast", lambda: call_endpoint("&fast=1"))
+    return records
+
+def git_commit() -> str | None:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=os.path.dirname(os.path.abspath(__file__)),
+                                       stderr=subprocess.DEVNULL, text=True).strip()
+    except Exception:
+        return None
+
+def compare(results: dict, baseline_path: str, threshold: float) -> int:
+    with open(baseline_path) as fh: baseline = json.load(fh)
+    old = {(r["rows"], r["stage"]): r for r in baseline.get("results", [])}
+    regressions = 0
+    print(f"\nCompared with {baseline_path} (commit {baseline.get('meta', {}).get('commit')}):")
+    for r in results["results"]:
+        prev = old.get((r["rows"], r["stage"]))
+        if not prev: continue
+        for metric in ("wall_s", "peak_mb"):
+            if metric not in r or metric not in prev or not prev[metric]: continue
+            change = (r[metric] - prev[metric]) / prev[metric] * 100
+            flag = "REGRESSION" if change > threshold else ""
+            if flag: regressions += 1
+            print(f"  {r['rows']:>10} {r['stage']:<18} {metric:<7} {prev[metric]:>10} -> {r[metric]:>10} ({change:+.1f}%) {flag}")
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the analysis pipeline on synthetic data.")
+    parser.add_argument("--rows", default="10000,100000,1000000", help="comma-separated row counts (10k to 10M)")
+    parser.add_argument("--numeric-cols", type=int, default=4)
+    parser.add_argument("--categorical-cols", type=int, default=4)
+    parser.add_argument("--cardinality", type=int, default=12)
+    parser.add_argument("--null-rate", type=float, default=0.02)
+    parser.add_argument("--date-cols", type=int, default=1)
+    parser.add_argument("--text-cols", type=int, default=1)
+    parser.add_argument("--llm-latency", type=float, default=0.0, help="seconds the fake Gemini call sleeps")
+    parser.add_argument("--repeat", type=int, default=1)
+    parser.add_argument("--no-memory", action="store_true", help="skip the traced run (faster)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default="benchmark-results.json")
+    parser.add_argument("--compare", help="earlier results file to diff against")
+    parser.add_argument("--threshold", type=float, default=10.0, help="%% slowdown counted as a regression")
+    args = parser.parse_args()
+
+    install_fake_client(args.llm_latency)
+    results = {
+        "meta": {"commit": git_commit(), "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"), "python": platform.python_version(),
+                 "pandas": pd.__version__, "numpy": np.__version__, "machine": platform.machine(), "cpus": os.cpu_count(),
+                 "params": {k: v for k, v in vars(args).items() if k not in ("output", "compare")}},
+        "results": [],
+    }
+    for rows in [int(r) for r in args.rows.split(",") if r]:
+        df = make_dataset(rows, args.numeric_cols, args.categorical_cols, args.cardinality,
+                          args.null_rate, args.date_cols, args.text_cols, args.seed)
+        csv_bytes = df.to_csv(index=False).encode()
+        print(f"{rows:,} rows x {df.shape[1]} cols ({len(csv_bytes) / 1e6:.1f} MB CSV)")
+        for record in run_stages(df, csv_bytes, args):
+            results["results"].append({"rows": rows, "cols": df.shape[1], **record})
+
+    with open(args.output, "w") as fh: json.dump(results, fh, indent=2)
+    print(f"\nWrote {args.output}")
+    if args.compare and compare(results, args.compare, args.threshold): sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,47 @@
+"""Gunicorn settings for serving the backend on every core.
+
+    pip install gunicorn
+    gunicorn -c gunicorn.conf.py
+
+The app is built once in the master (preload_app) so pandas, numpy, the
+Gemini SDK and the parser engines are loaded before forking and shared
+copy-on-write by the workers.
+
+Per-process state to keep in mind: the in-memory result cache, the LLM
+gateway's slots (LLM_MAX_CONCURRENCY applies to each worker) and the job
+queue (ANALYSIS_WORKERS and ANALYSIS_QUEUE_DEPTH are per worker). Each worker
+also starts its own pool of BATCH_PROCESSES processes on its first
+/api/analyze/batch request, so BATCH_PROCESSES defaults to the cores divided
+by the workers.
+
+The on-disk result cache, dataset sessions and job status (JOB_DIR) are
+shared, so any worker can answer a job poll or cancel.
+Workers also flush their metrics to METRICS_DIR, so /metrics reports the
+whole server whichever worker answers the scrape.
+"""
+import multiprocessing
+import os
+import shutil
+import tempfile
+
+wsgi_app = "app:create_app(preload=True)"
+bind = os.getenv("BIND", "0.0.0.0:5000")
+workers = int(os.getenv("WEB_CONCURRENCY", str(multiprocessing.cpu_count())))
+worker_class = "gthread"  # threads keep SSE streams and Gemini waits from pinning a whole worker
+threads = int(os.getenv("WEB_THREADS", "4"))
+preload_app = True
+timeout = int(os.getenv("WEB_TIMEOUT", "300"))  # a large upload plus the Gemini call
+graceful_timeout = 30
+max_requests = int(os.getenv("WEB_MAX_REQUESTS", "1000"))  # recycle workers to bound heap fragmentation
+max_requests_jitter = 100
+
+# One worker per core already fills the box; keep each worker's chart pool small
+os.environ.setdefault("COMPUTE_WORKERS", "2")
+# and split the cores between the workers' batch pools instead of giving each worker one per core
+os.environ.setdefault("BATCH_PROCESSES", str(max(1, multiprocessing.cpu_count() // workers)))
+
+# One directory per server run; removed on shutdown so old workers' counters don't carry over
+os.environ.setdefault("METRICS_DIR", os.path.join(tempfile.gettempdir(), f"slidesky-metrics-{os.getpid()}"))
+
+def on_exit(server):
+    shutil.rmtree(os.environ["METRICS_DIR"], ignore_errors=True)
@@ -0,0 +1,134 @@
+"""Local stand-in for the Gemini API, for load-testing the backend offline.
+
+Answers generateContent / streamGenerateContent with a canned 8-section
+presentation after a configurable delay, and can inject rate limits (a
+quota on concurrent calls and/or a random 429 rate) so the gateway's
+retries and concurrency cap can be exercised.
+
+    python llm_stub.py --port 8089 --latency 2 --quota 4 --rate-limit 0.05
+    GEMINI_BASE_URL=http://127.0.0.1:8089 GEMINI_API_KEY=stub python app.py
+
+GET /stats returns call counts and the peak concurrency seen.
+"""
+import argparse
+import json
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+PRESENTATION = {
+    "title": "Stub Presentation",
+    "sections": [{"sectionTitle": "About the Dataset", "points": ["Stub record count and total.", "Stub average, median and spread."]}]
+    + [{"sectionTitle": f"Stub Insight {i}", "points": [f"Stub finding {i}.{k}" for k in range(1, 4)]} for i in range(2, 9)],
+}
+
+class StubState:
+    def __init__(self, args):
+        self.args = args
+        self.lock = threading.Lock()
+        self.active = 0
+        self.stats = {"calls": 0, "served": 0, "rateLimited": 0, "peakConcurrency": 0}
+
+    def enter(self) -> bool:
+        """Counts the call; False when it should be rejected with a 429."""
+        with self.lock:
+            self.stats["calls"] += 1
+            over_quota = self.args.quota and self.active >= self.args.quota
+            if over_quota or random.random() < self.args.rate_limit:
+                self.stats["rateLimited"] += 1
+                return False
+            self.active += 1
+            self.stats["peakConcurrency"] = max(self.stats["peakConcurrency"], self.active)
+            return True
+
+    def leave(self):
+        with self.lock:
+            self.active -= 1
+            self.stats["served"] += 1
+
+def response_body(text: str, prompt_chars: int, final: bool = True) -> dict:
+    body = {"candidates": [{"content": {"role": "model", "parts": [{"text": text}]}, "index": 0}]}
+    if final:
+        body["candidates"][0]["finishReason"] = "STOP"
+        completion = max(1, len(json.dumps(PRESENTATION)) // 4)
+        body["usageMetadata"] = {"promptTokenCount": prompt_chars // 4, "candidatesTokenCount": completion,
+                                 "totalTokenCount": prompt_chars // 4 + completion}
+    return body
+
+def make_handler(state: StubState):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, fmt, *args):
+            if state.args.verbose: super().log_message(fmt, *args)
+
+        def send_json(self, status: int, body: dict):
+            payload = json.dumps(body).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(payload)))
+            if status == 429: self.send_header("Retry-After", "1")
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def do_GET(self):
+            if self.path.rstrip("/") == "/stats":
+                with state.lock: return self.send_json(200, {**state.stats, "active": state.active})
+            self.send_json(404, {"error": {"code": 404, "message": "Not found", "status": "NOT_FOUND"}})
+
+        def do_POST(self):
+            request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+            match = re.search(r"/models/([^/:]+):(generateContent|streamGenerateContent)", self.path)
+            if not match:
+                return self.send_json(404, {"error": {"code": 404, "message": "Not found", "status": "NOT_FOUND"}})
+            if not state.enter():
+                return self.send_json(429, {"error": {"code": 429, "message": "Resource has been exhausted (stub quota).",
+                                                      "status": "RESOURCE_EXHAUSTED"}})
+            try:
+                prompt_chars = sum(len(p.get("text", "")) for c in request.get("contents", []) for p in c.get("parts", []))
+                delay = max(0.0, random.gauss(state.args.latency, state.args.jitter))
+                text = json.dumps(PRESENTATION)
+                if match.group(2) == "generateContent":
+                    time.sleep(delay)
+                    return self.send_json(200, response_body(text, prompt_chars))
+                # Streaming: server-sent events, one JSON response per chunk
+                self.send_response(200)
+                self.send_header("Content-Type", "text/event-stream")
+                self.send_header("Connection", "close")
+                self.end_headers()
+                step = max(1, len(text) // state.args.stream_chunks)
+                pieces = [text[i:i + step] for i in range(0, len(text), step)]
+                for i, piece in enumerate(pieces):
+                    time.sleep(delay / len(pieces))
+                    event = response_body(piece, prompt_chars, final=i == len(pieces) - 1)
+                    self.wfile.write(f"data: {json.dumps(event)}\r\n\r\n".encode())
+                    self.wfile.flush()
+                self.close_connection = True
+            finally:
+                state.leave()
+
+    return Handler
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve a fake Gemini API for offline load tests.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8089)
+    parser.add_argument("--latency", type=float, default=1.0, help="mean seconds per generation")
+    parser.add_argument("--jitter", type=float, default=0.2, help="std-dev of the latency in seconds")
+    parser.add_argument("--quota", type=int, default=0, help="concurrent calls served before answering 429 (0 = unlimited)")
+    parser.add_argument("--rate-limit", type=float, default=0.0, help="probability of a random 429")
+    parser.add_argument("--stream-chunks", type=int, default=8, help="SSE chunks per streamed response")
+    parser.add_argument("--verbose", action="store_true")
+    args = parser.parse_args()
+    server = ThreadingHTTPServer((args.host, args.port), make_handler(StubState(args)))
+    server.daemon_threads = True
+    print(f"Gemini stub listening on http://{args.host}:{args.port} (latency {args.latency}s, quota {args.quota or 'none'})")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == "__main__":
+    main()
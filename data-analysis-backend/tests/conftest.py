@@ -0,0 +1,8 @@
+import os
+import sys
+
+# Keep the tests off the on-disk caches and job/session directories
+for name in ("RESULT_CACHE_DIR", "SESSION_DIR", "JOB_DIR", "METRICS_DIR"):
+    os.environ[name] = ""
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
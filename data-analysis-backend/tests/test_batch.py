@@ -0,0 +1,30 @@
+import io
+
+import app
+
+
+def upload(offset: int) -> io.BytesIO:
+    rows = "".join(f"{['North', 'South', 'East'][i % 3]},{i * 1.5 + offset},{i % 7}\n" for i in range(200))
+    return io.BytesIO(("region,amount,qty\n" + rows).encode())
+
+
+def requests_total(outcome: str = "ok") -> float:
+    return app.metrics._snapshot()["analyze_requests_total"].get((("outcome", outcome),), 0)
+
+
+def test_batch_hits_the_in_memory_cache_and_counts_one_request():
+    client = app.app.test_client()
+
+    def post():
+        files = [(upload(i), f"f{i}.csv") for i in range(2)]
+        return client.post("/api/analyze/batch?fast=1&compare=1", data={"files": files}).get_json()
+
+    before = requests_total()
+    first = post()
+    assert [r["cache"] for r in first["results"]] == ["MISS", "MISS"]
+    assert requests_total() == before + 1
+    again = post()
+    assert [r["cache"] for r in again["results"]] == ["HIT", "HIT"]
+    assert [r["presentation"] for r in again["results"]] == [r["presentation"] for r in first["results"]]
+    assert again["comparison"] == first["comparison"]
+    assert requests_total() == before + 2
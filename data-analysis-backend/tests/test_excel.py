@@ -0,0 +1,39 @@
+import io
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import app
+
+openpyxl = pytest.importorskip("openpyxl")
+
+
+def workbook(header: list, rows: list) -> bytes:
+    book = openpyxl.Workbook()
+    sheet = book.active
+    sheet.append(header)
+    for row in rows:
+        sheet.append(row)
+    buffer = io.BytesIO()
+    book.save(buffer)
+    return buffer.getvalue()
+
+
+def test_pruned_openpyxl_read_keeps_blank_header_names(monkeypatch):
+    rng = np.random.default_rng(0)
+    rows = [[f"ORD-{i:06d}", ["North", "South", "East"][i % 3], float(rng.lognormal(8, 1)), int(rng.integers(1, 9))]
+            for i in range(app.INGEST_SAMPLE_ROWS + 500)]
+    data = workbook(["order_id", "region", None, "qty"], rows)
+    monkeypatch.setattr(app, "EXCEL_ENGINE", "openpyxl")
+
+    df = app.read_excel_upload(io.BytesIO(data), "xlsx")
+    expected = pd.read_excel(io.BytesIO(data), engine="openpyxl")
+
+    # order_id is free text, so it is pruned; the blank header after it keeps its sheet position's name
+    assert "order_id" in df.attrs["pruned_profiles"]
+    assert list(df.columns) == ["region", "Unnamed: 2", "qty"]
+    pd.testing.assert_frame_equal(df, expected.drop(columns="order_id"), check_dtype=False)
+    profile = app.build_dataset_profile(df)
+    assert list(profile.columns) == list(expected.columns)
+    assert app.determine_key_metric(profile) == "Unnamed: 2"
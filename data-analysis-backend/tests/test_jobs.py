@@ -0,0 +1,37 @@
+import json
+import os
+import time
+import uuid
+
+import app
+
+
+def status_file(directory, status: str, age: float, pid: int | None = None) -> str:
+    job_id = uuid.uuid4().hex
+    path = os.path.join(directory, job_id + ".json")
+    with open(path, "w") as fh: json.dump({"id": job_id, "status": status, "pid": pid or os.getpid()}, fh)
+    os.utime(path, (time.time() - age, time.time() - age))
+    return job_id
+
+
+def test_sweep_keeps_unfinished_jobs_however_old(tmp_path):
+    manager = app.JobManager(1, 1, ttl=60, directory=str(tmp_path))
+    running, queued, done = (status_file(tmp_path, s, age=120) for s in ("running", "queued", "done"))
+    orphaned = status_file(tmp_path, "running", age=120, pid=2 ** 22 + 1)  # its process is gone
+    fresh = status_file(tmp_path, "done", age=0)
+    manager._sweep()
+    assert manager.status(running)["status"] == "running"
+    assert manager.status(queued)["status"] == "queued"
+    assert manager.status(fresh)["status"] == "done"
+    assert manager.status(done) is None and manager.status(orphaned) is None
+
+
+def test_submit_sweeps_the_directory_at_most_once_per_interval(tmp_path, monkeypatch):
+    manager = app.JobManager(1, 4, ttl=60, directory=str(tmp_path))
+    sweeps = []
+    monkeypatch.setattr(manager, "_sweep", lambda: sweeps.append(1))
+    monkeypatch.setattr(manager, "_run", lambda job: manager._finish(job, "done"))
+    for _ in range(3):
+        path = tmp_path / f"{uuid.uuid4().hex}.csv"; path.write_text("a\n1\n")
+        assert manager.submit(app.AnalysisJob(id=uuid.uuid4().hex, path=str(path), ext="csv", mode=None))
+    assert sweeps == [1]
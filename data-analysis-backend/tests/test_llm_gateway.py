@@ -0,0 +1,177 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+
+import pytest
+
+from app import LLMGateway, metrics
+
+
+def gateway(max_concurrency: int = 4, cache_ttl: float = 60, max_retries: int = 3) -> LLMGateway:
+    return LLMGateway(max_concurrency, cache_ttl, cache_entries=16, max_retries=max_retries,
+                      backoff_base=0.001, backoff_max=0.005)
+
+
+class FakeModel:
+    """Stands in for the Gemini call: fails `failures` times, then answers after `delay`."""
+    def __init__(self, delay: float = 0.0, failures: int = 0, error=ConnectionError):
+        self.delay, self.failures, self.error = delay, failures, error
+        self.calls = 0
+        self.active = self.peak = 0
+        self._lock = threading.Lock()
+
+    def __call__(self, prompt: str) -> str:
+        with self._lock:
+            self.calls += 1
+            self.active += 1; self.peak = max(self.peak, self.active)
+            fail = self.calls <= self.failures
+        try:
+            time.sleep(self.delay)
+            if fail: raise self.error("boom")
+            return f"answer to {prompt}"
+        finally:
+            with self._lock: self.active -= 1
+
+    def stream(self, prompt: str):
+        text = self(prompt)
+        return iter([text[:5], text[5:]])
+
+
+def test_retries_transient_errors_then_succeeds():
+    model = FakeModel(failures=2)
+    assert gateway().generate("p", model) == "answer to p"
+    assert model.calls == 3
+
+
+def test_gives_up_after_max_retries():
+    model = FakeModel(failures=10)
+    with pytest.raises(ConnectionError):
+        gateway(max_retries=2).generate("p", model)
+    assert model.calls == 3
+
+
+def test_does_not_retry_other_errors():
+    model = FakeModel(failures=1, error=ValueError)
+    with pytest.raises(ValueError):
+        gateway().generate("p", model)
+    assert model.calls == 1
+
+
+def test_backoff_honours_retry_after():
+    error = ConnectionError("slow down")
+    error.response = SimpleNamespace(headers={"Retry-After": "2"})
+    assert gateway()._backoff(0, error) == 2.0
+    assert gateway()._backoff(0, ConnectionError()) <= 0.001
+
+
+def test_identical_prompts_in_flight_share_one_call():
+    model = FakeModel(delay=0.2)
+    gw = gateway()
+    with ThreadPoolExecutor(8) as pool:
+        results = list(pool.map(lambda _: gw.generate("same", model), range(8)))
+    assert results == ["answer to same"] * 8
+    assert model.calls == 1
+
+
+def test_waiters_see_the_leaders_failure():
+    model = FakeModel(delay=0.2, failures=99, error=ValueError)
+    gw = gateway()
+    with ThreadPoolExecutor(4) as pool:
+        futures = [pool.submit(gw.generate, "same", model) for _ in range(4)]
+        for future in futures:
+            with pytest.raises(ValueError): future.result()
+    assert model.calls == 1
+    assert gw._inflight == {}
+
+
+def test_concurrency_is_capped_and_slots_are_returned():
+    model = FakeModel(delay=0.05)
+    gw = gateway(max_concurrency=2)
+    with ThreadPoolExecutor(8) as pool:
+        list(pool.map(lambda i: gw.generate(f"prompt {i}", model), range(8)))
+    assert model.calls == 8
+    assert model.peak == 2
+    assert gw.active == 0
+
+
+class SlowDown(ConnectionError):
+    response = SimpleNamespace(headers={"Retry-After": "0.3"})
+
+
+def test_slots_are_given_back_while_backing_off():
+    gw = gateway(max_concurrency=1)
+    flaky, steady = FakeModel(failures=1, error=SlowDown), FakeModel()
+    with ThreadPoolExecutor(2) as pool:
+        first = pool.submit(gw.generate, "flaky", flaky)
+        time.sleep(0.05)  # the flaky call has failed and is sleeping
+        started = time.monotonic()
+        assert pool.submit(gw.generate, "steady", steady).result() == "answer to steady"
+        assert time.monotonic() - started < 0.15
+        assert first.result() == "answer to flaky"
+
+
+def test_cache_modes():
+    model = FakeModel()
+    gw = gateway()
+    gw.generate("p", model); gw.generate("p", model)
+    assert model.calls == 1
+    gw.generate("p", model, cache_mode="refresh")
+    assert model.calls == 2
+    gw.generate("q", model, cache_mode="bypass"); gw.generate("q", model)
+    assert model.calls == 4
+
+
+def test_cache_entries_expire():
+    model = FakeModel()
+    gw = gateway(cache_ttl=0.05)
+    gw.generate("p", model); time.sleep(0.1); gw.generate("p", model)
+    assert model.calls == 2
+
+
+def test_stream_retries_before_the_first_chunk_and_holds_its_slot():
+    model = FakeModel(failures=1)
+    gw = gateway()
+    chunks = gw.stream("p", model.stream)
+    first = next(chunks)
+    assert gw.active == 1
+    assert first + "".join(chunks) == "answer to p"
+    assert gw.active == 0 and model.calls == 2
+    # The joined text is cached for the next caller
+    assert list(gw.stream("p", model.stream)) == ["answer to p"] and model.calls == 2
+
+
+def test_identical_streams_in_flight_share_one_call():
+    model = FakeModel(delay=0.2)
+    gw = gateway()
+    with ThreadPoolExecutor(6) as pool:
+        results = list(pool.map(lambda _: "".join(gw.stream("same", model.stream)), range(6)))
+    assert results == ["answer to same"] * 6
+    assert model.calls == 1
+    assert gw._streaming == {} and gw.active == 0
+
+
+def failure_events() -> float:
+    return metrics._snapshot()["llm_gateway_events_total"].get((("event", "failure"),), 0)
+
+
+def test_stream_errors_after_the_first_chunk_reach_every_caller_and_count_as_failures():
+    started = threading.Event()
+
+    def broken(prompt):
+        yield "partial"
+        started.wait(1); time.sleep(0.1)
+        raise ConnectionError("dropped")
+
+    gw, before = gateway(), failure_events()
+    leader = gw.stream("p", broken)
+    assert next(leader) == "partial"
+    with ThreadPoolExecutor(1) as pool:
+        follower = pool.submit(lambda: list(gw.stream("p", broken)))
+        time.sleep(0.05); started.set()
+        with pytest.raises(ConnectionError): list(leader)
+        with pytest.raises(ConnectionError): follower.result()
+    assert failure_events() == before + 1
+    assert gw._streaming == {} and gw.active == 0
+    # Nothing half-streamed was cached
+    assert list(gw.stream("p", FakeModel().stream)) == ["answe", "r to p"]
@@ -0,0 +1,68 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from app import StratifiedSampler, weighted_quantile
+
+
+def population(rows: int = 40_000, seed: int = 0) -> pd.DataFrame:
+    rng = np.random.default_rng(seed)
+    region = rng.choice(["North", "South", "East", "West", "Islands"], size=rows, p=[0.4, 0.3, 0.2, 0.09, 0.01])
+    scale = pd.Series(region).map({"North": 1.0, "South": 2.0, "East": 0.5, "West": 4.0, "Islands": 10.0}).to_numpy()
+    amount = rng.lognormal(3, 1, rows) * scale
+    amount[rng.random(rows) < 0.05] = np.nan
+    return pd.DataFrame({"region": region, "amount": amount})
+
+
+def draw(df: pd.DataFrame, size: int, seed: int, strata_col="region", min_per_stratum: int = 100):
+    sampler = StratifiedSampler(strata_col, size, min_per_stratum, seed)
+    for start in range(0, len(df), 10_000):
+        sampler.add(df.iloc[start:start + 10_000])
+    return sampler.result()
+
+
+def test_full_sample_reproduces_the_exact_figures():
+    df = population(5_000)
+    estimate = draw(df, size=10_000, seed=1).estimate("amount", "region")
+    sums = df.groupby("region")["amount"].sum()
+    for key, exact in (("total", df["amount"].sum()), ("mean", df["amount"].mean()),
+                       ("topShare", sums.max() / df["amount"].sum())):
+        value, low, high = estimate[key]
+        # Every row sampled: no finite-population variance left
+        assert value == pytest.approx(exact) and low == pytest.approx(exact) and high == pytest.approx(exact)
+    assert estimate["median"][0] == pytest.approx(df["amount"].median(), rel=1e-3)
+
+
+def test_rare_strata_are_kept_and_reweighted():
+    df = population()
+    sample = draw(df, size=2_000, seed=3)
+    counts = sample.df["region"].value_counts()
+    assert counts["Islands"] >= min(100, (df["region"] == "Islands").sum())
+    # Weights expand each stratum back to its population size
+    weights = pd.Series(sample.weights).groupby(sample.df["region"].to_numpy()).sum()
+    assert weights.to_dict() == pytest.approx(df["region"].value_counts().to_dict())
+
+
+def test_95_percent_intervals_cover_the_truth():
+    df = population()
+    sums = df.groupby("region")["amount"].sum()
+    truth = {"total": df["amount"].sum(), "mean": df["amount"].mean(), "median": df["amount"].median(),
+             "topShare": sums.max() / df["amount"].sum()}
+    trials = 120
+    covered = dict.fromkeys(truth, 0)
+    for seed in range(trials):
+        estimate = draw(df, size=2_000, seed=seed).estimate("amount", "region")
+        for key, exact in truth.items():
+            value, low, high = estimate[key]
+            assert low <= value <= high
+            covered[key] += low <= exact <= high
+    # Nominal 95%; over 120 trials 0.87 is about 3.5 standard errors below it
+    for key, hits in covered.items():
+        assert hits / trials >= 0.87, (key, hits / trials)
+
+
+def test_weighted_quantile_matches_pandas_for_equal_weights():
+    values = np.random.default_rng(5).normal(size=1_001)
+    series = pd.Series(values)
+    assert weighted_quantile(values, np.ones(len(values)), 0.5) == pytest.approx(series.quantile(0.5))
+    assert np.isnan(weighted_quantile(np.array([]), np.array([]), 0.5))
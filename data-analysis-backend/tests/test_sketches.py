@@ -0,0 +1,90 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from app import DistinctCounter, HyperLogLog, QuantileSketch
+
+QUANTILES = (0.001, 0.01, 0.1, 0.25, 0.5, 0.75, 0.9, 0.99, 0.999)
+
+
+def rank_error(values: np.ndarray, estimate: float, q: float) -> float:
+    """How far (as a fraction of the data) the estimate's rank is from q."""
+    below = np.searchsorted(values, estimate, side='left') / len(values)
+    at_or_below = np.searchsorted(values, estimate, side='right') / len(values)
+    return 0.0 if below <= q <= at_or_below else min(abs(below - q), abs(at_or_below - q))
+
+
+@pytest.mark.parametrize("distribution", ["uniform", "lognormal", "integers"])
+def test_quantile_sketch_matches_pandas_in_rank(distribution):
+    rng = np.random.default_rng(1)
+    values = {"uniform": lambda: rng.uniform(-50, 50, 200_000),
+              "lognormal": lambda: rng.lognormal(3, 1.5, 200_000),
+              "integers": lambda: rng.integers(0, 20, 200_000).astype(float)}[distribution]()
+    sketch = QuantileSketch()
+    for chunk in np.array_split(values, 37):
+        sketch.add(chunk)
+    exact = pd.Series(values)
+    ordered = np.sort(values)
+    assert sketch.count == len(values)
+    for q in QUANTILES:
+        estimate = sketch.quantile(q)
+        # t-digest bounds the rank error, tighter in the tails
+        assert rank_error(ordered, estimate, q) <= 0.002 + 0.01 * q * (1 - q), (q, estimate, exact.quantile(q))
+    assert (sketch.min, sketch.max) == (values.min(), values.max())
+
+
+def test_quantile_sketch_merge_matches_single_sketch():
+    rng = np.random.default_rng(2)
+    values = rng.normal(100, 15, 100_000)
+    whole, parts = QuantileSketch(), []
+    whole.add(values)
+    for chunk in np.array_split(values, 8):
+        part = QuantileSketch(); part.add(chunk); parts.append(part)
+    merged = parts[0]
+    for part in parts[1:]:
+        merged.merge(part)
+    ordered = np.sort(values)
+    assert merged.count == whole.count == len(values)
+    for q in QUANTILES:
+        assert rank_error(ordered, merged.quantile(q), q) <= 0.002 + 0.01 * q * (1 - q)
+        assert rank_error(ordered, whole.quantile(q), q) <= 0.002 + 0.01 * q * (1 - q)
+
+
+def test_quantile_sketch_ignores_nan_and_small_inputs_are_exact():
+    sketch = QuantileSketch()
+    assert np.isnan(sketch.quantile(0.5))
+    sketch.add(np.array([5.0, np.nan, 1.0, 3.0]))
+    assert sketch.count == 3
+    assert sketch.quantile(0.5) == pd.Series([5.0, 1.0, 3.0]).quantile(0.5)
+
+
+@pytest.mark.parametrize("cardinality", [100, 5_000, 50_000, 500_000])
+def test_hyperloglog_error_within_bounds(cardinality):
+    rng = np.random.default_rng(cardinality)
+    values = pd.Series(rng.choice(cardinality * 4, size=cardinality, replace=False)).astype(str)
+    # Duplicates must not move the estimate
+    values = pd.concat([values, values.sample(frac=0.5, random_state=0)], ignore_index=True)
+    hll = HyperLogLog()
+    for start in range(0, len(values), 100_000):
+        hll.add(values.iloc[start:start + 100_000])
+    exact = values.nunique()
+    # p=14 has a standard error of 1.04 / sqrt(16384) ~ 0.8%; allow 4 sigma
+    assert abs(hll.count() - exact) <= max(2, 0.033 * exact)
+
+
+def test_hyperloglog_merge_is_the_union():
+    a, b, both = HyperLogLog(), HyperLogLog(), HyperLogLog()
+    left, right = pd.Series(np.arange(0, 60_000)), pd.Series(np.arange(40_000, 100_000))
+    a.add(left); b.add(right); both.add(left); both.add(right)
+    a.merge(b)
+    assert a.count() == both.count()
+    assert abs(a.count() - 100_000) <= 3_300
+
+
+def test_distinct_counter_is_exact_below_the_limit_and_close_above():
+    counter = DistinctCounter(limit=1_000)
+    counter.add(pd.Series(["a", "b", None, "a"]))
+    assert counter.exact and counter.count() == 2
+    counter.add(pd.Series(np.arange(20_000)).astype(str))
+    assert not counter.exact
+    assert abs(counter.count() - 20_002) <= 0.033 * 20_002
@@ -0,0 +1,40 @@
+import io
+import json
+
+import pandas as pd
+
+import app
+
+DECK = {"title": "T", "sections": [{"sectionTitle": f"S{i}", "points": ["p"]} for i in range(8)]}
+
+
+def prepared_analysis():
+    df = pd.DataFrame({"region": ["North", "South", "East", "West"] * 50, "amount": range(200)})
+    return app.prepare_analysis(io.BytesIO(df.to_csv(index=False).encode()), "csv", cache_mode="bypass")
+
+
+def stages(trace):
+    return {s["stage"] for s in trace.to_json()["stages"]}
+
+
+def test_stream_trace_records_llm_and_charts_and_finishes_ok(monkeypatch):
+    text = json.dumps(DECK)
+    monkeypatch.setattr(app, "stream_ai_presentation", lambda prompt, cache_mode='': iter([text[:40], text[40:]]))
+    trace = app.PipelineTrace()
+    events = list(app.stream_analysis_events(prepared_analysis(), trace))
+    assert events[-1].startswith("event: done")
+    assert {"llm", "chart_specs", "serialize"} <= stages(trace)
+    assert "totalMs" in trace.to_json()
+
+
+def test_stream_trace_counts_a_late_llm_error_as_error(monkeypatch):
+    def failing(prompt, cache_mode=''):
+        yield '{"title": "T", "sections": ['
+        raise ConnectionError("dropped")
+    monkeypatch.setattr(app, "stream_ai_presentation", failing)
+    finished = []
+    trace = app.PipelineTrace()
+    monkeypatch.setattr(trace, "finish", finished.append)
+    events = list(app.stream_analysis_events(prepared_analysis(), trace))
+    assert events[-1].startswith("event: error")
+    assert finished == ["error"]
@@ -0,0 +1,58 @@
+import json
+
+import pytest
+
+from app import SectionStreamParser
+
+DECK = {
+    "title": "Sales \"Q3\" Review {draft}",
+    "sections": [
+        {"sectionTitle": "About the Dataset", "points": ["1,200 records", "Average is 4.5"]},
+        {"sectionTitle": "Braces { and } in text", "points": ["A ] bracket", "Quote \" and backslash \\ here"]},
+        {"sectionTitle": "Nested", "points": ["x"], "meta": {"inner": {"deep": [1, 2, {"k": "}"}]}}},
+        {"sectionTitle": "Ünïcode – ✓", "points": ["€1,000 → €2,000"]},
+    ],
+}
+
+
+def feed_all(chunks):
+    parser = SectionStreamParser()
+    found = []
+    for chunk in chunks:
+        found.extend(parser.feed(chunk))
+    return parser, found
+
+
+@pytest.mark.parametrize("indent", [None, 2])
+def test_every_two_way_split(indent):
+    text = json.dumps(DECK, indent=indent, ensure_ascii=False)
+    for cut in range(len(text) + 1):
+        parser, found = feed_all([text[:cut], text[cut:]])
+        assert found == DECK["sections"], cut
+        assert parser.title == DECK["title"], cut
+
+
+def test_one_character_at_a_time():
+    text = json.dumps(DECK)
+    parser = SectionStreamParser()
+    found = []
+    for ch in text:
+        new = parser.feed(ch)
+        found.extend(new)
+        # A section is handed back as soon as its closing brace arrives
+        if new: assert ch == '}'
+    assert found == DECK["sections"]
+    assert parser.title == DECK["title"]
+
+
+def test_stops_at_the_end_of_the_sections_array():
+    text = json.dumps({"title": "T", "sections": [{"sectionTitle": "A", "points": []}]})[:-1]
+    parser, found = feed_all([text, ', "extra": [{"sectionTitle": "B"}]}'])
+    assert found == [{"sectionTitle": "A", "points": []}]
+
+
+def test_nothing_before_the_sections_key():
+    parser = SectionStreamParser()
+    assert parser.feed('{"title": "T", "sect') == []
+    assert parser.title == "T"
+    assert parser.feed('ions": [{"a": 1}') == [{"a": 1}]
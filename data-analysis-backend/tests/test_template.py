@@ -0,0 +1,29 @@
+import io
+import re
+
+import pytest
+
+import app
+
+
+def upload(amounts) -> io.BytesIO:
+    rows = "".join(f"{['North', 'South', 'East'][i % 3]},{a},{i % 7}\n" for i, a in enumerate(amounts))
+    return io.BytesIO(("region,amount,qty\n" + rows).encode())
+
+
+@pytest.mark.parametrize("mode", [None, "stream", "sample"])
+@pytest.mark.parametrize("extreme", [["inf"], ["-inf"], ["inf", "-inf"]])
+def test_template_deck_survives_infinite_values(mode, extreme):
+    amounts = [i * 1.5 for i in range(300)]
+    amounts[5:5 + len(extreme)] = extreme
+    prepared = app.prepare_analysis(upload(amounts), "csv", mode, cache_mode="bypass", fast=True)
+    deck = app.complete_analysis(prepared)
+    text = [s for s in deck["sections"] if not s.get("isChartSlide")]
+    assert len(text) == 8
+    points = " ".join(p for s in text for p in s["points"])
+    assert not re.search(r"\b(nan|inf)\b", points, re.I), points
+    assert "N/A" in points
+
+
+def test_format_number_renders_non_finite_as_na():
+    assert [app.format_number(v) for v in (float("inf"), float("-inf"), float("nan"), 1234.5)] == ["N/A", "N/A", "N/A", "1,234"]
@@ -344,7 +344,7 @@ const App = () => {
     return (
         <div style={{ background: theme?.pageBg || '#ffffff', minHeight: "100vh", fontFamily: THEMES.TEXT_FONT }} className="transition-all duration-300">
             <GlobalFont />
-            <input type="file" onChange={handleFileChange} className="hidden" ref={fileInputRef} accept=".xlsx,.xls,.csv" />
+            <input type="file" onChange={handleFileChange} className="hidden" ref={fileInputRef} accept=".xlsx,.xls,.csv,.parquet,.arrow,.feather" />
             {!isEditorMode ? (
                 <HomePage onFileProcessed={handleFileChange} />
             ) : (
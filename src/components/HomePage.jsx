@@ -167,7 +167,7 @@ const HomePage = ({ onFileProcessed }) => {
                                 type="file" 
                                 ref={fileInputRef} 
                                 onChange={handleFileUpload} 
-                                accept=".csv,.xlsx,.xls" 
+                                accept=".csv,.xlsx,.xls,.parquet,.arrow,.feather" 
                                 className="hidden" 
                             />
                             
@@ -261,7 +261,7 @@ const PresentationEditor = ({
                 onChange={handleFileChange} 
                 className="hidden" 
                 ref={fileInputRef} 
-                accept=".xlsx,.xls,.csv" 
+                accept=".xlsx,.xls,.csv,.parquet,.arrow,.feather" 
             />
             
             {/* Modal */}